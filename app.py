@@ -1,11 +1,22 @@
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+
 import streamlit as st
-import pandas as pd
 import numpy as np
-import pickle
-import shap
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.ensemble import RandomForestClassifier
+import pandas as pd
+from scoring import (FEATURE_SPECS, feature_groups, risk_level as get_risk_level, positive_class_shap,
+                     iter_cohort_chunks, score_chunk, sensitivity_curves)
+from prediction_cache import PredictionCache, quantize_key
+from metrics import RequestTimer, register_cache, stage, start_metrics_server
+from progressive import ProgressiveJob, step_outcome
+from approx_shap import ApproximateShapExplainer
+from cohort_index import DEFAULT_INDEX_PATH, load_index
+from drift import MIN_OBSERVATIONS, PSI_ALERT, PSI_WARNING, monitor_for
+from audit import get_audit_log
+from runtime import get_runtime
+from what_if import WhatIfSession
 
 # 设置页面配置
 st.set_page_config(
@@ -14,279 +25,462 @@ st.set_page_config(
     layout="wide"
 )
 
-# 加载模型和SHAP解释器
-@st.cache_resource
+# 模型包在后台线程中加载和预热，页面不等待加载完成即可显示
+runtime = get_runtime()
+# 使用共享模型存储时，每次运行检查是否发布了新模型（只读取代数计数器）
+runtime.check_for_update()
+
 def load_model():
-    """加载训练好的模型"""
-    with open('rf_model.pkl', 'rb') as f:
-        model = pickle.load(f)
-    return model
+    """等待后台加载完成，返回 (打包森林, TreeSHAP解释器, 特征列, 模型版本)"""
+    if not runtime.ready:
+        with st.spinner("Loading model..."):
+            try:
+                runtime.wait()
+            except FileNotFoundError as e:
+                st.error(f"Model file not found: {e}")
+                st.info("Please run train_model.py first to train the model")
+                st.stop()
+            except Exception as e:
+                st.error(f"Model loading failed: {e}")
+                st.stop()
+    return runtime.snapshot()
+
+@st.cache_resource
+def get_prediction_cache():
+    """所有会话共享的预测/SHAP缓存（统计信息同时作为指标导出）"""
+    cache = PredictionCache(maxsize=2048, ttl=6 * 3600)
+    register_cache(cache)
+    return cache
+
+@st.cache_resource
+def get_metrics_server():
+    """进程内只启动一次的本地 /metrics 端口（环境变量METRICS_PORT，设为0时关闭）"""
+    return start_metrics_server()
+
+metrics_server = get_metrics_server()
 
 @st.cache_resource
-def load_explainer():
-    """加载SHAP解释器"""
-    with open('shap_explainer.pkl', 'rb') as f:
-        explainer = pickle.load(f)
-    return explainer
+def get_explain_executor():
+    """SHAP和图表计算的工作线程（所有会话共享）"""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix='explain')
+
+def wait_for_step(future, slot, label):
+    """
+    等待一个步骤完成，返回 (结果, 异常)
+
+    等待期间定期更新占位元素中的提示；每次更新也是Streamlit检查是否需要重新运行的位置，
+    输入改变时本次运行在这里被打断，不必等到全部步骤完成
+    """
+    start = time.perf_counter()
+    while not future.done():
+        slot.caption(f"⏳ {label}... {time.perf_counter() - start:.1f}s")
+        wait([future], timeout=0.2)
+    return step_outcome(future)
+
+@st.cache_resource(max_entries=2)
+def get_approximate_explainer(model_version, _model, _explainer):
+    """近似SHAP（部分树上的分层抽样估计），按模型版本缓存"""
+    return ApproximateShapExplainer(_model, _explainer)
+
+# 近似SHAP：每个特征95%置信区间半宽的目标（概率单位）和用时上限（秒）
+APPROX_TOLERANCE = 0.01
+APPROX_TIME_BUDGET = 1.0
 
 @st.cache_resource
-def load_feature_info():
-    """加载特征信息"""
-    with open('feature_info.pkl', 'rb') as f:
-        feature_info = pickle.load(f)
-    return feature_info
-
-# 加载模型和解释器
-try:
-    model = load_model()
-    explainer = load_explainer()
-    feature_info = load_feature_info()
-    feature_cols = feature_info['feature_cols']
-except FileNotFoundError as e:
-    st.error(f"Model file not found: {e}")
-    st.info("Please run train_model.py first to train the model")
-    st.stop()
+def get_cohort_index():
+    """预先计算的队列SHAP索引（环境变量COHORT_INDEX，默认cohort_index.arrow；不存在或无法读取时为None）"""
+    path = os.environ.get('COHORT_INDEX', DEFAULT_INDEX_PATH)
+    if not os.path.exists(path):
+        return None
+    try:
+        return load_index(path)
+    except Exception as e:
+        print(f"队列索引 {path} 读取失败，不显示队列背景: {e}")
+        return None
+
+# 相似患者的个数
+N_SIMILAR = 10
+
+CHART_TITLES = {
+    'force': "#### SHAP Force Plot",
+    'waterfall': "#### SHAP Waterfall Plot",
+    'contribution': "#### Feature Contribution",
+}
+
+FEATURE_STEPS = {name: spec['step'] for name, spec in FEATURE_SPECS.items()}
 
 # 标题
 st.title("🏥 Pressure Injuries in Sepsis")
 st.markdown("### Sepsis Risk Score Calculator")
 st.markdown("---")
 
-# 创建两列布局
-col1, col2 = st.columns([1, 1])
+tab_single, tab_cohort = st.tabs(["👤 Single Patient", "📋 Cohort Batch"])
 
-with col1:
-    st.header("📊 Input Features")
-    
-    # 特征变量输入
-    inputs = {}
-    
-    # 第一组特征
-    st.subheader("Vital Signs")
-    inputs['GCS'] = st.number_input("GCS (Glasgow Coma Scale)", min_value=3.0, max_value=15.0, value=15.0, step=0.1)
-    inputs['RR'] = st.number_input("RR (Respiratory Rate, /min)", min_value=0.0, max_value=60.0, value=20.0, step=0.1)
-    inputs['T'] = st.number_input("T (Temperature, °C)", min_value=30.0, max_value=45.0, value=37.0, step=0.1)
-    inputs['NBPS'] = st.number_input("NBPS (Systolic Blood Pressure, mmHg)", min_value=0.0, max_value=300.0, value=120.0, step=0.1)
-    
-    st.subheader("Laboratory Tests")
-    inputs['WBC'] = st.number_input("WBC (White Blood Cell Count, ×10⁹/L)", min_value=0.0, max_value=100.0, value=10.0, step=0.1)
-    inputs['HGB'] = st.number_input("HGB (Hemoglobin, g/dL)", min_value=0.0, max_value=30.0, value=12.0, step=0.1)
-    inputs['ANION_GAP'] = st.number_input("ANION_GAP (Anion Gap, mEq/L)", min_value=0.0, max_value=50.0, value=12.0, step=0.1)
-    inputs['CHLORIDE'] = st.number_input("CHLORIDE (Chloride, mEq/L)", min_value=0.0, max_value=200.0, value=105.0, step=0.1)
-    inputs['SODIUM'] = st.number_input("SODIUM (Sodium, mEq/L)", min_value=0.0, max_value=200.0, value=140.0, step=0.1)
-    inputs['BUN'] = st.number_input("BUN (Blood Urea Nitrogen, mg/dL)", min_value=0.0, max_value=200.0, value=20.0, step=0.1)
-    inputs['CR'] = st.number_input("CR (Creatinine, mg/dL)", min_value=0.0, max_value=20.0, value=1.0, step=0.1)
-    inputs['INRPT'] = st.number_input("INRPT (International Normalized Ratio)", min_value=0.5, max_value=10.0, value=1.0, step=0.1)
-    inputs['BS'] = st.number_input("BS (Blood Sugar, mg/dL)", min_value=0.0, max_value=500.0, value=100.0, step=0.1)
-    
-    st.subheader("Scoring Systems")
-    inputs['SOFA'] = st.number_input("SOFA (Sequential Organ Failure Assessment)", min_value=0.0, max_value=24.0, value=0.0, step=0.1)
-    inputs['SAPSII'] = st.number_input("SAPSII (Simplified Acute Physiology Score II)", min_value=0.0, max_value=200.0, value=30.0, step=0.1)
-    inputs['OASIS'] = st.number_input("OASIS (Oxford Acute Severity of Illness Score)", min_value=0.0, max_value=100.0, value=20.0, step=0.1)
-    
-    st.subheader("Treatment Measures")
-    inputs['BALANCE'] = st.number_input("BALANCE (Fluid Balance, mL)", min_value=-50000.0, max_value=50000.0, value=0.0, step=100.0)
-    inputs['MV'] = st.selectbox("MV (Mechanical Ventilation)", options=[0, 1], format_func=lambda x: "Yes" if x == 1 else "No")
-    inputs['CRRT'] = st.selectbox("CRRT (Continuous Renal Replacement Therapy)", options=[0, 1], format_func=lambda x: "Yes" if x == 1 else "No")
-    inputs['NOR'] = st.selectbox("NOR (Norepinephrine)", options=[0, 1], format_func=lambda x: "Yes" if x == 1 else "No")
-
-with col2:
-    st.header("📈 Prediction Results")
-    
-    # 计算按钮
-    if st.button("🔍 Calculate Sepsis Risk", type="primary", use_container_width=True):
-        # 准备输入数据
-        input_data = pd.DataFrame([inputs])
-        
-        # 确保列顺序正确
-        input_data = input_data[feature_cols]
-        
-        # 预测
-        prediction_proba = model.predict_proba(input_data)[0]
-        risk_score = prediction_proba[1] * 100  # 转换为百分比
-        
-        # 显示风险评分
-        st.markdown("---")
-        st.metric("Sepsis Risk Score", f"{risk_score:.2f}%")
-        
-        # 风险等级
-        if risk_score < 30:
-            risk_level = "Low Risk"
-            risk_color = "🟢"
-        elif risk_score < 60:
-            risk_level = "Medium Risk"
-            risk_color = "🟡"
-        else:
-            risk_level = "High Risk"
-            risk_color = "🔴"
-        
-        st.markdown(f"### {risk_color} Risk Level: **{risk_level}**")
-        
-        # 进度条
-        st.progress(risk_score / 100)
-        
-        # 计算SHAP值
-        st.markdown("---")
-        st.subheader("🔬 SHAP Explanation")
-        
-        with st.spinner("Calculating SHAP values..."):
-            try:
-                shap_values = explainer.shap_values(input_data)
-                
-                # 如果是多类输出，取正类的SHAP值
-                if isinstance(shap_values, list):
-                    shap_values_array = shap_values[1]  # 正类的SHAP值
-                    expected_value = explainer.expected_value[1] if isinstance(explainer.expected_value, (list, np.ndarray)) else explainer.expected_value
+with tab_single:
+    # 创建两列布局
+    col1, col2 = st.columns([1, 1])
+
+    with col1:
+        st.header("📊 Input Features")
+
+        # 特征变量输入（按分组显示）
+        inputs = {}
+        for group, group_features in feature_groups():
+            st.subheader(group)
+            for name in group_features:
+                spec = FEATURE_SPECS[name]
+                if 'options' in spec:
+                    inputs[name] = st.selectbox(spec['label'], options=spec['options'], format_func=lambda x: "Yes" if x == 1 else "No")
                 else:
-                    shap_values_array = shap_values
-                    expected_value = explainer.expected_value
-                
-                # 确保shap_values_array是1维数组
-                if shap_values_array.ndim > 1:
-                    shap_values_1d = shap_values_array[0].flatten()
+                    inputs[name] = st.number_input(spec['label'], min_value=spec['min'], max_value=spec['max'], value=spec['default'], step=spec['step'])
+
+    with col2:
+        st.header("📈 Prediction Results")
+
+        # 图表在浏览器中绘制；勾选后额外用matplotlib导出静态PNG
+        export_png = st.checkbox("Export static PNG plots (matplotlib)", value=False)
+        # what-if模式：保存本会话上一次的逐树结果，修改输入后只重新计算受影响的树
+        what_if = st.checkbox("What-if mode (re-evaluate only trees affected by changed inputs)", value=True)
+        show_sensitivity = st.checkbox("Sensitivity curves (ICE) for every feature", value=True)
+        # 近似SHAP：只在部分树上计算，逐步增加树数直到置信区间足够窄（what-if模式下SHAP已是增量计算，不需要近似）
+        approximate = st.checkbox("Approximate SHAP (subset of trees, with 95% confidence intervals)", value=False)
+
+        # 计算按钮
+        if st.button("🔍 Calculate Sepsis Risk", type="primary", use_container_width=True):
+            # 记录各阶段用时（/metrics直方图，设置TIMING_LOG时写出每次计算的计时日志）
+            with RequestTimer('app', 'calculate'):
+                with stage('load_model'):
+                    model, explainer, feature_cols, model_version = load_model()
+
+                # 准备输入数据（确保列顺序正确）
+                with stage('dataframe'):
+                    input_data = pd.DataFrame([inputs])[feature_cols]
+                # 输入漂移监测（只放入队列，由后台线程计数）
+                drift_monitor = monitor_for(runtime.artifact)
+                if drift_monitor is not None:
+                    drift_monitor.observe(input_data)
+
+                # 按输入步长量化后查询缓存，相同（或步长内相同）的输入直接复用结果；键包含模型版本，发布新模型后不复用旧结果
+                prediction_cache = get_prediction_cache()
+                with stage('cache_lookup'):
+                    cache_key = quantize_key(inputs, feature_cols, FEATURE_STEPS, namespace=model_version)
+                    cached = prediction_cache.get(cache_key)
+
+                # 预测
+                what_if_note = None
+                if cached is not None:
+                    probability = cached['probability']
+                elif what_if:
+                    session = st.session_state.get('what_if_session')
+                    with stage('what_if'):
+                        if session is None or session.forest is not model:
+                            session = WhatIfSession(model, explainer, input_data)
+                            st.session_state['what_if_session'] = session
+                        else:
+                            session.update(input_data)
+                    probability = session.probability
+                    cached = {
+                        'probability': probability,
+                        'shap_values_1d': session.shap_values,
+                        'expected_value': session.expected_value,
+                        'plots': {},
+                    }
+                    prediction_cache.put(cache_key, cached)
+                    what_if_note = (f"What-if: re-evaluated {session.n_recomputed}/{model.n_estimators} trees "
+                                    f"in {session.last_seconds * 1000:.1f} ms")
                 else:
-                    shap_values_1d = shap_values_array.flatten()
-                
-                # 如果长度不匹配，只取前len(feature_cols)个
-                if len(shap_values_1d) != len(feature_cols):
-                    if len(shap_values_1d) > len(feature_cols):
-                        shap_values_1d = shap_values_1d[:len(feature_cols)]
+                    with stage('predict'):
+                        probability = float(model.predict_proba(input_data)[0][1])
+                risk_score = probability * 100  # 转换为百分比
+                # 风险等级
+                risk_level, risk_color = get_risk_level(risk_score)
+
+                # SHAP值、各图表、静态图片和敏感性曲线在工作线程中依次计算，主线程按完成顺序填入占位元素；
+                # 输入改变时Streamlit打断本次运行，finally中取消尚未开始的步骤
+                feature_values = input_data.iloc[0].values
+
+                approx_explainer = get_approximate_explainer(model_version, model, explainer) if approximate else None
+
+                def compute_shap(results):
+                    # 缓存中的精确结果总是可以直接使用；近似结果只在近似模式下使用
+                    if cached is not None and (approximate or not cached.get('approximate')):
+                        return cached
+                    if approximate:
+                        with stage('shap_values'):
+                            result = approx_explainer.shap_values(input_data, tolerance=APPROX_TOLERANCE,
+                                                                  time_budget=APPROX_TIME_BUDGET)
+                        entry = {
+                            'probability': probability,
+                            'shap_values_1d': result.values[0],
+                            'expected_value': result.expected_value,
+                            'plots': {},
+                            'approximate': not result.exact,
+                            'shap_half_width': result.half_width[0],
+                            'n_trees_used': int(result.n_trees_used[0]),
+                        }
                     else:
-                        # 如果SHAP值太少，用0填充
-                        shap_values_1d = np.pad(shap_values_1d, (0, len(feature_cols) - len(shap_values_1d)), 'constant')
-                
-                # 确保expected_value是标量
-                if isinstance(expected_value, (list, np.ndarray)):
-                    expected_value = float(expected_value[0] if len(expected_value) > 0 else expected_value)
-                else:
-                    expected_value = float(expected_value)
-                
-                # 创建SHAP力图
-                st.markdown("#### SHAP Force Plot")
-                try:
-                    # 使用新版本的SHAP API
-                    # 创建Explanation对象用于force plot
-                    explanation_force = shap.Explanation(
-                        values=shap_values_1d,
-                        base_values=expected_value,
-                        data=input_data.iloc[0].values,
-                        feature_names=feature_cols
-                    )
-                    
-                    # 尝试使用shap.plots.force (新API v0.20+)
-                    try:
-                        plt.figure(figsize=(12, 4))
-                        shap.plots.force(explanation_force, matplotlib=True, show=False)
-                        st.pyplot(plt)
-                        plt.close()
-                    except AttributeError:
-                        # 如果shap.plots不存在，尝试旧API
-                        try:
-                            plt.figure(figsize=(12, 4))
-                            shap.force_plot(
-                                expected_value,
-                                shap_values_1d,
-                                input_data.iloc[0],
-                                matplotlib=True,
-                                show=False
-                            )
-                            st.pyplot(plt)
-                            plt.close()
-                        except:
-                            raise Exception("使用替代可视化")
-                    except Exception:
-                        raise Exception("使用替代可视化")
-                        
-                except Exception as e:
-                    # 使用条形图替代
-                    min_len = min(len(feature_cols), len(shap_values_1d))
-                    shap_df_temp = pd.DataFrame({
-                        'Feature': feature_cols[:min_len],
-                        'SHAP Value': shap_values_1d[:min_len]
-                    })
-                    shap_df_temp = shap_df_temp.sort_values('SHAP Value', key=abs, ascending=False)
-                    fig, ax = plt.subplots(figsize=(10, 8))
-                    colors = ['red' if x < 0 else 'blue' for x in shap_df_temp['SHAP Value']]
-                    ax.barh(shap_df_temp['Feature'], shap_df_temp['SHAP Value'], color=colors)
-                    ax.set_xlabel('SHAP Value', fontsize=12)
-                    ax.set_title('SHAP Force Plot - Feature Contribution', fontsize=14, fontweight='bold')
-                    ax.axvline(x=0, color='black', linestyle='--', linewidth=0.5)
-                    ax.grid(axis='x', alpha=0.3)
-                    st.pyplot(fig)
-                    plt.close()
-                
-                # 创建SHAP瀑布图
-                st.markdown("#### SHAP Waterfall Plot")
+                        # 取正类的SHAP值和基准值
+                        shap_matrix, expected_value = positive_class_shap(explainer, input_data)
+                        entry = {
+                            'probability': probability,
+                            'shap_values_1d': shap_matrix[0, :len(feature_cols)],
+                            'expected_value': expected_value,
+                            'plots': {},
+                        }
+                    prediction_cache.put(cache_key, entry)
+                    return entry
+
+                def build_force_chart(results):
+                    from shap_charts import force_chart
+                    entry = results['shap']
+                    with stage('chart_build'):
+                        return force_chart(entry['shap_values_1d'], entry['expected_value'], feature_values, feature_cols)
+
+                def build_waterfall_chart(results):
+                    from shap_charts import waterfall_chart
+                    entry = results['shap']
+                    with stage('chart_build'):
+                        return waterfall_chart(entry['shap_values_1d'], entry['expected_value'], feature_values, feature_cols)
+
+                def build_contribution(results):
+                    from shap_charts import contribution_chart
+                    entry = results['shap']
+                    shap_values_1d = entry['shap_values_1d']
+                    with stage('chart_build'):
+                        shap_df = pd.DataFrame({
+                            'Feature': feature_cols,
+                            'SHAP Value': shap_values_1d,
+                            'Feature Value': feature_values
+                        })
+                        note = None
+                        if entry.get('approximate'):
+                            shap_df.insert(2, '± 95% CI', np.round(entry['shap_half_width'], 4))
+                            note = (f"Approximate SHAP from {entry['n_trees_used']}/{model.n_estimators} trees; "
+                                    f"± is the 95% confidence interval of each value")
+                        shap_df = shap_df.sort_values('SHAP Value', key=abs, ascending=False)
+                        shap_df['SHAP Value'] = shap_df['SHAP Value'].round(4)
+                        shap_df['Feature Value'] = shap_df['Feature Value'].round(2)
+                        return contribution_chart(shap_values_1d, feature_values, feature_cols), shap_df, note
+
+                cohort_index = get_cohort_index()
+                if cohort_index is not None and cohort_index.feature_cols != feature_cols:
+                    cohort_index = None
+
+                def compute_cohort_context(results):
+                    # 队列背景：SHAP贡献的队列百分位和最相似的历史患者（查询预先计算的索引）
+                    shap_values_1d = results['shap']['shap_values_1d']
+                    with stage('cohort_lookup'):
+                        percentiles = cohort_index.percentiles(shap_values_1d)
+                        neighbours = cohort_index.similar(feature_values, k=N_SIMILAR)
+                    with stage('chart_build'):
+                        percentile_df = pd.DataFrame({
+                            'Feature': feature_cols,
+                            'SHAP Value': shap_values_1d,
+                            'Cohort Percentile': percentiles,
+                        })
+                        percentile_df = percentile_df.sort_values('SHAP Value', key=abs, ascending=False)
+                        percentile_df['SHAP Value'] = percentile_df['SHAP Value'].round(4)
+                        percentile_df['Cohort Percentile'] = percentile_df['Cohort Percentile'].round(1)
+                        neighbours['Distance'] = neighbours['Distance'].round(3)
+                        neighbours['Risk Score (%)'] = neighbours['Risk Score (%)'].round(2)
+                        return percentile_df, neighbours
+
+                def render_static_plots(results):
+                    # 静态图片导出（matplotlib，渲染结果随缓存条目保存）
+                    from shap_plots import render_force_plot, render_waterfall_plot
+                    entry = results['shap']
+                    plots = entry.setdefault('plots', {})
+                    with stage('matplotlib_render'):
+                        if 'force' not in plots:
+                            plots['force'] = render_force_plot(entry['shap_values_1d'], entry['expected_value'],
+                                                               feature_values, feature_cols)
+                        if 'waterfall' not in plots:
+                            plots['waterfall'] = render_waterfall_plot(entry['shap_values_1d'], entry['expected_value'],
+                                                                       feature_values, feature_cols)
+                    return plots
+
+                def compute_sensitivity(results):
+                    # 敏感性分析：20个特征的网格（约20×50行）一次批量评分，结果随缓存条目保存
+                    from shap_charts import sensitivity_chart
+                    entry = results.get('shap')
+                    curves = entry.get('sensitivity') if entry is not None else None
+                    if curves is None:
+                        curves = sensitivity_curves(model, inputs, feature_cols, cache=prediction_cache,
+                                                    steps=FEATURE_STEPS, namespace=model_version)
+                        if entry is not None:
+                            entry['sensitivity'] = curves
+                    with stage('chart_build'):
+                        return sensitivity_chart(curves)
+
+                # (步骤名, 计算函数, 依赖的步骤, 等待时的提示, 失败时的提示)
+                steps = [
+                    ('shap', compute_shap, (), None, "SHAP calculation failed"),
+                    ('force', build_force_chart, ('shap',), "Calculating SHAP values", "SHAP calculation failed"),
+                    ('waterfall', build_waterfall_chart, ('shap',), "Building waterfall plot", "Waterfall plot failed"),
+                    ('contribution', build_contribution, ('shap',), "Building contribution chart", "Contribution chart failed"),
+                ]
+                if cohort_index is not None:
+                    steps.append(('cohort', compute_cohort_context, ('shap',), "Looking up cohort context",
+                                  "Cohort context failed"))
+                if show_sensitivity:
+                    steps.append(('sensitivity', compute_sensitivity, (), "Scoring sensitivity grid",
+                                  "Sensitivity analysis failed"))
+                if export_png:
+                    steps.append(('png', render_static_plots, ('shap',), "Rendering static PNG plots",
+                                  "Static plot export failed"))
+
+                job = ProgressiveJob((name, func, requires) for name, func, requires, _, _ in steps)
+                audit_log = get_audit_log()
+                if audit_log is not None:
+                    # SHAP步骤结束（成功、失败或输入改变后被取消）时记录本次评分，每次评分恰好记录一次；
+                    # 在第一次调用st（Streamlit可能在此打断本次运行）之前注册
+                    def audit_score(future):
+                        entry, _ = step_outcome(future)
+                        audit_log.record('app', model_version, feature_cols, feature_values, probability, risk_level,
+                                         None if entry is None else entry['shap_values_1d'],
+                                         None if entry is None else entry['expected_value'],
+                                         approximate=bool(entry and entry.get('approximate')))
+                    job.futures['shap'].add_done_callback(audit_score)
+                job.start(get_explain_executor())
+
+                if what_if_note:
+                    st.caption(what_if_note)
+                # 显示风险评分
+                st.markdown("---")
+                st.metric("Sepsis Risk Score", f"{risk_score:.2f}%")
+                st.markdown(f"### {risk_color} Risk Level: **{risk_level}**")
+
+                # 进度条
+                st.progress(risk_score / 100)
+
+                # 占位元素按页面布局顺序创建
+                st.markdown("---")
+                st.subheader("🔬 SHAP Explanation")
+                slots = {name: st.empty() for name in ['force', 'waterfall', 'contribution']}
+                if export_png:
+                    slots['png'] = st.empty()
+                if cohort_index is not None:
+                    st.markdown("---")
+                    st.subheader("👥 Cohort Context")
+                    st.caption(f"Compared with {len(cohort_index)} patients in "
+                               f"{cohort_index.metadata.get('source', 'the reference cohort')}")
+                    if cohort_index.model_version != model_version:
+                        st.caption("⚠️ The cohort index was built with a different model version; "
+                                   "rebuild it with cohort_index.py for comparable percentiles")
+                    slots['cohort'] = st.empty()
+                if show_sensitivity:
+                    st.markdown("---")
+                    st.subheader("📉 Sensitivity Analysis")
+                    st.caption("Risk as each feature varies over its input range, with the other inputs held at "
+                               "their current values (the dot marks the current value)")
+                    slots['sensitivity'] = st.empty()
+
+                shown_errors = set()
                 try:
-                    # 创建Explanation对象
-                    explanation = shap.Explanation(
-                        values=shap_values_1d,
-                        base_values=expected_value,
-                        data=input_data.iloc[0].values,
-                        feature_names=feature_cols
-                    )
-                    plt.figure(figsize=(12, 8))
-                    # 尝试新API
-                    try:
-                        shap.plots.waterfall(explanation, show=False)
-                    except AttributeError:
-                        # 如果新API不存在，使用旧API
-                        shap.waterfall_plot(explanation, show=False)
-                    st.pyplot(plt)
-                    plt.close()
-                except Exception as e:
-                    # 使用累积条形图替代瀑布图
-                    min_len = min(len(feature_cols), len(shap_values_1d))
-                    shap_df_temp = pd.DataFrame({
-                        'Feature': feature_cols[:min_len],
-                        'SHAP Value': shap_values_1d[:min_len]
-                    })
-                    shap_df_temp = shap_df_temp.sort_values('SHAP Value', ascending=False)
-                    shap_df_temp['Cumulative'] = shap_df_temp['SHAP Value'].cumsum() + expected_value
-                    
-                    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 10))
-                    
-                    # 上：SHAP值条形图
-                    colors = ['red' if x < 0 else 'blue' for x in shap_df_temp['SHAP Value']]
-                    ax1.bar(range(len(shap_df_temp)), shap_df_temp['SHAP Value'], color=colors)
-                    ax1.set_xticks(range(len(shap_df_temp)))
-                    ax1.set_xticklabels(shap_df_temp['Feature'], rotation=45, ha='right')
-                    ax1.set_ylabel('SHAP Value', fontsize=12)
-                    ax1.set_title('SHAP Waterfall Plot - Feature Contribution', fontsize=14, fontweight='bold')
-                    ax1.axhline(y=0, color='black', linestyle='--', linewidth=0.5)
-                    ax1.grid(axis='y', alpha=0.3)
-                    
-                    # 下：累积值
-                    ax2.plot(range(len(shap_df_temp)), shap_df_temp['Cumulative'], marker='o', linewidth=2, markersize=6)
-                    ax2.axhline(y=expected_value, color='green', linestyle='--', linewidth=1, label=f'Base Value: {expected_value:.4f}')
-                    ax2.set_xticks(range(len(shap_df_temp)))
-                    ax2.set_xticklabels(shap_df_temp['Feature'], rotation=45, ha='right')
-                    ax2.set_ylabel('Cumulative SHAP Value', fontsize=12)
-                    ax2.set_title('Cumulative SHAP Value Change', fontsize=14, fontweight='bold')
-                    ax2.legend()
-                    ax2.grid(alpha=0.3)
-                    
-                    plt.tight_layout()
-                    st.pyplot(fig)
-                    plt.close()
-                
-                # 特征重要性表格
-                st.markdown("#### Feature Contribution")
-                min_len = min(len(feature_cols), len(shap_values_1d), len(input_data.iloc[0].values))
-                shap_df = pd.DataFrame({
-                    'Feature': feature_cols[:min_len],
-                    'SHAP Value': shap_values_1d[:min_len],
-                    'Feature Value': input_data.iloc[0].values[:min_len]
-                })
-                shap_df = shap_df.sort_values('SHAP Value', key=abs, ascending=False)
-                shap_df['SHAP Value'] = shap_df['SHAP Value'].round(4)
-                shap_df['Feature Value'] = shap_df['Feature Value'].round(2)
-                st.dataframe(shap_df, use_container_width=True, hide_index=True)
-                
-            except Exception as e:
-                st.error(f"SHAP calculation failed: {e}")
-                import traceback
-                st.code(traceback.format_exc())
+                    for name, _, _, waiting_label, failure_label in steps:
+                        if name not in slots:
+                            continue
+                        slot = slots[name]
+                        result, error = wait_for_step(job.futures[name], slot, waiting_label)
+                        if error is not None:
+                            # 依赖的步骤失败时只显示一次错误
+                            if id(error) in shown_errors:
+                                slot.empty()
+                                continue
+                            shown_errors.add(id(error))
+                            with slot.container():
+                                st.error(f"{failure_label}: {error}")
+                                st.code("".join(traceback.format_exception(type(error), error, error.__traceback__)))
+                            continue
+                        with stage('st_transfer'):
+                            with slot.container():
+                                if name in CHART_TITLES:
+                                    st.markdown(CHART_TITLES[name])
+                                if name == 'contribution':
+                                    chart, shap_df, note = result
+                                    st.altair_chart(chart, use_container_width=True)
+                                    st.dataframe(shap_df, use_container_width=True, hide_index=True)
+                                    if note:
+                                        st.caption(note)
+                                elif name == 'png':
+                                    export_col1, export_col2 = st.columns(2)
+                                    export_col1.download_button("💾 Force Plot (PNG)", data=result['force'],
+                                                                file_name="shap_force_plot.png", mime="image/png", on_click="ignore")
+                                    export_col2.download_button("💾 Waterfall Plot (PNG)", data=result['waterfall'],
+                                                                file_name="shap_waterfall_plot.png", mime="image/png", on_click="ignore")
+                                elif name == 'cohort':
+                                    percentile_df, neighbours = result
+                                    st.markdown("#### SHAP Contribution Percentile")
+                                    st.dataframe(percentile_df, use_container_width=True, hide_index=True)
+                                    st.markdown(f"#### {len(neighbours)} Most Similar Patients")
+                                    if cohort_index.has_outcome:
+                                        outcomes = neighbours['Outcome'].dropna()
+                                        st.caption(f"{int(outcomes.sum())}/{len(outcomes)} similar patients had the outcome "
+                                                   f"(cohort rate {np.nanmean(cohort_index.outcome):.1%})")
+                                    st.dataframe(neighbours, use_container_width=True, hide_index=True)
+                                elif name == 'sensitivity':
+                                    st.altair_chart(result)
+                                else:
+                                    st.altair_chart(result, use_container_width=True)
+                finally:
+                    job.cancel()
+
+with tab_cohort:
+    st.header("📋 Cohort Batch Scoring")
+    st.markdown(f"Upload a CSV or Parquet file containing the columns: `{', '.join(runtime.feature_cols or FEATURE_SPECS)}`")
+
+    uploaded_file = st.file_uploader("Cohort file", type=['csv', 'parquet'])
+    batch_col1, batch_col2 = st.columns([1, 1])
+    with batch_col1:
+        chunk_size = st.number_input("Rows per batch", min_value=100, max_value=100000, value=5000, step=100)
+    with batch_col2:
+        explain_batch = st.checkbox("Include top SHAP drivers", value=True)
+
+    if uploaded_file is not None and st.button("📥 Score Cohort", type="primary", use_container_width=True):
+        model, explainer, feature_cols, model_version = load_model()
+        drift_monitor = monitor_for(runtime.artifact)
+        progress_bar = st.progress(0.0, text="Scoring cohort...")
+        table_placeholder = st.empty()
+        results = []
+        n_scored = 0
+        try:
+            for chunk, progress in iter_cohort_chunks(uploaded_file, uploaded_file.name, int(chunk_size)):
+                missing_cols = [col for col in feature_cols if col not in chunk.columns]
+                if missing_cols:
+                    st.error(f"Missing feature columns: {', '.join(missing_cols)}")
+                    st.stop()
+
+                results.append(score_chunk(model, explainer, chunk, feature_cols, explain=explain_batch,
+                                           audit_log=get_audit_log(), model_version=model_version))
+                if drift_monitor is not None:
+                    drift_monitor.observe(chunk[feature_cols])
+                n_scored += len(chunk)
+                progress_bar.progress(progress, text=f"Scored {n_scored} patients...")
+                # 逐块显示最新结果
+                table_placeholder.dataframe(results[-1], use_container_width=True, hide_index=True)
+        except Exception as e:
+            st.error(f"Cohort scoring failed: {e}")
+            import traceback
+            st.code(traceback.format_exc())
+            st.stop()
+
+        if results:
+            cohort_result = pd.concat(results, ignore_index=True)
+            progress_bar.progress(1.0, text=f"Done: {len(cohort_result)} patients scored")
+            level_counts = cohort_result['Risk Level'].value_counts()
+            count_cols = st.columns(3)
+            for count_col, level in zip(count_cols, ["Low Risk", "Medium Risk", "High Risk"]):
+                count_col.metric(level, int(level_counts.get(level, 0)))
+            table_placeholder.dataframe(cohort_result, use_container_width=True, hide_index=True)
+            st.download_button(
+                "💾 Download Results (CSV)",
+                data=cohort_result.to_csv(index=False).encode('utf-8'),
+                file_name="cohort_risk_scores.csv",
+                mime="text/csv",
+            )
+        else:
+            progress_bar.empty()
+            st.warning("The uploaded file contains no rows")
 
 # 侧边栏信息
 with st.sidebar:
@@ -307,6 +501,7 @@ with st.sidebar:
     1. Enter patient features on the left
     2. Click "Calculate Sepsis Risk" button
     3. View risk score and SHAP visualizations
+    4. Or upload a CSV/Parquet file in the "Cohort Batch" tab to score a whole cohort
     
     **Disclaimer:**
     - This tool is for research purposes only
@@ -317,6 +512,30 @@ with st.sidebar:
     st.markdown("---")
     st.markdown("**Development Info**")
     st.caption("Trained with optimal Random Forest parameters")
+    model_status = runtime.status()
+    if model_status['status'] == 'ready':
+        st.caption(f"Model: ready ({model_status['n_estimators']} trees, version {model_status['model_version']}, "
+                   f"loaded in {model_status['load_seconds']:.1f}s)")
+        if 'generation' in model_status:
+            st.caption(f"Shared model store: generation {model_status['generation']}")
+    else:
+        st.caption(f"Model: {model_status['status']}")
+    drift_monitor = monitor_for(runtime.artifact)
+    if drift_monitor is not None:
+        n_recent = drift_monitor.recent_observations()
+        if n_recent >= MIN_OBSERVATIONS:
+            top = drift_monitor.scores().sort_values('PSI', ascending=False).iloc[0]
+            status = "🔴" if top['PSI'] > PSI_ALERT else "🟡" if top['PSI'] > PSI_WARNING else "🟢"
+            st.caption(f"Input drift {status}: highest PSI {top['PSI']:.3f} ({top['Feature']}) over the last "
+                       f"{n_recent} inputs")
+        else:
+            st.caption(f"Input drift: collecting ({n_recent}/{MIN_OBSERVATIONS} recent inputs)")
+    cache_stats = get_prediction_cache().stats()
+    st.caption(f"Prediction cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+               f"({cache_stats['size']}/{cache_stats['maxsize']} entries)")
+    if metrics_server is not None:
+        metrics_host, metrics_port = metrics_server.server_address[:2]
+        st.caption(f"Metrics: http://{metrics_host}:{metrics_port}/metrics")
 
 # 页脚
 st.markdown("---")
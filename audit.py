@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+预测审计日志：每次给出的评分都记录输入、概率、风险等级、SHAP值和模型版本
+
+评分路径只把记录放入有界队列，后台线程按批（达到batch_size条或每flush_interval秒）
+写入本地SQLite数据库（WAL模式，多个进程可以同时写入同一个文件）。表只允许插入，
+UPDATE/DELETE由触发器拒绝。队列已满时调用方最多等待put_timeout秒（计入背压指标），
+仍然放不进时丢弃并计数；进程退出时（atexit）写完队列中的全部记录。
+
+环境变量AUDIT_LOG指定数据库路径（默认audit_log.sqlite，设为空字符串时不记录）。
+
+用法（查看最近的记录）:
+    python audit.py --db audit_log.sqlite --last 20
+"""
+import argparse
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from metrics import Counter, Histogram, REGISTRY
+
+DEFAULT_AUDIT_PATH = 'audit_log.sqlite'
+
+AUDIT_ENQUEUED = REGISTRY.register(Counter(
+    'sepsis_audit_enqueued_total', 'Audit records handed to the background writer'))
+AUDIT_WRITTEN = REGISTRY.register(Counter(
+    'sepsis_audit_written_total', 'Audit records committed to the audit database'))
+AUDIT_DROPPED = REGISTRY.register(Counter(
+    'sepsis_audit_dropped_total', 'Audit records dropped because the queue stayed full'))
+AUDIT_BACKPRESSURE = REGISTRY.register(Counter(
+    'sepsis_audit_backpressure_total', 'Audit submissions that had to wait for queue space'))
+AUDIT_WRITE_ERRORS = REGISTRY.register(Counter(
+    'sepsis_audit_write_errors_total', 'Failed audit batch writes (retried on the next flush)'))
+AUDIT_FLUSH_SECONDS = REGISTRY.register(Histogram(
+    'sepsis_audit_flush_seconds', 'Time to commit one batch of audit records'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT NOT NULL,
+    source TEXT NOT NULL,
+    model_version TEXT,
+    probability REAL NOT NULL,
+    risk_level TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    shap_values TEXT,
+    expected_value REAL,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS predictions_ts ON predictions (ts);
+CREATE TRIGGER IF NOT EXISTS predictions_no_update BEFORE UPDATE ON predictions
+BEGIN SELECT RAISE(ABORT, 'audit log is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS predictions_no_delete BEFORE DELETE ON predictions
+BEGIN SELECT RAISE(ABORT, 'audit log is append-only'); END;
+"""
+_INSERT = ("INSERT INTO predictions (ts, source, model_version, probability, risk_level, inputs, "
+           "shap_values, expected_value, details) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+_STOP = object()
+
+
+def _timestamp():
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+
+
+def _vector(feature_cols, values):
+    return json.dumps(dict(zip(feature_cols, map(float, values))))
+
+
+def connect(path):
+    """打开审计数据库（WAL模式，不存在时建表）"""
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+class AuditLog:
+    """通过有界队列交给后台线程批量写入的审计日志"""
+
+    def __init__(self, path=DEFAULT_AUDIT_PATH, batch_size=256, flush_interval=0.5, queue_size=10000,
+                 put_timeout=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        # 队列中的每一项是一组记录（单个患者为1条，批量评分为一个数据块）
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        # 在调用方线程中建表，数据库无法打开时立即报错
+        connect(path).close()
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, source, model_version, feature_cols, inputs, probability, risk_level,
+               shap_values=None, expected_value=None, **details):
+        """记录一次评分（不等待写入）"""
+        row = (_timestamp(), source, model_version, float(probability), risk_level,
+               _vector(feature_cols, inputs),
+               None if shap_values is None else _vector(feature_cols, shap_values),
+               None if expected_value is None else float(expected_value),
+               json.dumps(details, ensure_ascii=False) if details else None)
+        self._put([row])
+
+    def record_batch(self, source, model_version, feature_cols, X, probabilities, risk_levels,
+                     shap_matrix=None, expected_value=None, **details):
+        """记录一批评分（作为队列中的一项）"""
+        ts = _timestamp()
+        expected_value = None if expected_value is None else float(expected_value)
+        details = json.dumps(details, ensure_ascii=False) if details else None
+        rows = [(ts, source, model_version, float(p), level, _vector(feature_cols, x),
+                 None if shap_matrix is None else _vector(feature_cols, shap_matrix[i]), expected_value, details)
+                for i, (x, p, level) in enumerate(zip(X, probabilities, risk_levels))]
+        if rows:
+            self._put(rows)
+
+    def _put(self, rows):
+        if self._closed:
+            # 关闭之后的记录直接写入
+            self._write_now(rows)
+            return
+        try:
+            self._queue.put_nowait(rows)
+        except queue.Full:
+            AUDIT_BACKPRESSURE.inc()
+            try:
+                self._queue.put(rows, timeout=self.put_timeout)
+            except queue.Full:
+                AUDIT_DROPPED.inc(len(rows))
+                print(f"审计日志队列已满，丢弃 {len(rows)} 条记录")
+                return
+        AUDIT_ENQUEUED.inc(len(rows))
+
+    def _run(self):
+        conn = connect(self.path)
+        pending = []
+        stopping = False
+        flushed = []
+        failures = 0
+        while True:
+            deadline = time.monotonic() + self.flush_interval
+            while len(pending) < self.batch_size and not stopping:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    flushed.append(item)
+                    break
+                else:
+                    pending.extend(item)
+            if stopping:
+                # 停止前取出队列中剩余的全部记录
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, threading.Event):
+                        flushed.append(item)
+                    elif item is not _STOP:
+                        pending.extend(item)
+            if pending:
+                try:
+                    self._insert(conn, pending)
+                except sqlite3.Error as e:
+                    AUDIT_WRITE_ERRORS.inc()
+                    print(f"审计日志写入失败（{len(pending)}条记录，稍后重试）: {e}")
+                    failures += 1
+                    # 持续失败时待写记录不超过队列容量；停止时最多重试3次
+                    limit = 0 if stopping and failures >= 3 else self._queue.maxsize
+                    if len(pending) > limit:
+                        AUDIT_DROPPED.inc(len(pending) - limit)
+                        pending = pending[len(pending) - limit:]
+                    if pending:
+                        time.sleep(0.1)
+                        continue
+                else:
+                    pending = []
+                    failures = 0
+            if not pending:
+                for event in flushed:
+                    event.set()
+                flushed = []
+                if stopping:
+                    break
+        conn.close()
+
+    @staticmethod
+    def _insert(conn, rows):
+        start = time.perf_counter()
+        with conn:
+            conn.executemany(_INSERT, rows)
+        AUDIT_FLUSH_SECONDS.observe(time.perf_counter() - start)
+        AUDIT_WRITTEN.inc(len(rows))
+
+    def _write_now(self, rows):
+        conn = connect(self.path)
+        try:
+            self._insert(conn, rows)
+        finally:
+            conn.close()
+
+    def flush(self, timeout=None):
+        """等待此前放入队列的记录全部写入，返回是否在timeout内完成"""
+        if self._closed:
+            return True
+        event = threading.Event()
+        self._queue.put(event)
+        return event.wait(timeout)
+
+    def close(self, timeout=30):
+        """写完队列中的全部记录后停止后台线程（进程退出时自动调用）"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def collect(self):
+        return [
+            ('sepsis_audit_queue_depth', 'gauge', 'Audit record groups waiting for the background writer',
+             [((), self.queue_depth())]),
+            ('sepsis_audit_queue_capacity', 'gauge', 'Maximum number of queued audit record groups',
+             [((), self._queue.maxsize)]),
+        ]
+
+
+_audit_log = None
+_audit_lock = threading.Lock()
+
+
+def get_audit_log():
+    """进程内共享的审计日志（环境变量AUDIT_LOG为空字符串时返回None）"""
+    global _audit_log
+    path = os.environ.get('AUDIT_LOG', DEFAULT_AUDIT_PATH)
+    if not path:
+        return None
+    with _audit_lock:
+        if _audit_log is None:
+            _audit_log = AuditLog(path)
+            REGISTRY.register_collector(_audit_log.collect)
+        return _audit_log
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show recent entries of the prediction audit log")
+    parser.add_argument('--db', default=os.environ.get('AUDIT_LOG') or DEFAULT_AUDIT_PATH)
+    parser.add_argument('--last', type=int, default=20, help="显示最近的记录数")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    total, first, last = conn.execute("SELECT COUNT(*), MIN(ts), MAX(ts) FROM predictions").fetchone()
+    print(f"{args.db}: {total}条记录 ({first} ~ {last})")
+    rows = conn.execute("SELECT id, ts, source, model_version, probability, risk_level, shap_values IS NOT NULL "
+                        "FROM predictions ORDER BY id DESC LIMIT ?", (args.last,)).fetchall()
+    for row_id, ts, source, model_version, probability, level, has_shap in reversed(rows):
+        print(f"  #{row_id} {ts} {source:<8} 模型 {model_version} 概率 {probability:.4f} {level}"
+              f"{'' if has_shap else ' (无SHAP)'}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+批量生成每个患者的SHAP报告图（力图 + 瀑布图）
+
+1. 一次向量化调用计算尚未生成报告的患者的SHAP值和风险评分；
+2. 用进程池并行绘图：工作进程通过fork以写时复制方式继承已加载的模型和SHAP矩阵，不重复加载或传输；
+3. 每个工作进程只创建一个图形，逐个患者更新图中的条形、文字和参考线后保存，不反复创建/销毁图形；
+4. 逐个写出PNG，或按块写出多页PDF；已完成的文件会被跳过（不重新计算SHAP，也不重复记录审计日志），
+   中断后重新运行即可继续。
+
+用法:
+    python batch_shap_images.py --rows 0:500 --format png --workers 4 --output-dir shap_reports
+    python batch_shap_images.py --format pdf --chunk-size 100 --metrics-file shap_reports.prom
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from audit import get_audit_log
+from drift import monitor_for
+from metrics import STAGE_SECONDS, stage, write_textfile
+from scoring import risk_levels
+
+POSITIVE_COLOR = '#ff0051'
+NEGATIVE_COLOR = '#008bfb'
+
+# 工作进程中共享的任务数据（fork时直接继承）和复用的图形
+_job = None
+_report_figure = None
+
+
+class PatientReportFigure:
+    """可复用的单患者SHAP报告图：上方为力图条带，下方为瀑布图"""
+
+    def __init__(self, n_features, figsize=(10, 9)):
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        from matplotlib.patches import Rectangle
+
+        self.n_features = n_features
+        self.fig, (self.ax_force, self.ax_waterfall) = plt.subplots(
+            2, 1, figsize=figsize, gridspec_kw={'height_ratios': [1, 5]})
+        self.fig.subplots_adjust(left=0.22, right=0.95, hspace=0.25)
+        self.title = self.fig.suptitle('', fontsize=14, fontweight='bold')
+
+        # 力图：每个特征一段
+        self.force_patches = [self.ax_force.add_patch(Rectangle((0, 0.2), 0, 0.6, linewidth=0.5, edgecolor='white'))
+                              for _ in range(n_features)]
+        self.force_labels = [self.ax_force.text(0, 0.95, '', ha='center', va='bottom', fontsize=7)
+                             for _ in range(n_features)]
+        self.ax_force.set_ylim(0, 1.4)
+        self.ax_force.set_yticks([])
+        for side in ('left', 'right', 'top'):
+            self.ax_force.spines[side].set_visible(False)
+
+        # 瀑布图：每个特征一行
+        self.waterfall_patches = [self.ax_waterfall.add_patch(Rectangle((0, 0), 0, 0.7)) for _ in range(n_features)]
+        self.waterfall_labels = [self.ax_waterfall.text(0, 0, '', va='center', fontsize=8) for _ in range(n_features)]
+        self.ax_waterfall.set_ylim(-0.6, n_features - 0.4)
+        self.ax_waterfall.set_yticks(range(n_features))
+        self.ax_waterfall.grid(axis='x', alpha=0.3)
+        for side in ('right', 'top'):
+            self.ax_waterfall.spines[side].set_visible(False)
+
+        self.base_lines = [ax.axvline(0, color='gray', linestyle='--', linewidth=1)
+                           for ax in (self.ax_force, self.ax_waterfall)]
+        self.output_lines = [ax.axvline(0, color='black', linestyle='-', linewidth=1)
+                             for ax in (self.ax_force, self.ax_waterfall)]
+        self.output_text = self.ax_force.text(0, 1.25, '', ha='center', va='bottom', fontsize=9, fontweight='bold')
+
+    def update(self, shap_values_1d, expected_value, feature_values, feature_cols, title):
+        """按一个患者的SHAP值更新全部图元"""
+        shap_values_1d = np.asarray(shap_values_1d, dtype=float)
+        output = expected_value + shap_values_1d.sum()
+        labels = [f"{name} = {value:g}" for name, value in zip(feature_cols, feature_values)]
+        colors = np.where(shap_values_1d >= 0, POSITIVE_COLOR, NEGATIVE_COLOR)
+        self.title.set_text(title)
+
+        # 力图：正贡献从输出值向左依次排列，负贡献向右
+        order = np.argsort(-np.abs(shap_values_1d), kind='stable')
+        pos_cursor, neg_cursor = output, output
+        total_width = np.abs(shap_values_1d).sum() or 1.0
+        for rank, i in enumerate(order):
+            value = shap_values_1d[i]
+            if value >= 0:
+                start, pos_cursor = pos_cursor - value, pos_cursor - value
+            else:
+                start, neg_cursor = neg_cursor, neg_cursor - value
+            patch = self.force_patches[rank]
+            patch.set_x(start)
+            patch.set_width(abs(value))
+            patch.set_facecolor(colors[i])
+            label = self.force_labels[rank]
+            label.set_x(start + abs(value) / 2)
+            label.set_text(feature_cols[i] if rank < 5 and abs(value) > 0.05 * total_width else '')
+
+        # 瀑布图：最重要的特征在顶部，自下而上从基准值累加到输出值
+        cursor = expected_value
+        for rank, i in enumerate(order[::-1]):
+            value = shap_values_1d[i]
+            start, end = cursor, cursor + value
+            cursor = end
+            patch = self.waterfall_patches[rank]
+            patch.set_xy((min(start, end), rank - 0.35))
+            patch.set_width(abs(value))
+            patch.set_facecolor(colors[i])
+            text = self.waterfall_labels[rank]
+            text.set_position((max(start, end), rank))
+            text.set_text(f" {value:+.4f}")
+        self.ax_waterfall.set_yticklabels([labels[i] for i in order[::-1]], fontsize=8)
+
+        lo = min(expected_value, output, pos_cursor, neg_cursor)
+        hi = max(expected_value, output, pos_cursor, neg_cursor)
+        pad = (hi - lo) * 0.12 or 0.01
+        for ax in (self.ax_force, self.ax_waterfall):
+            ax.set_xlim(lo - pad, hi + pad)
+        for line in self.base_lines:
+            line.set_xdata([expected_value, expected_value])
+        for line in self.output_lines:
+            line.set_xdata([output, output])
+        self.ax_waterfall.set_xlabel(f"Model output (probability), E[f(X)] = {expected_value:.4f}")
+        self.output_text.set_position((output, 1.25))
+        self.output_text.set_text(f"f(x) = {output:.4f}")
+
+    def save_png(self, file, dpi):
+        self.fig.savefig(file, format='png', dpi=dpi, facecolor='white')
+
+    def save_pdf_page(self, pdf_pages, dpi):
+        pdf_pages.savefig(self.fig, dpi=dpi, facecolor='white')
+
+
+def _init_worker(job=None):
+    """spawn方式启动时由参数传入任务数据；fork方式已继承父进程中的数据"""
+    global _job
+    if job is not None:
+        _job = job
+
+
+def _figure():
+    global _report_figure
+    if _report_figure is None:
+        _report_figure = PatientReportFigure(len(_job['feature_cols']))
+    return _report_figure
+
+
+def _update_for_row(figure, row):
+    job = _job
+    score = job['risk_scores'][row]
+    title = f"Patient {job['ids'][row]} - Risk Score {score:.2f}% ({job['risk_levels'][row]})"
+    figure.update(job['shap'][row], job['expected_value'], job['X'][row], job['feature_cols'], title)
+
+
+def png_path(output_dir, patient_id):
+    return os.path.join(output_dir, f"patient_{patient_id}.png")
+
+
+def pdf_part_path(output_dir, chunk_index):
+    return os.path.join(output_dir, f"shap_report_part{chunk_index:04d}.pdf")
+
+
+def _render_chunk(chunk_index, rows):
+    """渲染一块患者，返回实际新生成的页数（已存在的文件跳过）"""
+    job = _job
+    figure = _figure()
+    if job['format'] == 'pdf':
+        from matplotlib.backends.backend_pdf import PdfPages
+        path = pdf_part_path(job['output_dir'], chunk_index)
+        if os.path.exists(path):
+            return 0
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with PdfPages(tmp_path) as pdf:
+            for row in rows:
+                _update_for_row(figure, row)
+                figure.save_pdf_page(pdf, job['dpi'])
+        os.replace(tmp_path, path)
+        return len(rows)
+
+    rendered = 0
+    for row in rows:
+        path = png_path(job['output_dir'], job['ids'][row])
+        if os.path.exists(path):
+            continue
+        _update_for_row(figure, row)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            figure.save_png(f, job['dpi'])
+        os.replace(tmp_path, path)
+        rendered += 1
+    return rendered
+
+
+def _pending_chunks(ids, output_dir, fmt, chunk_size):
+    """按块划分患者，跳过已全部完成的块；返回 [(块编号, 块内尚未生成的行号)]"""
+    n_rows = len(ids)
+    chunks = []
+    for chunk_index, start in enumerate(range(0, n_rows, chunk_size)):
+        rows = list(range(start, min(start + chunk_size, n_rows)))
+        if fmt == 'pdf':
+            if os.path.exists(pdf_part_path(output_dir, chunk_index)):
+                continue
+        else:
+            rows = [row for row in rows if not os.path.exists(png_path(output_dir, ids[row]))]
+        if rows:
+            chunks.append((chunk_index, rows))
+    return chunks
+
+
+def render_reports(forest, explainer, X, ids, output_dir, fmt='png', workers=None, dpi=300, chunk_size=50,
+                   approx_tolerance=None):
+    """
+    计算尚未生成报告的患者的SHAP（给定approx_tolerance时为部分树上的近似值）并并行渲染报告图
+
+    返回 (新生成的页数, 本次生成报告的患者的评分字典)；评分字典包含 'X'、'probability'、'risk_levels'、
+    'shap'、'expected_value'，没有需要生成的患者时为None
+    """
+    global _job
+    feature_cols = list(X.columns)
+    ids = [str(i) for i in ids]
+    chunks = _pending_chunks(ids, output_dir, fmt, chunk_size)
+    total_chunks = (len(ids) + chunk_size - 1) // chunk_size
+    if len(chunks) < total_chunks:
+        print(f"跳过已完成的 {total_chunks - len(chunks)}/{total_chunks} 块")
+    if not chunks:
+        return 0, None
+
+    # 只对尚未生成报告的患者评分和计算SHAP；块内的行号换成在这些患者中的位置
+    pending = [row for _, rows in chunks for row in rows]
+    chunks = [(chunk_index, list(range(offset, offset + len(rows))))
+              for (chunk_index, rows), offset in zip(chunks, np.cumsum([0] + [len(rows) for _, rows in chunks]))]
+    X = X.iloc[pending]
+    values = X.to_numpy(dtype=float)
+    start = time.perf_counter()
+    with stage('predict'):
+        risk_scores = forest.predict_proba(X)[:, 1] * 100
+    with stage('shap_values'):
+        if approx_tolerance is None:
+            shap_matrix = explainer.shap_values(X)
+        else:
+            from approx_shap import ApproximateShapExplainer
+            approx = ApproximateShapExplainer(forest, explainer).shap_values(X, tolerance=approx_tolerance)
+            shap_matrix = approx.values
+            print(f"  近似SHAP: 平均使用 {approx.n_trees_used.mean():.0f}/{approx.n_trees} 棵树, "
+                  f"最大95%区间半宽 {approx.max_half_width:.4f}")
+    print(f"✓ SHAP计算完成: {len(X)}个患者, 用时 {time.perf_counter() - start:.2f}s")
+
+    os.makedirs(output_dir, exist_ok=True)
+    _job = {
+        'feature_cols': feature_cols, 'X': values, 'shap': shap_matrix, 'expected_value': explainer.expected_value,
+        'risk_scores': risk_scores, 'risk_levels': risk_levels(risk_scores), 'ids': [ids[row] for row in pending],
+        'output_dir': output_dir, 'format': fmt, 'dpi': dpi,
+    }
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(chunks)))
+    if 'fork' in multiprocessing.get_all_start_methods():
+        ctx, initargs = multiprocessing.get_context('fork'), ()
+    else:
+        ctx, initargs = multiprocessing.get_context('spawn'), (_job,)
+
+    rendered, done = 0, 0
+    start = time.perf_counter()
+    with ctx.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+        for count, seconds in pool.imap_unordered(_render_chunk_args, chunks):
+            # 工作进程中的绘图用时随结果返回，在主进程中汇总
+            STAGE_SECONDS.observe(seconds, stage='render_chunk')
+            rendered += count
+            done += 1
+            print(f"  [{done}/{len(chunks)}] 已生成 {rendered} 页 ({time.perf_counter() - start:.1f}s)")
+    scored = {'X': values, 'probability': risk_scores / 100, 'risk_levels': _job['risk_levels'],
+              'shap': shap_matrix, 'expected_value': explainer.expected_value}
+    return rendered, scored
+
+
+def _render_chunk_args(args):
+    start = time.perf_counter()
+    return _render_chunk(*args), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render per-patient SHAP report images in parallel")
+    parser.add_argument('--input', default=None, help="患者数据文件（默认测试集）")
+    parser.add_argument('--rows', default='all', help="行范围，如 0:500，默认全部")
+    parser.add_argument('--id-col', default=None, help="用作文件名的患者编号列（默认使用行号）")
+    parser.add_argument('--output-dir', default='shap_reports')
+    parser.add_argument('--format', choices=['png', 'pdf'], default='png')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--dpi', type=int, default=300)
+    parser.add_argument('--chunk-size', type=int, default=50, help="每个任务（PDF分卷）的患者数")
+    parser.add_argument('--approx-tolerance', type=float, default=None,
+                        help="使用近似SHAP（部分树），每个特征95%%置信区间半宽的目标，如0.01")
+    parser.add_argument('--metrics-file', default=None, help="结束时把各阶段用时写入该文件（Prometheus文本格式）")
+    args = parser.parse_args()
+
+    from model_artifact import open_artifact
+    from project_data import TEST_PATH, dataset_columns, load_dataset
+
+    with stage('load_model'):
+        artifact = open_artifact()
+    forest, explainer = artifact.forest, artifact.explainer
+    feature_cols = list(forest.feature_names_in_)
+    input_path = args.input or TEST_PATH
+    id_col = args.id_col if args.id_col in dataset_columns(input_path) else None
+    with stage('load_data'):
+        data = load_dataset(input_path, feature_cols + ([id_col] if id_col else []))
+    if args.rows != 'all':
+        start, _, stop = args.rows.partition(':')
+        data = data.iloc[int(start or 0):int(stop) if stop else None]
+    ids = data[id_col] if id_col else data.index
+    print(f"模型包版本 {artifact.model_version}, 患者数: {len(data)}")
+
+    rendered, scored = render_reports(forest, explainer, data[feature_cols], ids, args.output_dir,
+                                      args.format, args.workers, args.dpi, args.chunk_size, args.approx_tolerance)
+    print(f"✓ 完成: 新生成 {rendered} 页, 保存在 {args.output_dir}")
+
+    # 漂移监测和审计日志的后台线程在进程池结束后才创建（fork时存在持有锁的线程可能使子进程死锁）；
+    # 只记录本次新生成报告的患者
+    drift_monitor = monitor_for(artifact) if scored is not None else None
+    if drift_monitor is not None:
+        drift_monitor.observe(scored['X'])
+    audit_log = get_audit_log() if scored is not None else None
+    if audit_log is not None:
+        audit_log.record_batch('reports', artifact.model_version, feature_cols, scored['X'], scored['probability'],
+                               scored['risk_levels'], scored['shap'], scored['expected_value'],
+                               approximate=args.approx_tolerance is not None)
+        audit_log.close()
+    if args.metrics_file:
+        if drift_monitor is not None:
+            drift_monitor.flush()
+        write_textfile(args.metrics_file)
+
+
+if __name__ == "__main__":
+    main()
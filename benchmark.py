@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+性能基准测试
+
+在合成队列（synthetic_data.py）上训练不同树数的随机森林，写成模型包后分别测量：
+模型包加载时间、首次调用（预热）时间、单样本和批量predict_proba延迟、单样本和批量SHAP延迟、
+图表渲染时间（Altair图表规格 / matplotlib PNG）以及进程峰值内存（RSS）。
+每个森林规模先在一个子进程中训练并写出模型包，再在另一个只加载模型包并评分的子进程中测量，
+峰值内存反映服务进程的内存，不包含训练森林时的内存；rss_increase_mb为导入完成后、加载模型包前
+到测量结束时的峰值增量。子进程异常退出（如内存不足被终止）时报告退出码，不会一直等待。
+
+结果写成JSON，可与之前的结果比较，延迟或内存超过阈值即视为性能回退（退出码1）。
+
+用法:
+    python benchmark.py --trees 100,500,2500 --output bench.json
+    python benchmark.py --trees 100,500,2500 --output bench_new.json --baseline bench.json --threshold 0.2
+    python benchmark.py --compare bench.json bench_new.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# 比较结果时忽略的指标（随环境波动很大或不是越小越好）
+_NOT_COMPARED = {'n_trees', 'n_nodes'}
+
+
+def _percentiles(func, repeats):
+    """重复调用，返回 (p50, p95) 毫秒"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.percentile(times, 50)), float(np.percentile(times, 95))
+
+
+def _peak_rss_mb():
+    """当前进程的峰值常驻内存（MB），平台不支持时返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def build_artifact(n_trees, train_rows=5000, seed=0, work_dir=None):
+    """训练一个n_trees棵树的森林并写成模型包，返回 (模型包路径, 训练用时秒数)"""
+    from sklearn.ensemble import RandomForestClassifier
+    from forest_engine import PackedForest
+    from model_artifact import write_artifact
+    from project_data import DEFAULT_RF_PARAMS, FEATURE_COLS
+    from synthetic_data import TARGET_COL, generate_cohort
+
+    train = generate_cohort(train_rows, seed=seed)
+    params = dict(DEFAULT_RF_PARAMS, n_estimators=n_trees)
+    model = RandomForestClassifier(random_state=seed, n_jobs=-1, **params)
+    start = time.perf_counter()
+    model.fit(train[FEATURE_COLS], train[TARGET_COL])
+    fit_seconds = time.perf_counter() - start
+
+    path = os.path.join(work_dir or tempfile.mkdtemp(), f"bench_{n_trees}.bin")
+    write_artifact(path, PackedForest.from_sklearn(model), metadata={'feature_cols': FEATURE_COLS})
+    return path, fit_seconds
+
+
+def benchmark_artifact(path, batch_sizes=(1000, 10000), shap_batch=100, repeats=50, seed=0):
+    """加载模型包并测量各项指标，返回指标字典（峰值内存为调用进程的峰值，应在单独的进程中调用）"""
+    from model_artifact import open_artifact
+    from project_data import FEATURE_COLS
+    from shap_charts import contribution_chart, force_chart, waterfall_chart
+    from shap_plots import render_force_plot, render_waterfall_plot
+    from synthetic_data import generate_cohort
+
+    # 先完成导入和评分数据的生成，之后的内存增量来自模型包和评分/解释/绘图
+    cohort = generate_cohort(max(tuple(batch_sizes) + (shap_batch,)), seed=seed + 1, with_target=False)
+    rss_before_load = _peak_rss_mb()
+    metrics = {}
+    start = time.perf_counter()
+    artifact = open_artifact(path)
+    metrics['artifact_load_ms'] = (time.perf_counter() - start) * 1000
+    forest, explainer = artifact.forest, artifact.explainer
+    metrics['n_trees'] = forest.n_estimators
+    metrics['n_nodes'] = len(forest.feature)
+
+    single = cohort.iloc[[0]]
+    start = time.perf_counter()
+    forest.predict_proba(single)
+    explainer.shap_values(single)
+    metrics['warmup_ms'] = (time.perf_counter() - start) * 1000
+
+    metrics['predict_single_p50_ms'], metrics['predict_single_p95_ms'] = \
+        _percentiles(lambda: forest.predict_proba(single), repeats)
+    for size in batch_sizes:
+        batch = cohort.iloc[:size]
+        metrics[f'predict_batch_{size}_ms'] = _percentiles(lambda: forest.predict_proba(batch), max(3, repeats // 10))[0]
+
+    metrics['shap_single_p50_ms'], metrics['shap_single_p95_ms'] = \
+        _percentiles(lambda: explainer.shap_values(single), repeats)
+    shap_rows = cohort.iloc[:shap_batch]
+    metrics[f'shap_batch_{shap_batch}_ms'] = _percentiles(lambda: explainer.shap_values(shap_rows), 3)[0]
+
+    # 图表渲染：浏览器端图表只需生成Vega-Lite规格；matplotlib为导出路径
+    shap_1d = explainer.shap_values(single)[0]
+    values = single.iloc[0].values
+    base = explainer.expected_value
+
+    def altair_specs():
+        force_chart(shap_1d, base, values, FEATURE_COLS).to_dict()
+        waterfall_chart(shap_1d, base, values, FEATURE_COLS).to_dict()
+        contribution_chart(shap_1d, values, FEATURE_COLS).to_dict()
+
+    def matplotlib_pngs():
+        render_force_plot(shap_1d, base, values, FEATURE_COLS)
+        render_waterfall_plot(shap_1d, base, values, FEATURE_COLS)
+
+    altair_specs()
+    metrics['render_altair_ms'] = _percentiles(altair_specs, 5)[0]
+    matplotlib_pngs()
+    metrics['render_matplotlib_ms'] = _percentiles(matplotlib_pngs, 3)[0]
+
+    metrics['peak_rss_mb'] = _peak_rss_mb()
+    if rss_before_load is not None:
+        metrics['rss_increase_mb'] = metrics['peak_rss_mb'] - rss_before_load
+    return metrics
+
+
+def benchmark_forest_size(n_trees, train_rows=5000, batch_sizes=(1000, 10000), shap_batch=100,
+                          repeats=50, seed=0, work_dir=None):
+    """在当前进程中训练并测量一个森林规模（峰值内存包含训练；run_benchmarks把两步放在不同的子进程中）"""
+    path, fit_seconds = build_artifact(n_trees, train_rows, seed, work_dir)
+    return {'fit_seconds': fit_seconds, **benchmark_artifact(path, batch_sizes, shap_batch, repeats, seed)}
+
+
+def _run_in_child(queue, func, kwargs):
+    try:
+        queue.put(('ok', func(**kwargs)))
+    except Exception as e:
+        queue.put(('error', f"{type(e).__name__}: {e}"))
+
+
+def _run_child(ctx, func, kwargs, timeout=None, poll_seconds=1.0):
+    """在子进程中运行func(**kwargs)并返回结果；子进程异常退出或超时时抛出RuntimeError"""
+    import queue as queue_module
+
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_in_child, args=(queue, func, kwargs))
+    process.start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                status, payload = queue.get(timeout=poll_seconds)
+                break
+            except queue_module.Empty:
+                pass
+            if not process.is_alive():
+                # 子进程可能在退出前刚放入结果
+                try:
+                    status, payload = queue.get(timeout=poll_seconds)
+                    break
+                except queue_module.Empty:
+                    raise RuntimeError(f"{func.__name__} exited with code {process.exitcode} without a result "
+                                       f"(killed, e.g. out of memory?)") from None
+            if deadline is not None and time.monotonic() > deadline:
+                raise RuntimeError(f"{func.__name__} did not finish within {timeout:.0f}s")
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+    if status != 'ok':
+        raise RuntimeError(payload)
+    return payload
+
+
+def run_benchmarks(tree_sizes, train_rows=5000, batch_sizes=(1000, 10000), shap_batch=100, repeats=50, seed=0,
+                   timeout=None):
+    """每个森林规模先在一个子进程中训练，再在另一个子进程中只加载模型包并测量（峰值内存不含训练）"""
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for n_trees in tree_sizes:
+            try:
+                path, fit_seconds = _run_child(ctx, build_artifact, dict(
+                    n_trees=n_trees, train_rows=train_rows, seed=seed, work_dir=work_dir), timeout)
+                metrics = _run_child(ctx, benchmark_artifact, dict(
+                    path=path, batch_sizes=batch_sizes, shap_batch=shap_batch, repeats=repeats, seed=seed), timeout)
+            except RuntimeError as e:
+                raise RuntimeError(f"Benchmark with {n_trees} trees failed: {e}") from None
+            payload = {'n_trees': n_trees, 'fit_seconds': fit_seconds, **metrics}
+            results.append(payload)
+            print(f"  {n_trees}棵树: 单样本预测 {payload['predict_single_p50_ms']:.3f}ms, "
+                  f"单样本SHAP {payload['shap_single_p50_ms']:.3f}ms, 峰值内存 {payload['peak_rss_mb']:.0f}MB "
+                  f"(加载模型包后增加 {payload.get('rss_increase_mb') or 0:.0f}MB)")
+    return results
+
+
+def environment_info():
+    """记录运行环境，比较结果时用于判断是否可比"""
+    import numba
+    import sklearn
+    info = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'numba': numba.__version__,
+        'sklearn': sklearn.__version__,
+    }
+    try:
+        import subprocess
+        info['git_commit'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                            text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        pass
+    return info
+
+
+def compare_results(baseline, current, threshold=0.2):
+    """
+    按森林规模逐项比较两次结果（所有指标都是越小越好）
+
+    返回 (比较表行列表, 是否有回退)；增幅超过threshold（相对值）的指标记为回退
+    """
+    base_by_size = {row['n_trees']: row for row in baseline['results']}
+    rows, regressed = [], False
+    for row in current['results']:
+        base = base_by_size.get(row['n_trees'])
+        if base is None:
+            continue
+        for metric, value in row.items():
+            if metric in _NOT_COMPARED or value is None or base.get(metric) in (None, 0):
+                continue
+            change = value / base[metric] - 1.0
+            is_regression = change > threshold
+            regressed |= is_regression
+            rows.append({'n_trees': row['n_trees'], 'metric': metric, 'baseline': base[metric],
+                         'current': value, 'change': change, 'regression': is_regression})
+    return rows, regressed
+
+
+def print_comparison(rows, threshold):
+    print(f"\n{'trees':>6}  {'metric':<26}{'baseline':>12}{'current':>12}{'change':>9}")
+    for row in rows:
+        flag = '  ✗ 回退' if row['regression'] else ''
+        print(f"{row['n_trees']:>6}  {row['metric']:<26}{row['baseline']:>12.3f}{row['current']:>12.3f}"
+              f"{row['change'] * 100:>8.1f}%{flag}")
+    n_regressed = sum(row['regression'] for row in rows)
+    print(f"\n{n_regressed}项指标增幅超过{threshold * 100:.0f}%" if n_regressed else "\n✓ 没有性能回退")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance benchmarks on synthetic cohorts")
+    parser.add_argument('--trees', default='100,500,2500', help="森林规模（树数，逗号分隔）")
+    parser.add_argument('--train-rows', type=int, default=5000)
+    parser.add_argument('--batch-sizes', default='1000,10000')
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=None, help="每个子进程（训练/测量）的最长秒数")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=None, help="与之前的结果比较")
+    parser.add_argument('--threshold', type=float, default=0.2, help="判定为回退的相对增幅")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help="只比较两个已有结果文件")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.compare[1], encoding='utf-8') as f:
+            current = json.load(f)
+        rows, regressed = compare_results(baseline, current, args.threshold)
+        print_comparison(rows, args.threshold)
+        sys.exit(1 if regressed else 0)
+
+    tree_sizes = [int(n) for n in args.trees.split(',')]
+    config = {
+        'train_rows': args.train_rows,
+        'batch_sizes': [int(n) for n in args.batch_sizes.split(',')],
+        'repeats': args.repeats,
+        'seed': args.seed,
+    }
+    print(f"基准测试: 森林规模 {tree_sizes}")
+    results = run_benchmarks(tree_sizes, train_rows=config['train_rows'], batch_sizes=tuple(config['batch_sizes']),
+                             repeats=config['repeats'], seed=config['seed'], timeout=args.timeout)
+    report = {'environment': environment_info(), 'config': config, 'results': results}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✓ 结果已保存到: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows, regressed = compare_results(baseline, report, args.threshold)
+        print_comparison(rows, args.threshold)
+        sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+队列SHAP索引：离线计算整个测试集的预测概率和SHAP值，应用中以毫秒级查询单个患者的队列背景
+
+    - 每个特征的SHAP贡献在队列中的百分位
+    - 标准化特征空间中最相似的k个历史患者及其结局
+
+索引为未压缩的Arrow IPC文件（特征列、shap_<特征>列、probability、outcome，schema元数据中保存
+模型版本、基准值和标准化参数），以内存映射方式读取；同名的 .kdtree.pkl 文件是标准化特征上的
+KD树（sklearn.neighbors.KDTree），缺失或与索引不匹配时加载索引时重新构建。
+特征中的缺失值（森林和TreeSHAP都支持缺失值）在计算距离时按均值填补，即标准化后为0。
+
+用法:
+    python cohort_index.py --data mimiciii_test1.xlsx --model rf_model.bin --output cohort_index.arrow
+    COHORT_INDEX=cohort_index.arrow streamlit run app.py
+"""
+import argparse
+import json
+import os
+import pickle
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from metrics import stage
+from scoring import positive_class_shap
+
+DEFAULT_INDEX_PATH = 'cohort_index.arrow'
+_METADATA_KEY = b'cohort_index'
+
+
+def kdtree_path(path):
+    """索引对应的KD树文件"""
+    return os.path.splitext(path)[0] + '.kdtree.pkl'
+
+
+def _shap_col(name):
+    return f'shap_{name}'
+
+
+class CohortIndex:
+    """内存映射的队列索引：百分位查询与相似患者查询"""
+
+    def __init__(self, table, metadata, tree=None):
+        self.metadata = metadata
+        self.feature_cols = list(metadata['feature_cols'])
+        self.model_version = metadata.get('model_version')
+        self.expected_value = metadata.get('expected_value')
+        self.mean = np.asarray(metadata['mean'], dtype=np.float64)
+        self.scale = np.asarray(metadata['scale'], dtype=np.float64)
+        self.ids = table.column('patient_id').to_numpy()
+        self.features = np.column_stack([table.column(col).to_numpy() for col in self.feature_cols]).astype(np.float64)
+        self.probability = table.column('probability').to_numpy()
+        self.outcome = table.column('outcome').to_numpy(zero_copy_only=False).astype(np.float64)
+        # 每个特征的SHAP值排序后保存，百分位查询为一次二分查找
+        self.sorted_shap = np.sort(np.column_stack([table.column(_shap_col(col)).to_numpy()
+                                                    for col in self.feature_cols]), axis=0)
+        if tree is None or tree.data.shape[0] != len(self):
+            tree = build_kdtree(self.features, self.mean, self.scale)
+        self.tree = tree
+
+    def __len__(self):
+        return len(self.probability)
+
+    @property
+    def has_outcome(self):
+        return not np.all(np.isnan(self.outcome))
+
+    def standardize(self, X):
+        return standardize(X, self.mean, self.scale)
+
+    def percentiles(self, shap_values_1d):
+        """每个特征的SHAP贡献在队列中的百分位（0-100，相同值取中间位置）"""
+        shap_values_1d = np.asarray(shap_values_1d, dtype=np.float64)
+        n = len(self)
+        ranks = np.empty(len(self.feature_cols))
+        for j, value in enumerate(shap_values_1d):
+            column = self.sorted_shap[:, j]
+            below = np.searchsorted(column, value, side='left')
+            at_or_below = np.searchsorted(column, value, side='right')
+            ranks[j] = (below + at_or_below) / 2
+        return ranks / n * 100
+
+    def similar(self, feature_values, k=10):
+        """标准化特征空间中最相似的k个历史患者，返回DataFrame（按距离排序）"""
+        k = min(int(k), len(self))
+        distances, indices = self.tree.query(self.standardize(feature_values).reshape(1, -1), k=k)
+        indices = indices[0]
+        neighbours = pd.DataFrame({
+            'Patient': self.ids[indices],
+            'Distance': distances[0],
+            'Risk Score (%)': self.probability[indices] * 100,
+            'Outcome': self.outcome[indices],
+        })
+        for j, col in enumerate(self.feature_cols):
+            neighbours[col] = self.features[indices, j]
+        return neighbours
+
+
+def standardize(X, mean, scale):
+    """标准化特征，缺失值按均值填补（标准化后为0），KDTree不接受NaN"""
+    Z = (np.asarray(X, dtype=np.float64) - mean) / scale
+    return np.where(np.isnan(Z), 0.0, Z)
+
+
+def build_kdtree(features, mean, scale):
+    from sklearn.neighbors import KDTree
+
+    return KDTree(standardize(features, mean, scale))
+
+
+def build_index(forest, explainer, data, feature_cols, outcome=None, ids=None, chunk_size=5000):
+    """
+    计算整个队列的预测概率和SHAP值，返回 (索引表DataFrame, 元数据字典)
+
+    outcome为结局（0/1，可为None），ids为患者编号（默认行号）
+    """
+    X = data[feature_cols].to_numpy(dtype=np.float64)
+    probability = np.empty(len(X))
+    shap_matrix = np.empty((len(X), len(feature_cols)))
+    expected_value = None
+    for start in range(0, len(X), chunk_size):
+        chunk = X[start:start + chunk_size]
+        with stage('predict'):
+            probability[start:start + len(chunk)] = forest.predict_proba(chunk)[:, 1]
+        values, expected_value = positive_class_shap(explainer, chunk)
+        shap_matrix[start:start + len(chunk)] = values[:, :len(feature_cols)]
+
+    table = pd.DataFrame({'patient_id': np.arange(len(X)) if ids is None else np.asarray(ids)})
+    for j, col in enumerate(feature_cols):
+        table[col] = X[:, j]
+    for j, col in enumerate(feature_cols):
+        table[_shap_col(col)] = shap_matrix[:, j]
+    table['probability'] = probability
+    table['outcome'] = np.nan if outcome is None else np.asarray(outcome, dtype=np.float64)
+
+    # 均值和标准差忽略缺失值；全部缺失的特征均值记为0
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = np.nanmean(X, axis=0)
+        scale = np.nanstd(X, axis=0)
+    n_missing = int(np.isnan(X).any(axis=1).sum())
+    if n_missing:
+        print(f"  {n_missing}个患者有缺失的特征值，相似患者查询时按均值填补")
+    metadata = {
+        'feature_cols': list(feature_cols),
+        'expected_value': expected_value,
+        'mean': np.where(np.isfinite(mean), mean, 0.0).tolist(),
+        # 取值恒定（或全部缺失）的特征不参与距离
+        'scale': np.where(scale > 0, scale, 1.0).tolist(),
+        'n_patients': len(X),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    return table, metadata
+
+
+def write_index(path, table, metadata):
+    """写出索引（Arrow IPC，未压缩，可内存映射）和KD树，均先写临时文件再原子替换"""
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    arrow_table = pa.Table.from_pandas(table, preserve_index=False)
+    arrow_table = arrow_table.replace_schema_metadata({_METADATA_KEY: json.dumps(metadata, ensure_ascii=False)})
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink, ipc.new_file(sink, arrow_table.schema) as writer:
+        writer.write_table(arrow_table)
+    os.replace(tmp_path, path)
+
+    features = table[metadata['feature_cols']].to_numpy(dtype=np.float64)
+    tree = build_kdtree(features, np.asarray(metadata['mean']), np.asarray(metadata['scale']))
+    tree_path = kdtree_path(path)
+    tmp_path = f"{tree_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, tree_path)
+
+
+def load_index(path=DEFAULT_INDEX_PATH):
+    """以内存映射方式读取索引并加载KD树"""
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    with pa.memory_map(path, 'r') as source:
+        table = ipc.open_file(source).read_all()
+    metadata = json.loads(table.schema.metadata[_METADATA_KEY])
+    tree = None
+    try:
+        with open(kdtree_path(path), 'rb') as f:
+            tree = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+    return CohortIndex(table, metadata, tree)
+
+
+def _median_ms(func, repeats=50):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times))
+
+
+def main():
+    from model_artifact import open_artifact
+    from project_data import TEST_PATH, dataset_columns, detect_target_col, load_dataset
+
+    parser = argparse.ArgumentParser(description="Build the cohort SHAP index for percentile and similar-patient lookup")
+    parser.add_argument('--data', default=TEST_PATH, help="队列数据文件（默认MIMIC-III测试集）")
+    parser.add_argument('--model', default='rf_model.bin', help="模型包")
+    parser.add_argument('--target', default=None, help="结局列（默认按列名自动识别，找不到时不保存结局）")
+    parser.add_argument('--id-col', default=None, help="患者编号列（默认使用行号）")
+    parser.add_argument('--output', default=DEFAULT_INDEX_PATH)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    artifact = open_artifact(args.model)
+    forest, explainer = artifact.forest, artifact.explainer
+    feature_cols = list(forest.feature_names_in_)
+    columns = dataset_columns(args.data)
+    target = args.target
+    if target is None:
+        others = [col for col in columns if col not in feature_cols and col != args.id_col]
+        detected = detect_target_col(others) if others else None
+        if detected is not None and ('SPESIS' in detected.upper() or 'SEPSIS' in detected.upper()):
+            target = detected
+    extra = [col for col in (target, args.id_col) if col is not None]
+    data = load_dataset(args.data, feature_cols + extra)
+
+    start = time.perf_counter()
+    table, metadata = build_index(forest, explainer, data, feature_cols,
+                                  outcome=data[target] if target else None,
+                                  ids=data[args.id_col] if args.id_col else None,
+                                  chunk_size=args.chunk_size)
+    metadata['model_version'] = artifact.model_version
+    metadata['source'] = os.path.basename(args.data)
+    metadata['outcome_col'] = target
+    write_index(args.output, table, metadata)
+    print(f"✓ 队列索引已保存到: {args.output} ({len(table)}个患者, 结局列 {target or '无'}, "
+          f"模型版本 {artifact.model_version}, 用时 {time.perf_counter() - start:.1f}s)")
+
+    index = load_index(args.output)
+    row = index.features[0]
+    print(f"  查询用时: 百分位 {_median_ms(lambda: index.percentiles(index.sorted_shap[0])):.3f} ms, "
+          f"最相似10个患者 {_median_ms(lambda: index.similar(row, k=10)):.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+森林压缩：寻找与完整模型预测一致的最小子森林
+
+在留出集上按贪心顺序逐棵挑选树（每一步加入使子森林平均概率最接近完整模型的那棵），
+直到子森林与完整模型的正类概率最大绝对差不超过容差（默认0.5个百分点）。
+输出精度/延迟权衡报告和可直接被应用加载的压缩模型包。留出集不应是用于最终评估的外部测试集，
+否则选树和容差检查都在评估数据上进行。报告中的加速比按批量推理延迟计算
+（单样本延迟只有几微秒，主要是调用开销和噪声），并列出节点数。
+
+用法:
+    python compact_forest.py test.csv --model rf_model.bin --tolerance 0.005 --output rf_model_compact.bin
+    MODEL_ARTIFACT=rf_model_compact.bin streamlit run app.py
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from model_artifact import open_artifact, write_artifact
+from project_data import dataset_columns, load_dataset
+from tree_shap import TreeShapExplainer
+
+DEFAULT_TOLERANCE = 0.005
+LATENCY_BATCH_ROWS = 1000
+
+
+def greedy_tree_order(leaf_probs, target, tolerance=DEFAULT_TOLERANCE):
+    """
+    贪心地选择树的顺序
+
+    leaf_probs: (n_samples, n_trees) 每棵树对每个样本的正类概率
+    target: (n_samples,) 完整模型的正类概率
+    每一步加入使子森林均值与target平方误差最小的树；最大绝对差不超过tolerance时停止。
+    返回 (选中的树编号列表, 每一步的最大绝对差列表)
+    """
+    leaf_probs = np.asarray(leaf_probs, dtype=np.float64)
+    n_trees = leaf_probs.shape[1]
+    squared_norms = np.einsum('ij,ij->j', leaf_probs, leaf_probs)
+    used = np.zeros(n_trees, dtype=bool)
+    total = np.zeros(leaf_probs.shape[0])
+    order, errors = [], []
+    for k in range(1, n_trees + 1):
+        # ||total + p_t - k*target||^2 = 常数 + 2 p_t·(total - k*target) + ||p_t||^2
+        score = 2.0 * (leaf_probs.T @ (total - k * target)) + squared_norms
+        score[used] = np.inf
+        best = int(np.argmin(score))
+        used[best] = True
+        total += leaf_probs[:, best]
+        order.append(best)
+        errors.append(float(np.abs(total / k - target).max()))
+        if errors[-1] <= tolerance:
+            break
+    return order, errors
+
+
+def _median_ms(func, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times))
+
+
+def measure(forest, explainer, X, reference, y=None, repeats=20):
+    """一个森林在留出集上的误差与推理/SHAP延迟"""
+    proba = forest.predict_proba(X)[:, 1]
+    diff = np.abs(proba - reference)
+    single = X[:1]
+    batch = X[np.arange(max(len(X), LATENCY_BATCH_ROWS)) % len(X)]
+    # 先各调用一次，排除numba编译时间
+    explainer.shap_values(single)
+    row = {
+        'n_trees': forest.n_estimators,
+        'n_nodes': len(forest.feature),
+        'max_abs_diff_pp': diff.max() * 100,
+        'mean_abs_diff_pp': diff.mean() * 100,
+        'predict_ms_single': _median_ms(lambda: forest.predict_proba(single), repeats),
+        'predict_ms_batch': _median_ms(lambda: forest.predict_proba(batch), max(3, repeats // 2)),
+        'shap_ms_single': _median_ms(lambda: explainer.shap_values(single), repeats),
+    }
+    if y is not None and len(np.unique(y)) == 2:
+        from sklearn.metrics import roc_auc_score
+        row['auc'] = roc_auc_score(y, proba)
+    return row
+
+
+def compact_forest(forest, X_holdout, tolerance=DEFAULT_TOLERANCE, y_holdout=None, report_points=None):
+    """
+    压缩森林
+
+    返回 (压缩后的森林, 选中的原始树编号, 权衡报告DataFrame)。
+    报告包含贪心顺序上若干树数量的误差/延迟，以及选中的子森林和完整森林。
+    """
+    X = forest._as_matrix(X_holdout)
+    y = None if y_holdout is None else np.asarray(y_holdout)
+    reference = forest.predict_proba(X)[:, 1]
+    leaf_probs = forest.value[forest.apply(X)]
+    order, errors = greedy_tree_order(leaf_probs, reference, tolerance)
+    n_selected = len(order)
+    if errors[-1] > tolerance:
+        n_selected = forest.n_estimators
+
+    if report_points is None:
+        report_points = [n for n in (10, 25, 50, 100, 200, 500, 1000, 2000) if n < n_selected]
+    report_points = sorted(set(report_points) | {n_selected})
+
+    rows = []
+    for n in report_points:
+        subset = forest.select_trees(np.sort(order[:n]) if n <= len(order) else np.arange(forest.n_estimators))
+        row = measure(subset, TreeShapExplainer.from_forest(subset), X, reference, y)
+        row['selected'] = n == n_selected
+        rows.append(row)
+    if n_selected < forest.n_estimators:
+        row = measure(forest, TreeShapExplainer.from_forest(forest), X, reference, y)
+        row['selected'] = False
+        rows.append(row)
+
+    report = pd.DataFrame(rows)
+    full = report.iloc[-1]
+    report['speedup'] = full['predict_ms_batch'] / report['predict_ms_batch']
+
+    tree_indices = np.sort(order[:n_selected]) if n_selected < forest.n_estimators else np.arange(forest.n_estimators)
+    return forest.select_trees(tree_indices), tree_indices, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact the random forest to the smallest matching sub-forest")
+    parser.add_argument('holdout', help="留出集文件（csv / xlsx / parquet）")
+    parser.add_argument('--model', default='rf_model.bin', help="完整模型包路径")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="允许的正类概率最大绝对差（0.005即0.5个百分点）")
+    parser.add_argument('--target', default=None, help="目标变量列（提供时报告中包含AUC）")
+    parser.add_argument('--output', default='rf_model_compact.bin')
+    parser.add_argument('--report', default='compaction_report.csv')
+    args = parser.parse_args()
+
+    artifact = open_artifact(args.model)
+    forest = artifact.forest
+    feature_cols = list(forest.feature_names_in_)
+    has_target = args.target is not None and args.target in dataset_columns(args.holdout)
+    holdout = load_dataset(args.holdout, feature_cols + ([args.target] if has_target else []))
+    y = holdout[args.target] if has_target else None
+    print(f"完整模型: {forest.n_estimators}棵树, 留出集: {len(holdout)}个样本")
+
+    compact, tree_indices, report = compact_forest(forest, holdout[feature_cols], args.tolerance, y)
+    print("\n精度/延迟权衡:")
+    print(report.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    report.to_csv(args.report, index=False)
+
+    selected = report[report['selected']].iloc[0]
+    metadata = dict(artifact.metadata)
+    for key in ('model_version', 'created_at', 'n_estimators'):
+        metadata.pop(key, None)
+    metadata['compaction'] = {
+        'source_model_version': artifact.model_version,
+        'source_n_estimators': forest.n_estimators,
+        'tolerance': args.tolerance,
+        'holdout_max_abs_diff': float(selected['max_abs_diff_pp']) / 100,
+        'tree_indices': tree_indices.tolist(),
+    }
+    metadata = write_artifact(args.output, compact, metadata=metadata)
+    print(f"\n✓ 压缩模型包已保存到: {args.output} "
+          f"({compact.n_estimators}/{forest.n_estimators}棵树, 最大差 {selected['max_abs_diff_pp']:.3f}个百分点, "
+          f"版本 {metadata['model_version']})")
+    print(f"✓ 权衡报告已保存到: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
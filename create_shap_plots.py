@@ -10,6 +10,8 @@ import shap
 import matplotlib
 matplotlib.use('Agg')  # 非交互式后端
 import matplotlib.pyplot as plt
+from model_artifact import open_artifact
+from project_data import TEST_PATH, load_dataset
 
 # 设置中文字体
 plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'Arial Unicode MS', 'DejaVu Sans']
@@ -23,13 +25,9 @@ def main():
     # 1. 加载模型和解释器
     print("\n[1/5] 加载模型和解释器...")
     try:
-        with open('rf_model.pkl', 'rb') as f:
-            model = pickle.load(f)
-        print("  ✓ 模型加载成功")
-        
-        with open('shap_explainer.pkl', 'rb') as f:
-            explainer = pickle.load(f)
-        print("  ✓ SHAP解释器加载成功")
+        artifact = open_artifact('rf_model.bin')
+        model, explainer = artifact.forest, artifact.explainer
+        print(f"  ✓ 模型包加载成功 (版本 {artifact.model_version}, 共{model.n_estimators}棵树)")
         
         with open('feature_info.pkl', 'rb') as f:
             feature_info = pickle.load(f)
@@ -42,13 +40,13 @@ def main():
     # 2. 读取测试样本
     print("\n[2/5] 读取测试集样本...")
     try:
-        test_path = r"spesis and pi\parameters\mimiciii_test1.xlsx"
-        test_df = pd.read_excel(test_path)
+        test_df = load_dataset(TEST_PATH, feature_cols)
         print(f"  ✓ 测试集形状: {test_df.shape}")
         
         # 选择第一个样本
         sample_data = test_df[feature_cols].iloc[[0]].copy()
         print(f"  ✓ 样本数据准备完成")
+        print(f"  ✓ 样本风险评分: {model.predict_proba(sample_data)[0, 1] * 100:.2f}%")
     except Exception as e:
         print(f"  ✗ 读取失败: {e}")
         return
@@ -56,38 +54,9 @@ def main():
     # 3. 计算SHAP值
     print("\n[3/5] 计算SHAP值...")
     try:
-        shap_values = explainer.shap_values(sample_data)
-        
-        # 处理SHAP值
-        if isinstance(shap_values, list):
-            shap_values_array = shap_values[1]
-            expected_value = explainer.expected_value[1] if isinstance(explainer.expected_value, (list, np.ndarray)) else explainer.expected_value
-        else:
-            shap_values_array = shap_values
-            expected_value = explainer.expected_value
-        
-        # 确保是1维数组
-        if shap_values_array.ndim > 1:
-            shap_values_1d = shap_values_array[0].flatten()
-        else:
-            shap_values_1d = shap_values_array.flatten()
-
-        # 如果长度不匹配，只取前len(feature_cols)个
-        if len(shap_values_1d) != len(feature_cols):
-            print(f"  警告: SHAP值长度({len(shap_values_1d)})与特征数量({len(feature_cols)})不匹配")
-            if len(shap_values_1d) > len(feature_cols):
-                shap_values_1d = shap_values_1d[:len(feature_cols)]
-                print(f"  已截取前{len(feature_cols)}个值")
-            else:
-                # 如果SHAP值太少，用0填充
-                shap_values_1d = np.pad(shap_values_1d, (0, len(feature_cols) - len(shap_values_1d)), 'constant')
-                print(f"  已用0填充至{len(feature_cols)}个值")
-
-        # 确保expected_value是标量
-        if isinstance(expected_value, (list, np.ndarray)):
-            expected_value = float(expected_value[0] if len(expected_value) > 0 else expected_value)
-        else:
-            expected_value = float(expected_value)
+        # 批量TreeSHAP直接返回正类的 (n_samples, n_features) 矩阵和标量基准值
+        shap_values_1d = explainer.shap_values(sample_data)[0]
+        expected_value = explainer.expected_value
         
         print(f"  ✓ SHAP值计算完成")
         print(f"  ✓ 基准值: {expected_value:.4f}")
@@ -109,11 +78,6 @@ def main():
     # 5. 生成SHAP力图
     print("\n[4/5] 生成SHAP力图...")
     try:
-        # 确保长度匹配
-        if len(shap_values_1d) != len(feature_cols):
-            print(f"  警告: 长度不匹配 ({len(shap_values_1d)} vs {len(feature_cols)})，使用条形图")
-            raise ValueError("长度不匹配")
-        
         # 方法1: 尝试使用新API
         try:
             plt.figure(figsize=(16, 6))
@@ -155,11 +119,6 @@ def main():
     # 6. 生成SHAP瀑布图
     print("\n[5/5] 生成SHAP瀑布图...")
     try:
-        # 确保长度匹配
-        if len(shap_values_1d) != len(feature_cols):
-            print(f"  警告: 长度不匹配 ({len(shap_values_1d)} vs {len(feature_cols)})，使用累积图")
-            raise ValueError("长度不匹配")
-        
         # 方法1: 尝试使用新API
         try:
             plt.figure(figsize=(14, 10))
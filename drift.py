@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+输入漂移监测：固定内存的流式直方图，与训练集的参考分布比较
+
+每个特征在固定的分箱上计数（连续特征在输入控件的取值范围内等宽分为100箱，另加超出下限/上限两箱；
+二分类特征每个取值一箱），计数数组的大小与请求数无关。直方图同时作为分位数草图（箱内线性插值）。
+    PSI：把细分箱按参考分布的十分位合并为约10箱后计算 Σ (p - q) ln(p / q)
+    KS ：两个分布在所有箱边界处累计比例之差的最大值
+
+参考分布由train_model.py在训练集（SMOTE-NC处理后的MIMIC-IV）上生成，保存在模型包旁边
+（rf_model.bin -> rf_model.drift.json）。评分路径只把特征向量放入有界队列（满时丢弃并计数），
+后台线程合并计数，不增加请求延迟。最近24个1小时窗口的计数循环使用，另有进程启动以来的累计计数；
+/metrics 导出每个特征最近窗口的PSI和KS。
+
+用法:
+    python drift.py reference --data train.csv --model rf_model.bin   # 为已有模型包生成参考分布
+    python drift.py report cohort.csv --model rf_model.bin           # 一个数据文件相对参考分布的漂移
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics import Counter, REGISTRY
+
+FINE_BINS = 100
+PSI_BINS = 10
+# 比例为0的箱按此值计算PSI，避免log(0)
+PSI_EPSILON = 1e-4
+# 常用的PSI判断阈值：<0.1 稳定，0.1~0.25 轻度漂移，>0.25 明显漂移
+PSI_WARNING = 0.1
+PSI_ALERT = 0.25
+# 样本很少时PSI偏高，少于此数时不判断漂移等级
+MIN_OBSERVATIONS = 100
+
+DRIFT_OBSERVATIONS = REGISTRY.register(Counter(
+    'sepsis_drift_observations_total', 'Feature vectors added to the drift histograms'))
+DRIFT_DROPPED = REGISTRY.register(Counter(
+    'sepsis_drift_dropped_total', 'Feature vectors dropped because the drift queue was full'))
+DRIFT_ERRORS = REGISTRY.register(Counter(
+    'sepsis_drift_errors_total', 'Observed batches that could not be added to the drift histograms'))
+
+
+def reference_path(artifact_path):
+    """模型包对应的参考分布文件"""
+    return os.path.splitext(artifact_path)[0] + '.drift.json'
+
+
+def feature_edges(name, values=None):
+    """
+    一个特征的分箱边界：输入控件有options时每个取值一箱，否则在 [min, max] 内等宽分为FINE_BINS箱；
+    没有输入控件定义的特征使用参考数据的0.5%/99.5%分位数作为范围
+    """
+    from scoring import FEATURE_SPECS
+
+    spec = FEATURE_SPECS.get(name)
+    if spec is not None and 'options' in spec:
+        options = np.sort(np.asarray(spec['options'], dtype=np.float64))
+        return np.concatenate([[options[0] - 0.5], (options[1:] + options[:-1]) / 2, [options[-1] + 0.5]])
+    if spec is not None:
+        lo, hi = float(spec['min']), float(spec['max'])
+    else:
+        lo, hi = np.nanquantile(np.asarray(values, dtype=np.float64), [0.005, 0.995])
+        if hi <= lo:
+            hi = lo + 1.0
+    return np.linspace(lo, hi, FINE_BINS + 1)
+
+
+class HistogramLayout:
+    """
+    所有特征的分箱拼接成一个计数向量：特征j占 [offsets[j], offsets[j+1])，
+    其中第一箱为低于下限，最后一箱为高于上限
+    """
+
+    def __init__(self, feature_cols, edges, categorical):
+        self.feature_cols = list(feature_cols)
+        self.edges = [np.asarray(e, dtype=np.float64) for e in edges]
+        self.categorical = list(categorical)
+        sizes = [len(e) + 1 for e in self.edges]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+
+    @property
+    def n_bins(self):
+        return int(self.offsets[-1])
+
+    def bin_counts(self, X):
+        """一批特征向量 (n, n_features) 的箱计数（缺失值不计入）"""
+        X = np.asarray(X, dtype=np.float64).reshape(-1, len(self.feature_cols))
+        indices = []
+        for j, edges in enumerate(self.edges):
+            column = X[:, j]
+            column = column[~np.isnan(column)]
+            index = np.searchsorted(edges, column, side='right')
+            # 等于上限的值计入最后一个范围内的箱
+            index[column == edges[-1]] = len(edges) - 1
+            indices.append(index + self.offsets[j])
+        return np.bincount(np.concatenate(indices), minlength=self.n_bins)
+
+    def split(self, counts):
+        return [counts[self.offsets[j]:self.offsets[j + 1]] for j in range(len(self.feature_cols))]
+
+    def to_dict(self):
+        return {
+            'feature_cols': self.feature_cols,
+            'edges': [e.tolist() for e in self.edges],
+            'categorical': self.categorical,
+        }
+
+
+def quantile_from_counts(edges, counts, q):
+    """直方图上的近似分位数（箱内线性插值；落在超出范围的箱时返回对应的边界）"""
+    total = counts.sum()
+    if total == 0:
+        return float('nan')
+    cumulative = np.cumsum(counts)
+    target = q * total
+    i = int(np.searchsorted(cumulative, target))
+    if i == 0:
+        return float(edges[0])
+    if i >= len(edges):
+        return float(edges[-1])
+    fraction = (target - (cumulative[i] - counts[i])) / counts[i] if counts[i] else 0.0
+    return float(edges[i - 1] + fraction * (edges[i] - edges[i - 1]))
+
+
+def psi(reference_counts, counts):
+    """按参考分布的十分位合并细分箱后的PSI"""
+    ref_total, total = reference_counts.sum(), counts.sum()
+    if ref_total == 0 or total == 0:
+        return float('nan')
+    ref_cdf = np.cumsum(reference_counts) / ref_total
+    # 每个合并后的箱在参考分布中约占1/PSI_BINS；离散特征自然合并为各个取值。
+    # 参考分布有计数的范围两端也作为分界，参考分布集中在一箱时范围外的偏移不会被合并掉
+    boundaries = np.searchsorted(ref_cdf, np.arange(1, PSI_BINS) / PSI_BINS, side='left') + 1
+    support = np.flatnonzero(reference_counts)
+    groups = np.concatenate([[0], boundaries, [support[0], support[-1] + 1, len(counts)]])
+    groups = np.unique(np.clip(groups, 0, len(counts)))
+    expected = np.add.reduceat(reference_counts, groups[:-1]) / ref_total
+    actual = np.add.reduceat(counts, groups[:-1]) / total
+    expected = np.maximum(expected, PSI_EPSILON)
+    actual = np.maximum(actual, PSI_EPSILON)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def ks(reference_counts, counts):
+    """分箱边界处累计比例之差的最大值（KS统计量在箱宽分辨率下的近似）"""
+    ref_total, total = reference_counts.sum(), counts.sum()
+    if ref_total == 0 or total == 0:
+        return float('nan')
+    return float(np.abs(np.cumsum(reference_counts) / ref_total - np.cumsum(counts) / total).max())
+
+
+class DriftReference:
+    """参考分布：分箱定义和训练集上的计数"""
+
+    def __init__(self, layout, counts, metadata=None):
+        self.layout = layout
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.metadata = dict(metadata or {})
+
+    @property
+    def feature_cols(self):
+        return self.layout.feature_cols
+
+    @classmethod
+    def from_data(cls, X, feature_cols, **metadata):
+        X = np.asarray(X, dtype=np.float64)
+        from scoring import FEATURE_SPECS
+
+        edges = [feature_edges(col, X[:, j]) for j, col in enumerate(feature_cols)]
+        categorical = ['options' in FEATURE_SPECS.get(col, {}) for col in feature_cols]
+        layout = HistogramLayout(feature_cols, edges, categorical)
+        metadata.setdefault('n', len(X))
+        metadata.setdefault('created_at', time.strftime('%Y-%m-%dT%H:%M:%S'))
+        return cls(layout, layout.bin_counts(X), metadata)
+
+    def save(self, path):
+        data = {**self.layout.to_dict(), 'counts': self.counts.tolist(), 'metadata': self.metadata}
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        layout = HistogramLayout(data['feature_cols'], data['edges'], data['categorical'])
+        return cls(layout, data['counts'], data.get('metadata'))
+
+    def compare(self, counts):
+        """每个特征的漂移指标表：PSI、KS、样本数、参考/当前的中位数和超出输入范围的比例"""
+        rows = []
+        reference_split = self.layout.split(self.counts)
+        for j, (col, ref, cur) in enumerate(zip(self.feature_cols, reference_split, self.layout.split(counts))):
+            edges, categorical = self.layout.edges[j], self.layout.categorical[j]
+            n = int(cur.sum())
+            rows.append({
+                'Feature': col,
+                'PSI': psi(ref, cur),
+                'KS': ks(ref, cur),
+                'N': n,
+                'Reference Median': float('nan') if categorical else quantile_from_counts(edges, ref, 0.5),
+                'Current Median': float('nan') if categorical else quantile_from_counts(edges, cur, 0.5),
+                'Out of Range': (cur[0] + cur[-1]) / n if n else float('nan'),
+            })
+        return pd.DataFrame(rows)
+
+
+class DriftMonitor:
+    """
+    流式漂移监测：observe()只把数据放入有界队列，后台线程合并到当前时间窗口的计数中
+
+    内存固定为 (n_windows + 1) × 总箱数 个整数
+    """
+
+    def __init__(self, reference, window_seconds=3600, n_windows=24, queue_size=10000):
+        self.window_seconds = window_seconds
+        self.n_windows = n_windows
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.reference = None
+        self.set_reference(reference)
+
+    def set_reference(self, reference):
+        """切换参考分布；分箱定义变化时清空已有计数"""
+        with self._lock:
+            if self.reference is None or self.reference.layout.to_dict() != reference.layout.to_dict():
+                self._window_counts = np.zeros((self.n_windows, reference.layout.n_bins), dtype=np.int64)
+                self._window_ids = np.full(self.n_windows, -1, dtype=np.int64)
+                self._window_n = np.zeros(self.n_windows, dtype=np.int64)
+                self.total_counts = np.zeros(reference.layout.n_bins, dtype=np.int64)
+            self.reference = reference
+
+    @property
+    def feature_cols(self):
+        return self.reference.feature_cols
+
+    def observe(self, X):
+        """记录一批特征向量（DataFrame按特征名取列），不等待处理；队列已满时丢弃"""
+        if hasattr(X, 'columns'):
+            X = X[self.feature_cols]
+        X = np.asarray(X, dtype=np.float64).reshape(-1, len(self.feature_cols))
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(X)
+        except queue.Full:
+            DRIFT_DROPPED.inc(len(X))
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='drift-monitor', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batches = [self._queue.get()]
+            # 一次合并队列中已有的全部数据
+            while True:
+                try:
+                    batches.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._update_batches(batches)
+            finally:
+                for _ in batches:
+                    self._queue.task_done()
+
+    def _update_batches(self, batches):
+        """合并一组批次；出错时逐批重试，只丢弃出错的批次（计数并打印），后台线程继续运行"""
+        try:
+            self._update(np.vstack(batches))
+            return
+        except Exception:
+            if len(batches) == 1:
+                self._report_error(batches[0])
+                return
+        for X in batches:
+            try:
+                self._update(X)
+            except Exception:
+                self._report_error(X)
+
+    @staticmethod
+    def _report_error(X):
+        import traceback
+
+        DRIFT_ERRORS.inc()
+        print(f"漂移监测丢弃了一批数据（{len(X)}行）:")
+        traceback.print_exc()
+
+    def _update(self, X, now=None):
+        with self._lock:
+            counts = self.reference.layout.bin_counts(X)
+            window_id = int((time.time() if now is None else now) // self.window_seconds)
+            slot = window_id % self.n_windows
+            if self._window_ids[slot] != window_id:
+                self._window_counts[slot] = 0
+                self._window_n[slot] = 0
+                self._window_ids[slot] = window_id
+            self._window_counts[slot] += counts
+            self._window_n[slot] += len(X)
+            self.total_counts += counts
+        DRIFT_OBSERVATIONS.inc(len(X))
+
+    def flush(self):
+        """等待队列中的数据全部合并（批量脚本结束前调用）"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def _live_windows(self, now=None):
+        window_id = int((time.time() if now is None else now) // self.window_seconds)
+        return self._window_ids > window_id - self.n_windows
+
+    def recent_counts(self, now=None):
+        """最近n_windows个窗口的计数之和"""
+        with self._lock:
+            return self._window_counts[self._live_windows(now)].sum(axis=0)
+
+    def recent_observations(self, now=None):
+        """最近n_windows个窗口中的特征向量数"""
+        with self._lock:
+            return int(self._window_n[self._live_windows(now)].sum())
+
+    def scores(self, recent=True):
+        """每个特征的漂移指标表（recent=False时使用进程启动以来的累计计数）"""
+        counts = self.recent_counts() if recent else self.total_counts.copy()
+        return self.reference.compare(counts)
+
+    def collect(self):
+        """/metrics 的指标：最近窗口每个特征的PSI和KS"""
+        table = self.scores(recent=True)
+        table = table[table['N'] > 0]
+        labels = [(('feature', col),) for col in table['Feature']]
+        return [
+            ('sepsis_drift_psi', 'gauge', 'Population stability index of each input feature over the recent window',
+             list(zip(labels, table['PSI']))),
+            ('sepsis_drift_ks', 'gauge', 'Kolmogorov-Smirnov distance of each input feature over the recent window',
+             list(zip(labels, table['KS']))),
+            ('sepsis_drift_recent_observations', 'gauge', 'Feature vectors in the recent drift window',
+             [((), self.recent_observations())]),
+        ]
+
+
+_monitor = None
+_monitor_artifact = None
+_monitor_enabled = False
+_monitor_lock = threading.Lock()
+
+
+def load_reference_for(artifact):
+    """模型包旁边的参考分布，不存在时返回None"""
+    path = getattr(artifact, 'path', None)
+    if not path or not os.path.exists(reference_path(path)):
+        return None
+    return DriftReference.load(reference_path(path))
+
+
+def monitor_for(artifact):
+    """
+    进程内共享的漂移监测器，参考分布取自artifact旁边的文件（模型切换后重新读取）；
+    没有参考分布时返回None。只在模型包变化时读取文件，可以在每次请求时调用
+    """
+    global _monitor, _monitor_artifact, _monitor_enabled
+    if artifact is None:
+        return None
+    with _monitor_lock:
+        if artifact is not _monitor_artifact:
+            _monitor_artifact = artifact
+            try:
+                reference = load_reference_for(artifact)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"漂移参考分布读取失败，不监测输入漂移: {e}")
+                reference = None
+            _monitor_enabled = reference is not None
+            if reference is not None:
+                if _monitor is None:
+                    _monitor = DriftMonitor(reference)
+                    REGISTRY.register_collector(_monitor.collect)
+                else:
+                    _monitor.set_reference(reference)
+        return _monitor if _monitor_enabled else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Input drift reference and report")
+    parser.add_argument('command', choices=['reference', 'report'])
+    parser.add_argument('data', nargs='?', default=None, help="数据文件（reference默认训练集，report必须指定）")
+    parser.add_argument('--model', default='rf_model.bin', help="模型包（参考分布保存在其旁边）")
+    args = parser.parse_args()
+
+    from model_artifact import open_artifact
+    from project_data import TRAIN_PATH, load_dataset
+
+    artifact = open_artifact(args.model)
+    feature_cols = list(artifact.forest.feature_names_in_)
+    path = reference_path(args.model)
+    if args.command == 'reference':
+        data_path = args.data or TRAIN_PATH
+        X = load_dataset(data_path, feature_cols)[feature_cols].to_numpy(dtype=np.float64)
+        reference = DriftReference.from_data(X, feature_cols, source=os.path.basename(data_path))
+        reference.save(path)
+        print(f"✓ 参考分布已保存到: {path} ({len(X)}个样本, {reference.layout.n_bins}个箱)")
+        return
+
+    if args.data is None:
+        parser.error("report需要指定数据文件")
+    reference = DriftReference.load(path)
+    X = load_dataset(args.data, feature_cols)[feature_cols].to_numpy(dtype=np.float64)
+    table = reference.compare(reference.layout.bin_counts(X)).sort_values('PSI', ascending=False)
+    print(f"{args.data} 相对参考分布（{reference.metadata.get('source', path)}）的漂移，{len(X)}个样本:")
+    print(table.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    n_alert = int((table['PSI'] > PSI_ALERT).sum())
+    n_warning = int(((table['PSI'] > PSI_WARNING) & (table['PSI'] <= PSI_ALERT)).sum())
+    print(f"PSI > {PSI_ALERT}: {n_alert}个特征, {PSI_WARNING}~{PSI_ALERT}: {n_warning}个特征")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+外部测试集评估：AUC、AUPRC、Brier分数和校准曲线，以及bootstrap置信区间
+
+测试集只评分一次。bootstrap不在Python循环中逐次重新计算指标，而是每次生成一块
+(replicates, n) 的重抽样下标矩阵，转换为每个样本被抽中的次数（权重），
+所有指标都写成按预测值排序后的加权累计和：
+    AUC   = Σ_g 正例权重_g × (得分更低的负例权重 + 0.5 × 同分负例权重) / (正例总权重 × 负例总权重)   （基于秩）
+    AUPRC = Σ_g 正例权重_g / 正例总权重 × 截至g的精确率   （与sklearn.metrics.average_precision_score一致）
+    Brier = 权重 @ (p - y)² / n
+相同预测值归为一组（与秩方法的平均秩一致）。每块的内存为 chunk_size × n，
+默认2000次重抽样在数千个样本上几秒内完成。
+
+用法:
+    python evaluation.py --model rf_model.bin --data mimiciii_test1.xlsx --n-boot 2000 --plot calibration.png
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_N_BOOT = 2000
+DEFAULT_CHUNK_SIZE = 250
+CALIBRATION_BINS = 10
+
+
+class _SortedScores:
+    """按预测值升序排序并把相同预测值归组，供各次重抽样共用"""
+
+    def __init__(self, proba, y):
+        proba = np.asarray(proba, dtype=np.float64)
+        y = np.asarray(y).astype(bool)
+        self.order = np.argsort(proba, kind='stable')
+        sorted_proba = proba[self.order]
+        self.group_starts = np.flatnonzero(np.r_[True, sorted_proba[1:] != sorted_proba[:-1]])
+        self.positive = y[self.order]
+
+    def group_sums(self, weights, mask):
+        """(B, n) 权重中mask选中样本在每个同分组内的和，结果 (B, 组数)，按预测值升序"""
+        return np.add.reduceat(weights[:, self.order] * mask, self.group_starts, axis=1)
+
+
+def _binary_outcome(y):
+    """结局转换为0/1浮点数组；其他取值（如1/2或字符串标签）报错，不默认把非零值当作阳性"""
+    y = np.asarray(y)
+    labels = np.unique(y)
+    if y.dtype != bool and not (y.dtype.kind in 'iuf' and np.isin(labels, [0, 1]).all()):
+        raise ValueError(f"Outcome labels must be 0/1, got {labels.tolist()[:10]}")
+    return y.astype(np.float64)
+
+
+def _auc(pos, neg):
+    """按预测值升序的分组正/负例权重 -> AUC（秩方法，同分计0.5）"""
+    neg_below = np.cumsum(neg, axis=1) - neg
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (pos * (neg_below + 0.5 * neg)).sum(axis=1) / (pos.sum(axis=1) * neg.sum(axis=1))
+
+
+def _auprc(pos, neg):
+    """平均精确率：阈值从高到低，每个同分组为一个阈值"""
+    pos, neg = pos[:, ::-1], neg[:, ::-1]
+    tp = np.cumsum(pos, axis=1)
+    fp = np.cumsum(neg, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        return (pos * precision).sum(axis=1) / pos.sum(axis=1)
+
+
+def _calibration_bin(proba, n_bins):
+    return np.minimum((np.asarray(proba) * n_bins).astype(np.int64), n_bins - 1)
+
+
+def weighted_metrics(proba, y, weights, n_bins=CALIBRATION_BINS, sorted_scores=None):
+    """
+    每一行权重（样本被抽中的次数）下的指标
+
+    返回 (指标字典 {名称: (B,)}, 校准曲线 {'predicted'/'observed'/'count': (B, n_bins)})
+    """
+    proba = np.asarray(proba, dtype=np.float64)
+    y = _binary_outcome(y)
+    weights = np.asarray(weights, dtype=np.float64)
+    scores = sorted_scores or _SortedScores(proba, y)
+    positive = scores.positive.astype(np.float64)
+    pos = scores.group_sums(weights, positive)
+    neg = scores.group_sums(weights, 1.0 - positive)
+
+    total = weights.sum(axis=1)
+    bins = np.eye(n_bins)[_calibration_bin(proba, n_bins)]     # (n, n_bins)
+    count = weights @ bins
+    with np.errstate(invalid='ignore', divide='ignore'):
+        predicted = (weights * proba) @ bins / count
+        observed = (weights * y) @ bins / count
+        ece = np.nansum(count * np.abs(predicted - observed), axis=1) / total
+    metrics = {
+        'AUC': _auc(pos, neg),
+        'AUPRC': _auprc(pos, neg),
+        'Brier': weights @ ((proba - y) ** 2) / total,
+        'ECE': ece,
+        'Prevalence': weights @ y / total,
+    }
+    return metrics, {'predicted': predicted, 'observed': observed, 'count': count}
+
+
+def bootstrap_weights(n, n_boot, chunk_size=DEFAULT_CHUNK_SIZE, seed=0):
+    """逐块生成重抽样下标矩阵 (chunk, n)，返回每个样本被抽中次数的矩阵"""
+    rng = np.random.default_rng(seed)
+    for start in range(0, n_boot, chunk_size):
+        size = min(chunk_size, n_boot - start)
+        indices = rng.integers(0, n, size=(size, n))
+        # 每一行的下标加上行偏移后一次bincount
+        flat = (indices + (np.arange(size) * n)[:, None]).ravel()
+        yield np.bincount(flat, minlength=size * n).reshape(size, n)
+
+
+def bootstrap_evaluation(proba, y, n_boot=DEFAULT_N_BOOT, chunk_size=DEFAULT_CHUNK_SIZE, seed=0,
+                         confidence=0.95, n_bins=CALIBRATION_BINS):
+    """
+    点估计和bootstrap百分位置信区间
+
+    返回 (指标表DataFrame, 校准曲线表DataFrame)；重抽样中只有一类样本时该次的AUC/AUPRC为NaN，不计入区间
+    """
+    proba = np.asarray(proba, dtype=np.float64)
+    y = _binary_outcome(y)
+    if len(np.unique(y)) != 2:
+        raise ValueError("Evaluation needs both outcome classes in the test set")
+    scores = _SortedScores(proba, y)
+    estimate, estimate_curve = weighted_metrics(proba, y, np.ones((1, len(y))), n_bins, scores)
+
+    replicates = {name: [] for name in estimate}
+    observed_replicates = []
+    for weights in bootstrap_weights(len(y), n_boot, chunk_size, seed):
+        metrics, curve = weighted_metrics(proba, y, weights, n_bins, scores)
+        for name, values in metrics.items():
+            replicates[name].append(values)
+        observed_replicates.append(curve['observed'])
+
+    alpha = (1 - confidence) / 2 * 100
+    rows = []
+    for name, values in replicates.items():
+        values = np.concatenate(values)
+        low, high = np.nanpercentile(values, [alpha, 100 - alpha])
+        rows.append({'metric': name, 'estimate': float(estimate[name][0]), 'ci_low': low, 'ci_high': high,
+                     'std': float(np.nanstd(values)), 'n_boot': int(np.isfinite(values).sum())})
+    metrics_table = pd.DataFrame(rows)
+
+    observed_replicates = np.vstack(observed_replicates)
+    with np.errstate(invalid='ignore'):
+        observed_low, observed_high = np.nanpercentile(observed_replicates, [alpha, 100 - alpha], axis=0)
+    edges = np.linspace(0, 1, n_bins + 1)
+    calibration = pd.DataFrame({
+        'bin_low': edges[:-1],
+        'bin_high': edges[1:],
+        'n': estimate_curve['count'][0].astype(np.int64),
+        'mean_predicted': estimate_curve['predicted'][0],
+        'observed': estimate_curve['observed'][0],
+        'observed_ci_low': observed_low,
+        'observed_ci_high': observed_high,
+    })
+    return metrics_table, calibration
+
+
+def plot_calibration(calibration, path, title="Calibration"):
+    """校准曲线（观察到的阳性比例及其置信区间 vs 平均预测概率）保存为图片"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    curve = calibration[calibration['n'] > 0]
+    fig, ax = plt.subplots(figsize=(5, 5))
+    ax.plot([0, 1], [0, 1], linestyle='--', color='gray', linewidth=1)
+    ax.errorbar(curve['mean_predicted'], curve['observed'],
+                yerr=[curve['observed'] - curve['observed_ci_low'], curve['observed_ci_high'] - curve['observed']],
+                marker='o', capsize=3)
+    ax.set_xlim(0, 1)
+    ax.set_ylim(0, 1)
+    ax.set_xlabel("Mean predicted probability")
+    ax.set_ylabel("Observed fraction of positives")
+    ax.set_title(title)
+    fig.tight_layout()
+    fig.savefig(path, dpi=150)
+    plt.close(fig)
+
+
+def print_report(metrics_table, calibration, confidence=0.95):
+    print(f"指标（{confidence:.0%} bootstrap置信区间，{int(metrics_table['n_boot'].max())}次重抽样）:")
+    for row in metrics_table.itertuples():
+        print(f"  {row.metric:<10} {row.estimate:.4f}  [{row.ci_low:.4f}, {row.ci_high:.4f}]")
+    print("校准曲线:")
+    print(calibration.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+
+
+def main():
+    from model_artifact import open_artifact
+    from project_data import TEST_PATH, dataset_columns, detect_target_col, load_dataset
+
+    parser = argparse.ArgumentParser(description="Evaluate the model on the external test set with bootstrap CIs")
+    parser.add_argument('--model', default='rf_model.bin', help="模型包")
+    parser.add_argument('--data', default=TEST_PATH, help="测试集文件（默认MIMIC-III测试集）")
+    parser.add_argument('--target', default=None, help="结局列（默认按列名自动识别）")
+    parser.add_argument('--n-boot', type=int, default=DEFAULT_N_BOOT, help="bootstrap重抽样次数")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="每块的重抽样次数（限制内存）")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--output', default='evaluation_report.csv', help="指标表")
+    parser.add_argument('--calibration', default='calibration_curve.csv', help="校准曲线表")
+    parser.add_argument('--plot', default=None, help="校准曲线图片（如calibration.png）")
+    args = parser.parse_args()
+
+    artifact = open_artifact(args.model)
+    forest = artifact.forest
+    feature_cols = list(forest.feature_names_in_)
+    target = args.target or detect_target_col([col for col in dataset_columns(args.data) if col not in feature_cols])
+    data = load_dataset(args.data, feature_cols + [target])
+
+    start = time.perf_counter()
+    proba = forest.predict_proba(data[feature_cols])[:, 1]
+    score_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    metrics_table, calibration = bootstrap_evaluation(proba, data[target], args.n_boot, args.chunk_size, args.seed,
+                                                      args.confidence)
+    bootstrap_seconds = time.perf_counter() - start
+
+    print(f"测试集: {args.data} ({len(data)}个样本, 结局列 {target}), 模型版本 {artifact.model_version}")
+    print_report(metrics_table, calibration, args.confidence)
+    print(f"用时: 评分 {score_seconds:.2f}s, bootstrap {bootstrap_seconds:.2f}s")
+    metrics_table.to_csv(args.output, index=False)
+    calibration.to_csv(args.calibration, index=False)
+    print(f"✓ 指标表已保存到: {args.output}, 校准曲线已保存到: {args.calibration}")
+    if args.plot:
+        plot_calibration(calibration, args.plot, title=f"Calibration ({target})")
+        print(f"✓ 校准曲线图已保存到: {args.plot}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+随机森林扁平数组推理引擎
+
+把sklearn RandomForestClassifier中每棵树的特征、阈值、左右子节点和叶节点正类概率
+打包成几段连续的NumPy数组，一次向量化地对一批样本遍历全部树，
+避免predict_proba对2500棵树逐棵分派。预测结果与sklearn一致。
+
+遍历内核优先使用numba编译（shap的依赖，通常已安装），不可用时退回纯NumPy实现。
+"""
+import pickle
+
+import numpy as np
+
+try:
+    from numba import config as numba_config, njit, prange
+    # 在后台线程中启动并行内核后，TBB线程层会使解释器退出时挂起，优先使用OpenMP
+    numba_config.THREADING_LAYER_PRIORITY = ['omp', 'tbb', 'workqueue']
+except ImportError:  # numba不可用时使用NumPy实现
+    njit = None
+
+# 每个分块中 (样本数 × 树数) 的上限，控制NumPy遍历时中间数组的内存
+_CHUNK_ELEMENTS = 1 << 20
+
+
+# 编译内核按行分块：块内逐棵树遍历所有行，使同一棵树的节点留在缓存中。
+# 节点编号使用无符号整数，省去numba对负下标的检查
+_ROW_BLOCK = 1024
+
+if njit is not None:
+    @njit(cache=True, parallel=True)
+    def _apply_kernel(X, roots, feature, threshold, left, right, missing_left, out):
+        n_rows = X.shape[0]
+        for b in prange((n_rows + _ROW_BLOCK - 1) // _ROW_BLOCK):
+            start = b * _ROW_BLOCK
+            stop = min(start + _ROW_BLOCK, n_rows)
+            for t in range(roots.shape[0]):
+                for i in range(start, stop):
+                    node = roots[t]
+                    while left[node] != node:
+                        x = X[i, feature[node]]
+                        if x <= threshold[node] or (np.isnan(x) and missing_left[node]):
+                            node = left[node]
+                        else:
+                            node = right[node]
+                    out[i, t] = node
+
+    @njit(cache=True, parallel=True)
+    def _predict_kernel(X, roots, feature, threshold, left, right, missing_left, value, out):
+        n_rows = X.shape[0]
+        for b in prange((n_rows + _ROW_BLOCK - 1) // _ROW_BLOCK):
+            start = b * _ROW_BLOCK
+            stop = min(start + _ROW_BLOCK, n_rows)
+            # 按树的顺序累加后再取平均，与sklearn的求和顺序相同
+            for i in range(start, stop):
+                out[i] = 0.0
+            for t in range(roots.shape[0]):
+                for i in range(start, stop):
+                    node = roots[t]
+                    while left[node] != node:
+                        x = X[i, feature[node]]
+                        if x <= threshold[node] or (np.isnan(x) and missing_left[node]):
+                            node = left[node]
+                        else:
+                            node = right[node]
+                    out[i] += value[node]
+            for i in range(start, stop):
+                out[i] /= roots.shape[0]
+
+
+class PackedForest:
+    """打包后的随机森林，接口与RandomForestClassifier.predict_proba兼容"""
+
+    def __init__(self, roots, feature, threshold, left, right, missing_left, value,
+                 max_depth, classes, n_features, feature_names=None, cover=None):
+        self.roots = roots                  # 每棵树根节点的全局编号 (n_trees,)
+        self.feature = feature              # 分裂特征，叶节点为0 (n_nodes,)
+        self.threshold = threshold          # 分裂阈值，叶节点为+inf (n_nodes,)
+        self.left = left                    # 左子节点全局编号，叶节点指向自身
+        self.right = right                  # 右子节点全局编号，叶节点指向自身
+        self.missing_left = missing_left    # 缺失值是否走左子树
+        self.value = value                  # 节点正类概率 (n_nodes,)
+        self.cover = cover                  # 节点的（加权）训练样本数，TreeSHAP使用
+        self.max_depth = int(max_depth)
+        self.classes_ = np.asarray(classes)
+        self.feature_names_in_ = None if feature_names is None else np.asarray(feature_names, dtype=object)
+        self.n_estimators = len(roots)
+        self.n_features_in_ = int(n_features)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """从训练好的RandomForestClassifier打包"""
+        classes = np.asarray(model.classes_)
+        # 正类取标签1所在列，否则取最后一列
+        pos = int(np.flatnonzero(classes == 1)[0]) if np.any(classes == 1) else len(classes) - 1
+
+        roots, features, thresholds, lefts, rights, missings, values, covers = [], [], [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for est in model.estimators_:
+            tree = est.tree_
+            n = tree.node_count
+            ids = np.arange(offset, offset + n)
+            is_leaf = tree.children_left == -1
+
+            feature = np.where(is_leaf, 0, tree.feature)
+            # 叶节点阈值设为+inf并指向自身，遍历时停留在叶节点
+            threshold = np.where(is_leaf, np.inf, tree.threshold)
+            left = np.where(is_leaf, ids, tree.children_left + offset)
+            right = np.where(is_leaf, ids, tree.children_right + offset)
+            missing = getattr(tree, 'missing_go_to_left', None)
+            missing = np.zeros(n, dtype=bool) if missing is None else np.asarray(missing, dtype=bool) & ~is_leaf
+
+            # 与DecisionTreeClassifier.predict_proba相同的归一化
+            node_value = tree.value[:, 0, :]
+            prob = node_value[:, pos] / node_value.sum(axis=1)
+
+            roots.append(offset)
+            features.append(feature)
+            thresholds.append(threshold)
+            lefts.append(left)
+            rights.append(right)
+            missings.append(missing)
+            values.append(prob)
+            covers.append(tree.weighted_n_node_samples)
+            offset += n
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            roots=np.asarray(roots, dtype=np.uint32),
+            feature=np.concatenate(features).astype(np.uint32),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            left=np.concatenate(lefts).astype(np.uint32),
+            right=np.concatenate(rights).astype(np.uint32),
+            missing_left=np.concatenate(missings),
+            value=np.concatenate(values).astype(np.float64),
+            max_depth=max_depth,
+            classes=classes,
+            n_features=model.n_features_in_,
+            feature_names=getattr(model, 'feature_names_in_', None),
+            cover=np.concatenate(covers).astype(np.float64),
+        )
+
+    def select_trees(self, tree_indices):
+        """取出部分树组成新的打包森林（节点重新编号，预测为所选树的平均）"""
+        tree_indices = np.asarray(tree_indices, dtype=np.intp)
+        n_nodes = len(self.feature)
+        tree_ends = np.append(self.roots[1:], n_nodes).astype(np.intp)
+        starts = self.roots.astype(np.intp)[tree_indices]
+        sizes = tree_ends[tree_indices] - starts
+        new_roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.intp)
+
+        # 每个新节点对应的原节点编号，以及所在树的编号平移量
+        nodes = np.repeat(starts - new_roots, sizes) + np.arange(sizes.sum())
+        shift = np.repeat(starts - new_roots, sizes)
+        return PackedForest(
+            roots=new_roots.astype(np.uint32),
+            feature=self.feature[nodes],
+            threshold=self.threshold[nodes],
+            left=(self.left[nodes].astype(np.intp) - shift).astype(np.uint32),
+            right=(self.right[nodes].astype(np.intp) - shift).astype(np.uint32),
+            missing_left=self.missing_left[nodes],
+            value=self.value[nodes],
+            max_depth=self.max_depth,
+            classes=self.classes_,
+            n_features=self.n_features_in_,
+            feature_names=self.feature_names_in_,
+            cover=None if self.cover is None else self.cover[nodes],
+        )
+
+    def _as_matrix(self, X):
+        """转换为float32矩阵（与sklearn树遍历时的精度一致），按训练时的列顺序"""
+        if hasattr(X, 'columns') and self.feature_names_in_ is not None:
+            X = X[list(self.feature_names_in_)]
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has {X.shape[1]} features, but PackedForest is expecting {self.n_features_in_} features")
+        return X
+
+    def apply(self, X, tree_indices=None):
+        """返回每个样本在每棵树（或tree_indices指定的树）中落入的叶节点全局编号 (n_samples, n_trees)"""
+        X = self._as_matrix(X)
+        roots = self.roots if tree_indices is None else self.roots[np.asarray(tree_indices, dtype=np.intp)]
+        leaves = np.empty((X.shape[0], len(roots)), dtype=np.intp)
+        if njit is not None:
+            _apply_kernel(X, roots, self.feature, self.threshold, self.left, self.right,
+                          self.missing_left, leaves)
+            return leaves
+        chunk = max(1, _CHUNK_ELEMENTS // max(1, len(roots)))
+        for start in range(0, X.shape[0], chunk):
+            leaves[start:start + chunk] = self._walk(X[start:start + chunk], roots)
+        return leaves
+
+    def _walk(self, X, roots=None):
+        """NumPy实现：对一个分块同时遍历所有树，到达叶节点的(样本, 树)对及时移出活动集合"""
+        roots = self.roots if roots is None else roots
+        n_rows, n_features = X.shape
+        n_trees = len(roots)
+        flat_x = X.ravel()
+        leaves = np.empty(n_rows * n_trees, dtype=np.intp)
+        pos = np.arange(n_rows * n_trees)
+        node = np.tile(roots, n_rows)
+        row_base = np.repeat(np.arange(n_rows) * n_features, n_trees)
+        check_missing = np.isnan(X).any()
+        while pos.size:
+            x = flat_x[row_base + self.feature[node]]
+            # float32与float64比较时提升为float64，与sklearn的 X[i, f] <= threshold 相同
+            go_left = x <= self.threshold[node]
+            if check_missing:
+                go_left |= np.isnan(x) & self.missing_left[node]
+            nxt = np.where(go_left, self.left[node], self.right[node])
+            done = self.left[nxt] == nxt
+            leaves[pos[done]] = nxt[done]
+            keep = ~done
+            pos, node, row_base = pos[keep], nxt[keep], row_base[keep]
+        return leaves.reshape(n_rows, n_trees)
+
+    def proba_from_leaves(self, leaves):
+        """由一个样本在每棵树中的叶节点计算正类概率（按树的顺序依次累加，与predict_proba的求和顺序相同）"""
+        return float(np.cumsum(self.value[leaves])[-1] / self.n_estimators)
+
+    def predict_proba(self, X):
+        """预测概率 (n_samples, 2)，列顺序与classes_一致"""
+        X = self._as_matrix(X)
+        p1 = np.empty(X.shape[0], dtype=np.float64)
+        if njit is not None:
+            _predict_kernel(X, self.roots, self.feature, self.threshold, self.left, self.right,
+                            self.missing_left, self.value, p1)
+        else:
+            chunk = max(1, _CHUNK_ELEMENTS // max(1, self.n_estimators))
+            for start in range(0, X.shape[0], chunk):
+                # 按树的顺序依次累加（与编译内核和proba_from_leaves逐位相同）
+                p1[start:start + chunk] = np.cumsum(self.value[self._walk(X[start:start + chunk])],
+                                                    axis=1)[:, -1] / self.n_estimators
+        proba = np.column_stack([1.0 - p1, p1])
+        if len(self.classes_) == 2 and self.classes_[0] == 1:
+            proba = proba[:, ::-1]
+        return proba
+
+    def predict(self, X):
+        """预测类别"""
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def load_packed_forest(path='rf_model.pkl'):
+    """读取pickle格式的随机森林并打包"""
+    with open(path, 'rb') as f:
+        model = pickle.load(f)
+    return PackedForest.from_sklearn(model)
@@ -5,6 +5,8 @@ import shap
 import matplotlib.pyplot as plt
 import matplotlib
 matplotlib.use('Agg')  # 使用非交互式后端
+from model_artifact import open_artifact
+from project_data import TEST_PATH, load_dataset
 
 # 设置中文字体
 plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'Arial Unicode MS']
@@ -12,15 +14,10 @@ plt.rcParams['axes.unicode_minus'] = False
 
 print("加载模型和解释器...")
 try:
-    # 加载模型
-    with open('rf_model.pkl', 'rb') as f:
-        model = pickle.load(f)
-    print("✓ 模型加载成功")
-    
-    # 加载SHAP解释器
-    with open('shap_explainer.pkl', 'rb') as f:
-        explainer = pickle.load(f)
-    print("✓ SHAP解释器加载成功")
+    # 加载模型包（打包森林 + SHAP解释器）
+    artifact = open_artifact('rf_model.bin')
+    model, explainer = artifact.forest, artifact.explainer
+    print(f"✓ 模型包加载成功 (版本 {artifact.model_version}, 共{model.n_estimators}棵树)")
     
     # 加载特征信息
     with open('feature_info.pkl', 'rb') as f:
@@ -37,8 +34,7 @@ print(f"特征列: {feature_cols}")
 
 # 读取测试集的一个样本作为示例
 print("\n读取测试集样本...")
-test_path = r"spesis and pi\parameters\mimiciii_test1.xlsx"
-test_df = pd.read_excel(test_path)
+test_df = load_dataset(TEST_PATH, feature_cols)
 print(f"测试集形状: {test_df.shape}")
 
 # 选择一个样本（可以选择第一个，或者随机选择一个）
@@ -46,40 +42,13 @@ sample_idx = 0
 sample_data = test_df[feature_cols].iloc[[sample_idx]].copy()
 print(f"\n使用样本索引: {sample_idx}")
 print(f"样本特征值:\n{sample_data.iloc[0]}")
+print(f"样本风险评分: {model.predict_proba(sample_data)[0, 1] * 100:.2f}%")
 
 # 计算SHAP值
 print("\n计算SHAP值...")
-shap_values = explainer.shap_values(sample_data)
-
-# 处理SHAP值
-if isinstance(shap_values, list):
-    shap_values_array = shap_values[1]  # 正类的SHAP值
-    expected_value = explainer.expected_value[1] if isinstance(explainer.expected_value, (list, np.ndarray)) else explainer.expected_value
-else:
-    shap_values_array = shap_values
-    expected_value = explainer.expected_value
-
-# 确保是1维数组，并且长度与特征数量匹配
-if shap_values_array.ndim > 1:
-    # 如果是2维，取第一行
-    shap_values_1d = shap_values_array[0].flatten()
-else:
-    shap_values_1d = shap_values_array.flatten()
-
-# 如果长度不匹配，只取前len(feature_cols)个
-if len(shap_values_1d) != len(feature_cols):
-    print(f"警告: SHAP值长度({len(shap_values_1d)})与特征数量({len(feature_cols)})不匹配，将截取或填充")
-    if len(shap_values_1d) > len(feature_cols):
-        shap_values_1d = shap_values_1d[:len(feature_cols)]
-    else:
-        # 如果SHAP值太少，用0填充
-        shap_values_1d = np.pad(shap_values_1d, (0, len(feature_cols) - len(shap_values_1d)), 'constant')
-
-# 确保expected_value是标量
-if isinstance(expected_value, (list, np.ndarray)):
-    expected_value = float(expected_value[0] if len(expected_value) > 0 else expected_value)
-else:
-    expected_value = float(expected_value)
+# 批量TreeSHAP直接返回正类的 (n_samples, n_features) 矩阵和标量基准值
+shap_values_1d = explainer.shap_values(sample_data)[0]
+expected_value = explainer.expected_value
 
 print(f"SHAP值形状: {shap_values_1d.shape}")
 print(f"特征数量: {len(feature_cols)}")
@@ -97,10 +66,6 @@ explanation = shap.Explanation(
 # 生成SHAP力图
 print("\n生成SHAP力图...")
 try:
-    # 确保长度匹配
-    if len(shap_values_1d) != len(feature_cols):
-        raise ValueError(f"长度不匹配: {len(shap_values_1d)} vs {len(feature_cols)}")
-    
     # 尝试使用新API
     try:
         plt.figure(figsize=(14, 6))
@@ -147,10 +112,6 @@ except Exception as e:
 # 生成SHAP瀑布图
 print("\n生成SHAP瀑布图...")
 try:
-    # 确保长度匹配
-    if len(shap_values_1d) != len(feature_cols):
-        raise ValueError(f"长度不匹配: {len(shap_values_1d)} vs {len(feature_cols)}")
-    
     plt.figure(figsize=(14, 10))
     try:
         shap.plots.waterfall(explanation, show=False)
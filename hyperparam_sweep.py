@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+随机森林超参数搜索（多进程并行 + warm_start逐步增加树数）
+
+对 mtry / min.node.size / min.bucket / max.depth 的每个组合只训练一个森林：
+用warm_start依次增加到 num.trees 网格中的每个树数（检查点），已有的树不重新训练。
+每个检查点记录验证集AUC（只对新增的树做预测并累加）和打包森林的推理延迟。
+验证集默认从训练集中按结局分层划出（--validation-fraction），不使用外部测试集，
+否则之后在测试集上报告的AUC和置信区间会因调参而偏高。
+
+组合分配到进程池中运行，每个进程的线程数（sklearn n_jobs、numba、BLAS）受 --n-jobs 限制，
+进程数 × 每进程线程数不超过CPU核数，避免超额占用。
+
+输出全部检查点的结果表 sweep_results.csv，以及AUC-推理延迟的Pareto前沿 sweep_pareto.csv。
+
+用法:
+    python hyperparam_sweep.py --workers 4 --n-jobs 2 --mtry 4,6,8 --min-node-size 20,50
+"""
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from project_data import (FEATURE_COLS, TEST_PATH, TRAIN_PATH, R_PARAM_NAMES, convert_r_param, dataset_columns,
+                          detect_target_col, load_dataset, split_holdout)
+
+# 默认搜索网格（R语言参数名，与参数文件一致）
+DEFAULT_GRID = {
+    'num.trees': [100, 250, 500, 1000, 2500],
+    'mtry': [4, 6, 8],
+    'min.node.size': [20, 50, 100],
+    'min.bucket': [30],
+    'max.depth': [20, 50],
+}
+
+# 进程内共享的数据，由进程池初始化函数设置，避免每个任务重复传输
+_worker_data = None
+
+
+def _init_worker(data, n_jobs):
+    """限制每个工作进程的线程数，并保存训练/验证数据"""
+    global _worker_data
+    _worker_data = data
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(n_jobs)
+    try:
+        import numba
+        numba.set_num_threads(min(n_jobs, numba.config.NUMBA_NUM_THREADS))
+    except ImportError:
+        pass
+
+
+def _median_ms(func, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times))
+
+
+def run_config(config, checkpoints, n_jobs, random_state=42, latency_rows=1000, repeats=20):
+    """
+    训练一个参数组合，在每个树数检查点记录验证集AUC和推理延迟
+
+    config: R语言参数名到取值的字典（不含num.trees）
+    返回每个检查点一行的字典列表
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.metrics import roc_auc_score
+    from forest_engine import PackedForest
+
+    X_train, y_train, X_val, y_val = _worker_data
+    params = {R_PARAM_NAMES[name]: convert_r_param(name, value) for name, value in config.items()}
+    model = RandomForestClassifier(warm_start=True, random_state=random_state, n_jobs=n_jobs, **params)
+
+    X_val32 = np.ascontiguousarray(X_val, dtype=np.float32)
+    latency_X = X_val32[np.arange(latency_rows) % len(X_val32)]
+    val_sum = np.zeros(len(X_val32))
+    fit_seconds = 0.0
+    rows = []
+    for n_trees in sorted(checkpoints):
+        n_prev = len(getattr(model, 'estimators_', []))
+        start = time.perf_counter()
+        model.set_params(n_estimators=n_trees)
+        model.fit(X_train, y_train)
+        fit_seconds += time.perf_counter() - start
+
+        # 只对新增的树预测，累加得到森林的平均概率
+        pos = int(np.flatnonzero(model.classes_ == 1)[0]) if np.any(model.classes_ == 1) else -1
+        for est in model.estimators_[n_prev:]:
+            val_sum += est.predict_proba(X_val32)[:, pos]
+        proba = val_sum / n_trees
+
+        packed = PackedForest.from_sklearn(model)
+        packed.predict_proba(X_val32[:1])  # 排除编译/首次调用开销
+        rows.append({
+            **config,
+            'num.trees': n_trees,
+            'auc': roc_auc_score(y_val, proba),
+            'fit_seconds': fit_seconds,
+            'predict_ms_single': _median_ms(lambda: packed.predict_proba(X_val32[:1]), repeats),
+            f'predict_ms_{latency_rows}': _median_ms(lambda: packed.predict_proba(latency_X), max(1, repeats // 5)),
+            'n_nodes': len(packed.feature),
+        })
+    return rows
+
+
+def pareto_frontier(results, score='auc', cost='predict_ms_single'):
+    """AUC越高越好、推理延迟越低越好：返回不被其他检查点同时在两方面超过的行"""
+    ordered = results.sort_values([cost, score], ascending=[True, False])
+    best = -np.inf
+    keep = []
+    for idx, value in zip(ordered.index, ordered[score]):
+        if value > best:
+            keep.append(idx)
+            best = value
+    return ordered.loc[keep].reset_index(drop=True)
+
+
+def run_sweep(X_train, y_train, X_val, y_val, grid=None, workers=None, n_jobs=None, random_state=42):
+    """在进程池中运行整个搜索网格，返回 (结果表, Pareto前沿)"""
+    grid = dict(DEFAULT_GRID if grid is None else grid)
+    checkpoints = sorted(grid.pop('num.trees'))
+    names = list(grid)
+    configs = [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+    n_cpus = os.cpu_count() or 1
+    workers = workers or max(1, min(len(configs), n_cpus))
+    n_jobs = n_jobs or max(1, n_cpus // workers)
+    if workers * n_jobs > n_cpus:
+        print(f"⚠ {workers}个进程 × {n_jobs}个线程超过了CPU核数 ({n_cpus})")
+
+    data = (np.asarray(X_train, dtype=np.float32), np.asarray(y_train),
+            np.asarray(X_val, dtype=np.float32), np.asarray(y_val))
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data, n_jobs)) as pool:
+        futures = {pool.submit(run_config, config, checkpoints, n_jobs, random_state): config for config in configs}
+        for i, future in enumerate(as_completed(futures), 1):
+            config_rows = future.result()
+            rows.extend(config_rows)
+            best = max(config_rows, key=lambda row: row['auc'])
+            print(f"[{i}/{len(configs)}] {futures[future]} -> 最佳AUC {best['auc']:.4f} ({best['num.trees']}棵树)")
+
+    results = pd.DataFrame(rows).sort_values(names + ['num.trees']).reset_index(drop=True)
+    return results, pareto_frontier(results)
+
+
+def _parse_list(text):
+    return [item.strip() for item in text.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel random forest hyperparameter sweep")
+    parser.add_argument('--train', default=TRAIN_PATH)
+    parser.add_argument('--validation', default=None, help="验证集文件（默认从训练集中分层划出，不能是外部测试集）")
+    parser.add_argument('--validation-fraction', type=float, default=0.2, help="从训练集中划出的验证集比例")
+    parser.add_argument('--workers', type=int, default=None, help="并行进程数")
+    parser.add_argument('--n-jobs', type=int, default=None, help="每个进程的线程数（默认CPU核数/进程数）")
+    for name, values in DEFAULT_GRID.items():
+        parser.add_argument(f"--{name.replace('.', '-')}", default=','.join(map(str, values)),
+                            help=f"{name} 的取值列表（逗号分隔）")
+    parser.add_argument('--output', default='sweep_results.csv')
+    parser.add_argument('--pareto-output', default='sweep_pareto.csv')
+    args = parser.parse_args()
+
+    grid = {}
+    for name in DEFAULT_GRID:
+        values = _parse_list(getattr(args, name.replace('.', '_')))
+        grid[name] = [value if name == 'mtry' and not value.replace('.', '').isdigit() else int(float(value))
+                      for value in values]
+
+    if args.validation is not None and os.path.abspath(args.validation) == os.path.abspath(TEST_PATH):
+        parser.error("the external test set is reserved for final evaluation; use a split of the training data")
+    target_col = detect_target_col(dataset_columns(args.train))
+    train_df = load_dataset(args.train, FEATURE_COLS + [target_col])
+    if args.validation is None:
+        train_df, val_df = split_holdout(train_df, target_col, args.validation_fraction)
+    else:
+        val_df = load_dataset(args.validation, FEATURE_COLS + [target_col])
+    print(f"训练集: {train_df.shape}, 验证集: {val_df.shape}, 目标变量列: {target_col}")
+    print(f"搜索网格: {grid}")
+
+    start = time.perf_counter()
+    results, pareto = run_sweep(train_df[FEATURE_COLS], train_df[target_col],
+                                val_df[FEATURE_COLS], val_df[target_col],
+                                grid, args.workers, args.n_jobs)
+    print(f"\n搜索完成，用时 {time.perf_counter() - start:.1f}s")
+
+    results.to_csv(args.output, index=False)
+    pareto.to_csv(args.pareto_output, index=False)
+    print("\nAUC-推理延迟Pareto前沿:")
+    print(pareto.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    print(f"\n✓ 结果表已保存到: {args.output}")
+    print(f"✓ Pareto前沿已保存到: {args.pareto_output}")
+
+
+if __name__ == "__main__":
+    main()
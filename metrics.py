@@ -0,0 +1,311 @@
+"""
+评分路径的分阶段延迟指标（Prometheus文本格式）
+
+    with stage('predict'):              # 记录到 sepsis_stage_seconds{stage="predict"} 直方图
+        ...
+    with RequestTimer('app', 'calculate'):
+        ...                             # 请求内各阶段的用时汇总，可按行写出JSON计时日志
+
+只依赖标准库（不需要prometheus_client）。指标在进程内汇总：
+    start_metrics_server()   在本地端口（环境变量METRICS_PORT，默认9464，只监听127.0.0.1）提供 /metrics
+    write_textfile(path)     批量脚本结束时写出指标文件（node_exporter textfile collector格式）
+设置环境变量TIMING_LOG（文件路径，或 '-' 表示标准错误）后，每个请求结束时写出一行JSON：
+    {"ts": ..., "source": "app", "request": "calculate", "total_ms": 12.3, "stages": {"predict": 1.2, ...}}
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 延迟直方图的桶上界（秒），覆盖单行预测（亚毫秒）到整批渲染（秒级）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_METRICS_PORT = 9464
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """单调递增的计数器"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # 没有标签的计数器从0开始导出
+        self._values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """固定桶的直方图（累计计数、总和与次数）"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # 标签 -> [各桶计数..., 总和, 次数]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state)) for key, state in sorted(self._values.items())]
+        samples = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', key + (('le', _format_value(float(bound))),), cumulative))
+            samples.append((f'{self.name}_bucket', key + (('le', '+Inf'),), state[-1]))
+            samples.append((f'{self.name}_sum', key, state[-2]))
+            samples.append((f'{self.name}_count', key, state[-1]))
+        return samples
+
+
+class Registry:
+    """指标集合；collector为返回 [(名称, 类型, 说明, [(标签, 值), ...]), ...] 的函数，用于采集时读取的量（如缓存统计）"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+        return collector
+
+    def render(self):
+        """Prometheus文本格式（0.0.4）"""
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        for collector in collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'sepsis_stage_seconds', 'Latency of each scoring stage in seconds', ['stage']))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'sepsis_request_seconds', 'End-to-end latency of scoring requests in seconds', ['source', 'request']))
+FALLBACK_PLOTS = REGISTRY.register(Counter(
+    'sepsis_fallback_plots_total', 'Static SHAP plots rendered with the fallback bar chart', ['plot']))
+SHAP_FAILURES = REGISTRY.register(Counter(
+    'sepsis_shap_failures_total', 'SHAP computations that raised an exception'))
+
+_local = threading.local()
+
+
+@contextmanager
+def stage(name):
+    """记录一个阶段的用时；在RequestTimer内时同时计入该请求的分阶段用时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timer = getattr(_local, 'timer', None)
+        if timer is not None:
+            timer.stages[name] = timer.stages.get(name, 0.0) + elapsed
+
+
+def current_timer():
+    """本线程当前的RequestTimer（没有时为None）"""
+    return getattr(_local, 'timer', None)
+
+
+@contextmanager
+def use_timer(timer):
+    """在工作线程中把stage()计入发起请求的RequestTimer"""
+    previous = getattr(_local, 'timer', None)
+    _local.timer = timer
+    try:
+        yield timer
+    finally:
+        _local.timer = previous
+
+
+class RequestTimer:
+    """一个请求的计时：期间本线程的stage()都计入该请求，结束时记录总用时并写出计时日志"""
+
+    def __init__(self, source, request, **fields):
+        self.source = source
+        self.request = request
+        self.fields = fields
+        self.stages = {}
+        self.total = None
+        self._start = None
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'timer', None)
+        _local.timer = self
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.total = time.perf_counter() - self._start
+        _local.timer = self._previous
+        REQUEST_SECONDS.observe(self.total, source=self.source, request=self.request)
+        logger = timing_logger()
+        if logger is not None:
+            record = {
+                'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'source': self.source,
+                'request': self.request,
+                'total_ms': round(self.total * 1000, 3),
+                'stages': {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+                **self.fields,
+            }
+            if exc_type is not None:
+                record['error'] = exc_type.__name__
+            logger.info(json.dumps(record, ensure_ascii=False))
+        return False
+
+
+_timing_logger = None
+_timing_logger_lock = threading.Lock()
+
+
+def timing_logger():
+    """按环境变量TIMING_LOG配置的计时日志记录器，未设置时返回None"""
+    global _timing_logger
+    target = os.environ.get('TIMING_LOG')
+    if not target:
+        return None
+    with _timing_logger_lock:
+        if _timing_logger is None:
+            logger = logging.getLogger('sepsis.timing')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = logging.StreamHandler() if target == '-' else logging.FileHandler(target, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            _timing_logger = logger
+        return _timing_logger
+
+
+def register_cache(cache, name='prediction'):
+    """把PredictionCache的统计信息作为指标导出（采集时读取）"""
+    def collect():
+        stats = cache.stats()
+        labels = (('cache', name),)
+        return [
+            ('sepsis_cache_entries', 'gauge', 'Entries currently in the cache', [(labels, stats['size'])]),
+            ('sepsis_cache_capacity', 'gauge', 'Maximum number of cache entries', [(labels, stats['maxsize'])]),
+            ('sepsis_cache_hits_total', 'counter', 'Cache lookups that returned a value', [(labels, stats['hits'])]),
+            ('sepsis_cache_misses_total', 'counter', 'Cache lookups that found no valid entry', [(labels, stats['misses'])]),
+            ('sepsis_cache_evictions_total', 'counter', 'Entries evicted by the LRU policy', [(labels, stats['evictions'])]),
+            ('sepsis_cache_expirations_total', 'counter', 'Entries dropped after their TTL', [(labels, stats['expirations'])]),
+        ]
+    return REGISTRY.register_collector(collect)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        data = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=None, host=None):
+    """
+    在后台线程中提供 /metrics，返回服务器对象
+
+    端口默认取环境变量METRICS_PORT（未设置时为9464，设为0时不启动），地址默认METRICS_HOST或127.0.0.1；
+    端口已被占用（如同一主机上的另一个工作进程）时返回None
+    """
+    if port is None:
+        port = int(os.environ.get('METRICS_PORT', DEFAULT_METRICS_PORT))
+    if not port:
+        return None
+    host = host or os.environ.get('METRICS_HOST', '127.0.0.1')
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"指标端口 {host}:{port} 不可用，不提供 /metrics: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+def write_textfile(path):
+    """把当前指标写入文件（先写临时文件再原子替换）"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp_path, path)
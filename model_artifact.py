@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+单文件模型包（替代 rf_model.pkl + shap_explainer.pkl）
+
+文件格式：
+    8字节魔数 b'SEPSISRF' | uint32 格式版本 | uint32 头部长度 | JSON头部 | 按64字节对齐的原始数组
+
+JSON头部记录元数据（类别、特征名、基准值、模型版本等）以及每个数组的dtype/shape/偏移。
+加载时用mmap只读映射整个文件，数组直接引用映射内存（零拷贝、不经过pickle），
+多个进程打开同一文件时共享操作系统页缓存。
+
+用法（把已有的 rf_model.pkl 转换为模型包）:
+    python model_artifact.py rf_model.pkl rf_model.bin
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from forest_engine import PackedForest
+from quantized_forest import QuantizedForest
+from tree_shap import TreeShapExplainer
+
+MAGIC = b'SEPSISRF'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+# 应用和评分服务默认加载的模型包，可用环境变量MODEL_ARTIFACT切换（如压缩或量化后的模型包）
+DEFAULT_ARTIFACT_PATH = os.environ.get('MODEL_ARTIFACT', 'rf_model.bin')
+
+_PREAMBLE = struct.Struct('<8sII')
+
+# 写入模型包的数组（PackedForest与TreeShapExplainer的属性名）
+FOREST_ARRAYS = ['roots', 'feature', 'threshold', 'left', 'right', 'missing_left', 'value', 'cover']
+# 量化森林（QuantizedForest）的数组
+QUANTIZED_FOREST_ARRAYS = ['roots', 'feature', 'threshold', 'right_offset', 'missing_left', 'value_q']
+EXPLAINER_ARRAYS = ['leaf_offset', 'leaf_value', 'leaf_tree', 'path_feature', 'path_zero',
+                    'path_lo', 'path_hi', 'path_nan_ok']
+
+
+class ModelArtifact:
+    """已打开的模型包：打包森林、SHAP解释器和元数据"""
+
+    def __init__(self, forest, explainer, metadata, path=None, buffer=None):
+        self.forest = forest
+        self.explainer = explainer
+        self.metadata = metadata
+        self.path = path
+        self._buffer = buffer  # 保持mmap存活
+
+    @property
+    def model_version(self):
+        return self.metadata.get('model_version')
+
+
+def forest_array_names(forest):
+    """森林写入模型包的数组名"""
+    return QUANTIZED_FOREST_ARRAYS if getattr(forest, 'encoding', 'packed') == 'quantized' else FOREST_ARRAYS
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_artifact(path, forest, explainer=None, metadata=None):
+    """把打包森林（或量化森林）和解释器路径表写入模型包（先写临时文件再原子替换）"""
+    if explainer is None:
+        explainer = TreeShapExplainer.from_forest(forest)
+
+    arrays = {f'forest.{name}': np.ascontiguousarray(getattr(forest, name)) for name in forest_array_names(forest)}
+    arrays.update({f'explainer.{name}': np.ascontiguousarray(getattr(explainer, name)) for name in EXPLAINER_ARRAYS})
+
+    # 模型版本：所有数组内容的哈希
+    digest = hashlib.sha256()
+    for name, array in arrays.items():
+        digest.update(name.encode('utf-8'))
+        digest.update(array.tobytes())
+
+    header = {
+        'metadata': dict(metadata or {}),
+        'forest': {
+            'max_depth': forest.max_depth,
+            'classes': forest.classes_.tolist(),
+            'n_features': forest.n_features_in_,
+            'feature_names': None if forest.feature_names_in_ is None else [str(c) for c in forest.feature_names_in_],
+        },
+        'explainer': {
+            'expected_value': explainer.expected_value,
+            'n_features': explainer.n_features,
+        },
+        'arrays': {},
+    }
+    header['metadata'].setdefault('model_version', digest.hexdigest()[:16])
+    header['metadata'].setdefault('created_at', time.strftime('%Y-%m-%dT%H:%M:%S'))
+    header['metadata'].setdefault('n_estimators', forest.n_estimators)
+    if getattr(forest, 'encoding', 'packed') == 'quantized':
+        header['forest']['encoding'] = 'quantized'
+        header['forest']['value_scale'] = forest.value_scale
+
+    # 先用占位偏移计算头部长度，再确定数据区起点
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': 0}
+    data_start = _align(_PREAMBLE.size + len(json.dumps(header).encode('utf-8')) + 1024)
+    offset = data_start
+    for name, array in arrays.items():
+        header['arrays'][name]['offset'] = offset
+        offset = _align(offset + array.nbytes)
+    header_bytes = json.dumps(header).encode('utf-8')
+    if _PREAMBLE.size + len(header_bytes) > data_start:
+        raise ValueError("Artifact header does not fit in the reserved space")
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(header['arrays'][name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(offset)
+    os.replace(tmp_path, path)
+    return header['metadata']
+
+
+def read_header(buffer):
+    """解析模型包头部"""
+    magic, version, header_len = _PREAMBLE.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a sepsis model artifact")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format version {version} (expected {FORMAT_VERSION})")
+    return json.loads(bytes(buffer[_PREAMBLE.size:_PREAMBLE.size + header_len]).decode('utf-8'))
+
+
+def _artifact_from_buffer(buffer, path=None):
+    """在只读缓冲区（mmap或共享内存）上构建森林和解释器，数组不复制"""
+    header = read_header(buffer)
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape']))
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=spec['offset']).reshape(spec['shape'])
+
+    forest_info = header['forest']
+    common = dict(max_depth=forest_info['max_depth'], classes=forest_info['classes'],
+                  n_features=forest_info['n_features'], feature_names=forest_info['feature_names'])
+    if forest_info.get('encoding', 'packed') == 'quantized':
+        forest = QuantizedForest(**{name: arrays[f'forest.{name}'] for name in QUANTIZED_FOREST_ARRAYS},
+                                 value_scale=forest_info['value_scale'], **common)
+    else:
+        forest = PackedForest(**{name: arrays[f'forest.{name}'] for name in FOREST_ARRAYS}, **common)
+    explainer = TreeShapExplainer(
+        **{name: arrays[f'explainer.{name}'] for name in EXPLAINER_ARRAYS},
+        expected_value=header['explainer']['expected_value'],
+        n_features=header['explainer']['n_features'],
+        feature_names=forest_info['feature_names'],
+    )
+    return ModelArtifact(forest, explainer, header['metadata'], path=path, buffer=buffer)
+
+
+def open_artifact(path=DEFAULT_ARTIFACT_PATH):
+    """以mmap只读方式打开模型包"""
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return _artifact_from_buffer(buffer, path=path)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: python model_artifact.py rf_model.pkl [rf_model.bin]")
+        return
+    from forest_engine import load_packed_forest
+
+    src = sys.argv[1]
+    dst = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_ARTIFACT_PATH
+    print(f"读取模型: {src}")
+    forest = load_packed_forest(src)
+    metadata = write_artifact(dst, forest)
+    print(f"✓ 模型包已保存到: {dst} ({os.path.getsize(dst) / 1024 / 1024:.1f} MB, 版本 {metadata['model_version']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+同一主机上多个工作进程共享的模型存储
+
+发布程序把模型包复制到共享内存目录（Linux上为 /dev/shm 下的tmpfs，可用环境变量MODEL_STORE_DIR修改）中
+的一个段文件，每次发布使用新的段文件，并递增一个8字节的代数计数器：
+    generation          uint64代数计数器（各进程只读映射，检查是否有新模型只需读8个字节）
+    current.json        当前代数、段文件名、模型版本和发布时间
+    model-000001.bin    各代模型包
+
+Streamlit和API工作进程设置MODEL_STORE_DIR后，以只读mmap方式附加当前段文件，
+所有进程共享同一份物理内存（增加进程时每个进程的私有内存基本不变）；
+代数变化时在后台附加新段文件并切换，旧段文件在最后一个引用释放后由操作系统回收。
+
+用法:
+    python model_store.py publish rf_model.bin
+    python model_store.py status
+    MODEL_STORE_DIR=/dev/shm/sepsis-model streamlit run app.py
+"""
+import argparse
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows上没有fcntl，不对并发发布加锁
+    fcntl = None
+
+_GENERATION = struct.Struct('<Q')
+_GENERATION_FILE = 'generation'
+_CURRENT_FILE = 'current.json'
+_LOCK_FILE = 'publish.lock'
+
+
+def default_store_dir():
+    """共享模型存储目录：环境变量MODEL_STORE_DIR，否则为 /dev/shm（没有时为系统临时目录）下的 sepsis-model"""
+    if os.environ.get('MODEL_STORE_DIR'):
+        return os.environ['MODEL_STORE_DIR']
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'sepsis-model')
+
+
+class SharedModelStore:
+    """共享模型存储的发布与附加"""
+
+    def __init__(self, store_dir=None):
+        self.store_dir = store_dir or default_store_dir()
+        self._counter = None
+
+    def _path(self, name):
+        return os.path.join(self.store_dir, name)
+
+    def generation(self):
+        """当前发布的代数（尚未发布时为0）"""
+        if self._counter is None:
+            try:
+                with open(self._path(_GENERATION_FILE), 'rb') as f:
+                    self._counter = mmap.mmap(f.fileno(), _GENERATION.size, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return 0
+        return _GENERATION.unpack_from(self._counter, 0)[0]
+
+    def current(self):
+        """当前发布的信息（current.json），尚未发布时返回None"""
+        try:
+            with open(self._path(_CURRENT_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def attach(self):
+        """以只读mmap方式打开当前发布的模型包，返回 (ModelArtifact, 代数)"""
+        from model_artifact import open_artifact
+
+        current = self.current()
+        if current is None:
+            raise FileNotFoundError(f"No model has been published to {self.store_dir}")
+        return open_artifact(self._path(current['segment'])), current['generation']
+
+    def publish(self, artifact_path, keep=2):
+        """
+        把模型包发布为新的一代，返回发布信息
+
+        先写入新的段文件并校验可以打开，再更新current.json，最后递增代数计数器；
+        只保留最近keep代的段文件（已附加的进程不受删除影响）
+        """
+        from drift import reference_path
+        from model_artifact import open_artifact
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(self._path(_LOCK_FILE), 'a+b') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            generation = self._read_counter() + 1
+            segment = f"model-{generation:06d}.bin"
+            tmp_path = self._path(f"{segment}.{os.getpid()}.tmp")
+            shutil.copyfile(artifact_path, tmp_path)
+            os.replace(tmp_path, self._path(segment))
+            artifact = open_artifact(self._path(segment))
+            # 模型包旁边的漂移参考分布随模型一起发布
+            if os.path.exists(reference_path(artifact_path)):
+                shutil.copyfile(reference_path(artifact_path), reference_path(self._path(segment)))
+
+            current = {
+                'generation': generation,
+                'segment': segment,
+                'model_version': artifact.model_version,
+                'source': os.path.abspath(artifact_path),
+                'size_bytes': os.path.getsize(self._path(segment)),
+                'published_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+            tmp_path = self._path(f"{_CURRENT_FILE}.{os.getpid()}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(current, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self._path(_CURRENT_FILE))
+            self._write_counter(generation)
+            self._remove_old_segments(generation - keep)
+        return current
+
+    def _read_counter(self):
+        try:
+            with open(self._path(_GENERATION_FILE), 'rb') as f:
+                data = f.read(_GENERATION.size)
+        except FileNotFoundError:
+            return 0
+        return _GENERATION.unpack(data)[0] if len(data) == _GENERATION.size else 0
+
+    def _write_counter(self, generation):
+        """原地更新计数器文件，已映射该文件的进程立即看到新值"""
+        path = self._path(_GENERATION_FILE)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(_GENERATION.pack(0))
+        with open(path, 'r+b') as f:
+            with mmap.mmap(f.fileno(), _GENERATION.size, access=mmap.ACCESS_WRITE) as counter:
+                _GENERATION.pack_into(counter, 0, generation)
+
+    def _remove_old_segments(self, oldest_kept):
+        from drift import reference_path
+
+        for name in os.listdir(self.store_dir):
+            if name.startswith('model-') and name.endswith('.bin'):
+                try:
+                    if int(name[6:-4]) <= oldest_kept:
+                        os.remove(self._path(name))
+                        if os.path.exists(reference_path(self._path(name))):
+                            os.remove(reference_path(self._path(name)))
+                except (ValueError, OSError):
+                    # Windows上仍被映射的文件不能删除，下次发布时再试
+                    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish the model to shared memory for all workers on this host")
+    parser.add_argument('command', choices=['publish', 'status'])
+    parser.add_argument('artifact', nargs='?', default=None, help="要发布的模型包（默认rf_model.bin，或环境变量MODEL_ARTIFACT）")
+    parser.add_argument('--store-dir', default=None, help="共享模型存储目录（默认环境变量MODEL_STORE_DIR或/dev/shm/sepsis-model）")
+    parser.add_argument('--keep', type=int, default=2, help="保留最近几代的段文件")
+    args = parser.parse_args()
+
+    store = SharedModelStore(args.store_dir)
+    if args.command == 'publish':
+        from model_artifact import DEFAULT_ARTIFACT_PATH
+        current = store.publish(args.artifact or DEFAULT_ARTIFACT_PATH, keep=args.keep)
+        print(f"✓ 已发布第{current['generation']}代模型 (版本 {current['model_version']}, "
+              f"{current['size_bytes'] / 1024 / 1024:.1f} MB) 到 {store.store_dir}")
+    else:
+        current = store.current()
+        if current is None:
+            print(f"{store.store_dir} 中尚未发布模型")
+        else:
+            print(json.dumps(current, ensure_ascii=False, indent=1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+预测结果与SHAP解释的缓存
+
+以按输入控件步长量化后的特征向量为键，缓存预测概率、正类SHAP值/基准值和按需导出的图片。
+容量有上限（LRU淘汰），条目超过TTL后失效；线程安全，可在多个Streamlit会话之间共享。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+def quantize_key(inputs, feature_cols, steps, namespace=None):
+    """把输入按每个特征的步长取整，得到可哈希的缓存键"""
+    key = tuple(int(round(float(inputs[col]) / steps.get(col, 1))) for col in feature_cols)
+    return key if namespace is None else (namespace,) + key
+
+
+
+def quantize_keys(X, feature_cols, steps, namespace=None):
+    """quantize_key的批量版本：对矩阵X（列顺序为feature_cols）的每一行返回缓存键"""
+    import numpy as np
+    step = np.array([steps.get(col, 1) for col in feature_cols], dtype=float)
+    # np.rint与round()一样按银行家舍入，结果与quantize_key相同
+    prefix = () if namespace is None else (namespace,)
+    return [prefix + tuple(row) for row in np.rint(np.asarray(X, dtype=float) / step).astype(np.int64).tolist()]
+
+
+class PredictionCache:
+    """带容量上限和过期时间的LRU缓存"""
+
+    def __init__(self, maxsize=1024, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """命中时返回缓存值并移到最近使用的位置，否则返回None"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at < now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key):
+        """返回未过期的缓存值（不存在时返回None），不改变LRU顺序和命中统计"""
+        with self._lock:
+            item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            return None
+        return item[1]
+
+    def put(self, key, value):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """返回命中/未命中等统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
@@ -0,0 +1,82 @@
+"""
+在工作线程中逐步计算解释结果，主线程随完成随显示
+
+风险概率计算完成后立即显示；SHAP值、图表、静态图片和敏感性曲线作为一个ProgressiveJob的若干步骤
+在工作线程中依次计算，每一步都有自己的Future，主线程按顺序等待并填入对应的占位元素。
+输入改变（Streamlit重新运行脚本）时调用cancel()：正在执行的步骤算完为止，之后的步骤不再开始。
+"""
+import threading
+from concurrent.futures import Future
+
+from metrics import Counter, REGISTRY, current_timer, use_timer
+
+CANCELLED_JOBS = REGISTRY.register(Counter(
+    'sepsis_cancelled_jobs_total', 'Progressive explanation jobs cancelled before all steps finished'))
+
+
+class ProgressiveJob:
+    """
+    依次执行的若干步骤：steps为 [(名称, 函数, 依赖的步骤名), ...]，函数参数为已完成步骤的结果字典
+
+    某一步失败时，依赖它的步骤以同一个异常结束，其余步骤继续执行
+    """
+
+    def __init__(self, steps):
+        self._steps = list(steps)
+        self.futures = {name: Future() for name, _, _ in self._steps}
+        self.results = {}
+        self._cancelled = threading.Event()
+        # 发起计算的请求计时器，工作线程中的stage()也计入该请求
+        self._timer = current_timer()
+
+    def start(self, executor):
+        executor.submit(self._run)
+        return self
+
+    def _run(self):
+        errors = {}
+        with use_timer(self._timer):
+            for name, func, requires in self._steps:
+                future = self.futures[name]
+                if self._cancelled.is_set() or not future.set_running_or_notify_cancel():
+                    break
+                failed = [errors[dep] for dep in requires if dep in errors]
+                if failed:
+                    errors[name] = failed[0]
+                    future.set_exception(failed[0])
+                    continue
+                try:
+                    self.results[name] = func(self.results)
+                except Exception as e:
+                    errors[name] = e
+                    future.set_exception(e)
+                else:
+                    future.set_result(self.results[name])
+        # 取消后未开始的步骤
+        for future in self.futures.values():
+            future.cancel()
+
+    def cancel(self):
+        """不再开始后续步骤；全部完成后调用没有效果"""
+        if self.done:
+            return
+        self._cancelled.set()
+        for future in self.futures.values():
+            future.cancel()
+        CANCELLED_JOBS.inc()
+
+    @property
+    def done(self):
+        return all(future.done() for future in self.futures.values())
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+
+def step_outcome(future):
+    """已完成步骤的 (结果, 异常)；步骤被取消时异常为CancelledError"""
+    try:
+        return future.result(timeout=0), None
+    except Exception as e:
+        return None, e
@@ -0,0 +1,184 @@
+"""
+训练数据与模型参数的公共定义（供训练、参数搜索和绘图脚本共用）
+
+load_dataset() 把CSV/Excel源文件第一次读取后转换为Arrow IPC（Feather）列式缓存，
+缓存文件名包含源文件内容的哈希；之后只以内存映射方式读取需要的列，不再解析CSV/Excel。
+"""
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+# 数据与参数文件路径
+PARAMS_PATH = r"Final result终版\最优模型RF参数.xlsx"
+TRAIN_PATH = r"spesis and pi\parameters\smote_nc_mimiciv_train.csv"
+TEST_PATH = r"spesis and pi\parameters\mimiciii_test1.xlsx"
+
+# 模型使用的20个特征
+FEATURE_COLS = ['ANION_GAP', 'BALANCE', 'BS', 'BUN', 'CHLORIDE', 'CR', 'CRRT',
+                'GCS', 'HGB', 'INRPT', 'MV', 'NBPS', 'NOR', 'OASIS', 'RR',
+                'SAPSII', 'SODIUM', 'SOFA', 'T', 'WBC']
+
+# R语言（ranger）参数名到RandomForestClassifier参数名的对应关系
+R_PARAM_NAMES = {
+    'num.trees': 'n_estimators',
+    'mtry': 'max_features',
+    'min.node.size': 'min_samples_leaf',
+    'min.bucket': 'min_samples_split',
+    'max.depth': 'max_depth',
+}
+
+# 参数文件读取失败时使用的默认参数
+DEFAULT_RF_PARAMS = {
+    'n_estimators': 2500,
+    'max_depth': 50,
+    'min_samples_split': 30,
+    'min_samples_leaf': 50,
+    'max_features': 6,
+}
+
+
+def detect_target_col(columns):
+    """目标变量列：列名包含SPESIS/SEPSIS的列，找不到时假设第一列"""
+    columns = list(columns)
+    for col in columns:
+        if 'SPESIS' in col.upper() or 'SEPSIS' in col.upper():
+            return col
+    return columns[0]
+
+
+def convert_r_param(name, value):
+    """把一个R参数值转换为对应的sklearn参数值"""
+    if name == 'mtry':
+        # mtry可以是整数或'sqrt'
+        try:
+            return int(float(value))
+        except (ValueError, TypeError):
+            return 'sqrt'
+    return int(float(value))
+
+
+def read_rf_params(params_df):
+    """
+    从参数表（Charater / Value 两列，R语言参数名）读取随机森林参数
+
+    返回sklearn参数字典，缺失的参数使用默认值
+    """
+    params_dict = {}
+    for _, row in params_df.iterrows():
+        charater = str(row['Charater']).strip()
+        value = row['Value']
+        if pd.notna(value):
+            params_dict[charater] = value
+
+    params = dict(DEFAULT_RF_PARAMS)
+    for r_name, sk_name in R_PARAM_NAMES.items():
+        if r_name in params_dict:
+            params[sk_name] = convert_r_param(r_name, params_dict[r_name])
+    if 'max.depth' not in params_dict:
+        params['max_depth'] = None
+    return params
+
+
+# 列式数据缓存目录，可用环境变量DATASET_CACHE_DIR修改
+CACHE_DIR = os.environ.get('DATASET_CACHE_DIR', '.dataset_cache')
+_HASH_INDEX = 'index.json'
+
+
+def file_hash(path, cache_dir=CACHE_DIR):
+    """
+    源文件内容的SHA-256
+
+    按 (大小, 修改时间) 记录已计算过的哈希，文件未变化时不重新读取整个文件
+    """
+    stat = os.stat(path)
+    index_path = os.path.join(cache_dir, _HASH_INDEX)
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+    key = os.path.abspath(path)
+    entry = index.get(key)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha256']
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    index[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, index_path)
+    return digest.hexdigest()
+
+
+def read_source(path):
+    """按扩展名读取原始数据文件"""
+    lower = path.lower()
+    if lower.endswith(('.xlsx', '.xls')):
+        return pd.read_excel(path)
+    if lower.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def cache_path(path, cache_dir=CACHE_DIR):
+    """源文件对应的列式缓存路径（文件名包含内容哈希）"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f"{stem}-{file_hash(path, cache_dir)[:16]}.arrow")
+
+
+def _ensure_cache(path, cache_dir=CACHE_DIR):
+    """缓存不存在时解析源文件并写入未压缩的Arrow IPC缓存，返回缓存路径"""
+    import pyarrow.feather as feather
+
+    cached = cache_path(path, cache_dir)
+    if not os.path.exists(cached):
+        df = read_source(path)
+        # 列名统一为字符串；object列中混有多种类型时转换为字符串（缺失值保留），保证可以写入Arrow
+        df.columns = [str(col) for col in df.columns]
+        for col in df.columns[(df.dtypes == object).values]:
+            if df[col].dropna().map(type).nunique() > 1:
+                df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        tmp_path = f"{cached}.{os.getpid()}.tmp"
+        feather.write_feather(df, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, cached)
+    return cached
+
+
+def dataset_columns(path, cache_dir=CACHE_DIR):
+    """数据集的列名（只读取缓存的schema）"""
+    import pyarrow.ipc as ipc
+
+    with ipc.open_file(_ensure_cache(path, cache_dir)) as reader:
+        return reader.schema.names
+
+
+def load_dataset(path, columns=None, cache_dir=CACHE_DIR):
+    """
+    读取数据集（带列式缓存）
+
+    第一次读取时解析源文件并写入缓存；之后以内存映射方式只读取columns中的列。
+    源文件内容变化时哈希不同，自动重新生成缓存。
+    """
+    import pyarrow.feather as feather
+
+    cached = _ensure_cache(path, cache_dir)
+    table = feather.read_table(cached, columns=None if columns is None else list(columns), memory_map=True)
+    return table.to_pandas()
+
+
+def split_holdout(data, target_col, fraction=0.2, seed=42):
+    """
+    从训练数据中按结局分层划出留出集，返回 (训练部分, 留出部分)
+
+    超参数搜索、森林压缩等需要验证数据的步骤使用留出集，外部测试集只用于最终评估
+    """
+    from sklearn.model_selection import train_test_split
+
+    return train_test_split(data, test_size=fraction, random_state=seed, stratify=data[target_col])
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+量化的紧凑森林表示（用于内存受限的部署）
+
+与PackedForest相比：
+- 分裂阈值向下取整为float32（输入本来就按float32比较，判断结果不变，无损）；
+- 特征编号用uint8，只保存右子节点的相对偏移（uint16，树内节点按先序排列，左子节点总是下一个节点），
+  叶节点的偏移为0；不再保存左子节点和节点样本数；
+- 节点只保存一个量化后的正类概率（8或16位整数），预测时先对整数求和再换算，
+  每棵树的误差不超过半个量化步长，平均后的概率误差也不超过这个界；
+- SHAP路径表的零分支比例和叶节点值改用float32，特征编号用uint8，树编号用uint16。
+
+模型包写入量化表示后，应用、评分服务和what-if评分直接在其上计算预测和SHAP，每个进程占用的内存更少。
+
+用法:
+    python quantized_forest.py --model rf_model.bin --bits 16 --output rf_model_q16.bin
+    python quantized_forest.py --model rf_model.bin --holdout test.csv --bits 8 --output rf_model_q8.bin
+    MODEL_ARTIFACT=rf_model_q16.bin streamlit run app.py
+"""
+import argparse
+import os
+
+import numpy as np
+
+from forest_engine import PackedForest
+from tree_shap import TreeShapExplainer, _floor_float32
+
+try:
+    from numba import config as numba_config, njit, prange
+    # 在后台线程中启动并行内核后，TBB线程层会使解释器退出时挂起，优先使用OpenMP
+    numba_config.THREADING_LAYER_PRIORITY = ['omp', 'tbb', 'workqueue']
+except ImportError:  # numba不可用时使用NumPy实现
+    njit = None
+
+_CHUNK_ELEMENTS = 1 << 20
+_ROW_BLOCK = 1024
+
+if njit is not None:
+    @njit(cache=True, parallel=True)
+    def _apply_kernel(X, roots, feature, threshold, right_offset, missing_left, out):
+        n_rows = X.shape[0]
+        for b in prange((n_rows + _ROW_BLOCK - 1) // _ROW_BLOCK):
+            start = b * _ROW_BLOCK
+            stop = min(start + _ROW_BLOCK, n_rows)
+            for t in range(roots.shape[0]):
+                for i in range(start, stop):
+                    node = np.int64(roots[t])
+                    while right_offset[node] != 0:
+                        x = X[i, feature[node]]
+                        if x <= threshold[node] or (np.isnan(x) and missing_left[node]):
+                            node += 1
+                        else:
+                            node += right_offset[node]
+                    out[i, t] = node
+
+    @njit(cache=True, parallel=True)
+    def _predict_kernel(X, roots, feature, threshold, right_offset, missing_left, value_q, value_scale, out):
+        n_rows = X.shape[0]
+        n_trees = roots.shape[0]
+        for b in prange((n_rows + _ROW_BLOCK - 1) // _ROW_BLOCK):
+            start = b * _ROW_BLOCK
+            stop = min(start + _ROW_BLOCK, n_rows)
+            totals = np.zeros(stop - start, dtype=np.int64)
+            for t in range(n_trees):
+                for i in range(start, stop):
+                    node = np.int64(roots[t])
+                    while right_offset[node] != 0:
+                        x = X[i, feature[node]]
+                        if x <= threshold[node] or (np.isnan(x) and missing_left[node]):
+                            node += 1
+                        else:
+                            node += right_offset[node]
+                    totals[i - start] += value_q[node]
+            # 整数求和没有舍入误差，与求和顺序无关
+            for i in range(start, stop):
+                out[i] = totals[i - start] * value_scale / n_trees
+
+
+class QuantizedForest:
+    """量化后的随机森林，接口与PackedForest的预测部分相同"""
+
+    encoding = 'quantized'
+
+    def __init__(self, roots, feature, threshold, right_offset, missing_left, value_q, value_scale,
+                 max_depth, classes, n_features, feature_names=None):
+        self.roots = roots                  # 每棵树根节点的全局编号 (n_trees,)
+        self.feature = feature              # 分裂特征 (n_nodes,)
+        self.threshold = threshold          # 分裂阈值（float32，向下取整）
+        self.right_offset = right_offset    # 右子节点相对当前节点的偏移，叶节点为0
+        self.missing_left = missing_left    # 缺失值是否走左子树
+        self.value_q = value_q              # 量化的节点正类概率，概率 = value_q * value_scale
+        self.value_scale = float(value_scale)
+        self.max_depth = int(max_depth)
+        self.classes_ = np.asarray(classes)
+        self.feature_names_in_ = None if feature_names is None else np.asarray(feature_names, dtype=object)
+        self.n_estimators = len(roots)
+        self.n_features_in_ = int(n_features)
+
+    @property
+    def value_bits(self):
+        return self.value_q.dtype.itemsize * 8
+
+    @property
+    def error_bound(self):
+        """量化带来的正类概率最大误差（阈值无损，只有叶节点概率取整的半个步长）"""
+        return self.value_scale / 2
+
+    _as_matrix = PackedForest._as_matrix
+
+    def apply(self, X, tree_indices=None):
+        """返回每个样本在每棵树（或tree_indices指定的树）中落入的叶节点全局编号 (n_samples, n_trees)"""
+        X = self._as_matrix(X)
+        roots = self.roots if tree_indices is None else self.roots[np.asarray(tree_indices, dtype=np.intp)]
+        leaves = np.empty((X.shape[0], len(roots)), dtype=np.intp)
+        if njit is not None:
+            _apply_kernel(X, roots, self.feature, self.threshold, self.right_offset, self.missing_left, leaves)
+            return leaves
+        chunk = max(1, _CHUNK_ELEMENTS // max(1, len(roots)))
+        for start in range(0, X.shape[0], chunk):
+            leaves[start:start + chunk] = self._walk(X[start:start + chunk], roots)
+        return leaves
+
+    def _walk(self, X, roots):
+        """NumPy实现：对一个分块同时遍历所有树"""
+        n_rows, n_features = X.shape
+        flat_x = X.ravel()
+        node = np.tile(roots.astype(np.intp), n_rows)
+        row_base = np.repeat(np.arange(n_rows) * n_features, len(roots))
+        active = np.flatnonzero(self.right_offset[node] != 0)
+        while active.size:
+            current = node[active]
+            x = flat_x[row_base[active] + self.feature[current]]
+            go_left = (x <= self.threshold[current]) | (np.isnan(x) & self.missing_left[current])
+            node[active] = current + np.where(go_left, 1, self.right_offset[current].astype(np.intp))
+            active = active[self.right_offset[node[active]] != 0]
+        return node.reshape(n_rows, len(roots))
+
+    def proba_from_leaves(self, leaves):
+        """由一个样本在每棵树中的叶节点计算正类概率（与predict_proba的计算相同）"""
+        return float(self.value_q[leaves].sum(dtype=np.int64) * self.value_scale / self.n_estimators)
+
+    def predict_proba(self, X):
+        """预测概率 (n_samples, 2)，列顺序与classes_一致"""
+        X = self._as_matrix(X)
+        p1 = np.empty(X.shape[0], dtype=np.float64)
+        if njit is not None:
+            _predict_kernel(X, self.roots, self.feature, self.threshold, self.right_offset, self.missing_left,
+                            self.value_q, self.value_scale, p1)
+        else:
+            chunk = max(1, _CHUNK_ELEMENTS // max(1, self.n_estimators))
+            for start in range(0, X.shape[0], chunk):
+                leaves = self._walk(X[start:start + chunk], self.roots)
+                p1[start:start + chunk] = self.value_q[leaves].sum(axis=1, dtype=np.int64) * self.value_scale \
+                    / self.n_estimators
+        proba = np.column_stack([1.0 - p1, p1])
+        if len(self.classes_) == 2 and self.classes_[0] == 1:
+            proba = proba[:, ::-1]
+        return proba
+
+    def predict(self, X):
+        """预测类别"""
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def _narrowest_uint(max_value):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def quantize_forest(forest, value_bits=16):
+    """
+    把PackedForest转换为 (QuantizedForest, 对应的TreeShapExplainer)
+
+    解释器在量化后的叶节点概率上构建，SHAP值之和等于量化森林的输出减去基准值
+    """
+    if value_bits not in (8, 16):
+        raise ValueError("value_bits must be 8 or 16")
+    if forest.cover is None:
+        raise ValueError("PackedForest has no node cover; rebuild it with PackedForest.from_sklearn")
+    n_nodes = len(forest.feature)
+    nodes = np.arange(n_nodes)
+    internal = forest.left != nodes
+    if np.any(forest.left[internal] != nodes[internal] + 1):
+        raise ValueError("Tree nodes are not in depth-first order; cannot encode left children implicitly")
+
+    levels = (1 << value_bits) - 1
+    value_q = np.rint(forest.value * levels).astype(np.uint8 if value_bits == 8 else np.uint16)
+    right_offset = np.where(internal, forest.right.astype(np.int64) - nodes, 0)
+    qforest = QuantizedForest(
+        roots=forest.roots.astype(np.uint32),
+        feature=forest.feature.astype(_narrowest_uint(forest.n_features_in_ - 1)),
+        threshold=_floor_float32(forest.threshold),
+        right_offset=right_offset.astype(_narrowest_uint(right_offset.max())),
+        missing_left=forest.missing_left.astype(bool),
+        value_q=value_q,
+        value_scale=1.0 / levels,
+        max_depth=forest.max_depth,
+        classes=forest.classes_,
+        n_features=forest.n_features_in_,
+        feature_names=forest.feature_names_in_,
+    )
+
+    # 在反量化后的概率上构建SHAP路径表
+    dequantized = PackedForest(
+        roots=forest.roots, feature=forest.feature, threshold=forest.threshold, left=forest.left,
+        right=forest.right, missing_left=forest.missing_left, value=value_q * qforest.value_scale,
+        max_depth=forest.max_depth, classes=forest.classes_, n_features=forest.n_features_in_,
+        feature_names=forest.feature_names_in_, cover=forest.cover,
+    )
+    full = TreeShapExplainer.from_forest(dequantized)
+    # 基准值取每棵树叶节点概率按样本数加权的平均（量化后与根节点的概率不再完全相等）
+    tree_of = np.repeat(np.arange(forest.n_estimators), np.diff(np.append(forest.roots, n_nodes)))
+    leaf = ~internal
+    leaf_mass = np.bincount(tree_of[leaf], weights=forest.cover[leaf] * dequantized.value[leaf],
+                            minlength=forest.n_estimators)
+    expected_value = float(np.mean(leaf_mass / forest.cover[forest.roots]))
+    explainer = TreeShapExplainer(
+        leaf_offset=full.leaf_offset,
+        leaf_value=full.leaf_value.astype(np.float32),
+        leaf_tree=full.leaf_tree.astype(_narrowest_uint(max(forest.n_estimators - 1, 0))),
+        path_feature=full.path_feature.astype(_narrowest_uint(forest.n_features_in_ - 1)),
+        path_zero=full.path_zero.astype(np.float32),
+        path_lo=full.path_lo,
+        path_hi=full.path_hi,
+        path_nan_ok=full.path_nan_ok,
+        expected_value=expected_value,
+        n_features=full.n_features,
+        feature_names=full.feature_names,
+    )
+    return qforest, explainer
+
+
+def quantization_error(forest, explainer, qforest, qexplainer, X):
+    """在样本X上比较量化前后的正类概率和SHAP值，返回误差统计"""
+    reference = forest.predict_proba(X)[:, 1]
+    diff = np.abs(qforest.predict_proba(X)[:, 1] - reference)
+    shap_diff = np.abs(qexplainer.shap_values(X) - explainer.shap_values(X))
+    return {
+        'n_samples': int(len(reference)),
+        'error_bound': qforest.error_bound,
+        'max_abs_diff': float(diff.max()),
+        'mean_abs_diff': float(diff.mean()),
+        'shap_max_abs_diff': float(shap_diff.max()),
+        'expected_value_diff': abs(qexplainer.expected_value - explainer.expected_value),
+    }
+
+
+def artifact_nbytes(forest, explainer):
+    """森林和解释器全部数组的字节数"""
+    from model_artifact import EXPLAINER_ARRAYS, forest_array_names
+    return (sum(getattr(forest, name).nbytes for name in forest_array_names(forest))
+            + sum(getattr(explainer, name).nbytes for name in EXPLAINER_ARRAYS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a quantized compact forest artifact")
+    parser.add_argument('--model', default='rf_model.bin', help="完整精度的模型包")
+    parser.add_argument('--bits', type=int, choices=[8, 16], default=16, help="叶节点概率的量化位数")
+    parser.add_argument('--holdout', default=None, help="测量误差用的数据文件（默认使用合成队列）")
+    parser.add_argument('--rows', type=int, default=5000, help="使用合成队列时的样本数")
+    parser.add_argument('--output', default=None, help="默认为 rf_model_q{bits}.bin")
+    args = parser.parse_args()
+
+    from model_artifact import open_artifact, write_artifact
+
+    artifact = open_artifact(args.model)
+    forest, explainer = artifact.forest, artifact.explainer
+    feature_cols = list(forest.feature_names_in_)
+    if args.holdout:
+        from project_data import load_dataset
+        X = load_dataset(args.holdout, feature_cols)
+    else:
+        from synthetic_data import generate_cohort
+        X = generate_cohort(args.rows, seed=0, with_target=False)[feature_cols]
+
+    qforest, qexplainer = quantize_forest(forest, args.bits)
+    error = quantization_error(forest, explainer, qforest, qexplainer, X)
+    print(f"量化误差（{error['n_samples']}个样本）: 概率最大差 {error['max_abs_diff']:.2e} "
+          f"(理论上界 {error['error_bound']:.2e}), 平均差 {error['mean_abs_diff']:.2e}, "
+          f"SHAP最大差 {error['shap_max_abs_diff']:.2e}")
+
+    metadata = dict(artifact.metadata)
+    for key in ('model_version', 'created_at', 'n_estimators'):
+        metadata.pop(key, None)
+    metadata['quantization'] = dict(error, value_bits=args.bits, source_model_version=artifact.model_version,
+                                    holdout=args.holdout or f"synthetic:{args.rows}")
+    output = args.output or f"rf_model_q{args.bits}.bin"
+    metadata = write_artifact(output, qforest, qexplainer, metadata=metadata)
+
+    before, after = artifact_nbytes(forest, explainer), artifact_nbytes(qforest, qexplainer)
+    print(f"✓ 量化模型包已保存到: {output} (数组 {before / 1024 / 1024:.1f} MB → {after / 1024 / 1024:.1f} MB, "
+          f"文件 {os.path.getsize(output) / 1024 / 1024:.1f} MB, 版本 {metadata['model_version']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+模型运行时：后台加载与预热
+
+进程启动时在后台线程中打开模型包、读取特征信息，并用默认输入做一次预测和SHAP计算
+（触发numba编译或加载编译缓存）。加载期间界面和健康检查照常响应，
+status() 返回 'loading' / 'ready' / 'failed'，供就绪探针使用。
+
+重依赖（numba、模型包）在后台线程中才导入，不拖慢首个页面/首个请求。
+
+设置环境变量MODEL_STORE_DIR（或store_dir参数）时从共享模型存储（model_store.py）附加模型，
+check_for_update() 发现新发布的一代模型后在后台切换，切换完成前继续使用当前模型。
+
+用法（构建镜像时预先编译numba内核，写入编译缓存）:
+    python runtime.py
+"""
+import os
+import pickle
+import threading
+import time
+
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class ModelRuntime:
+    """在后台线程中加载模型包并预热，加载完成前调用方可以查询状态或等待"""
+
+    def __init__(self, artifact_path=None, feature_info_path='feature_info.pkl', warm_up=True, store_dir=None):
+        self.artifact_path = artifact_path
+        self.feature_info_path = feature_info_path
+        self.warm_up = warm_up
+        self.store_dir = store_dir if store_dir is not None else os.environ.get('MODEL_STORE_DIR')
+        self.store = None
+        self.state = LOADING
+        self.error = None
+        self.artifact = None
+        self.feature_cols = None
+        self.generation = None
+        self.reload_error = None
+        self._reloading = False
+        self._failed_generation = None
+        self.started_at = time.monotonic()
+        self.load_seconds = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动后台加载线程（重复调用无效果）"""
+        with self._lock:
+            if self._thread is None:
+                self.started_at = time.monotonic()
+                self._thread = threading.Thread(target=self._load, name='model-runtime', daemon=True)
+                self._thread.start()
+        return self
+
+    def _open(self):
+        """打开模型包（配置了共享模型存储时附加当前发布的一代），返回 (模型包, 特征列, 代数)"""
+        if self.store_dir:
+            from model_store import SharedModelStore
+            if self.store is None:
+                self.store = SharedModelStore(self.store_dir)
+            artifact, generation = self.store.attach()
+        else:
+            from model_artifact import DEFAULT_ARTIFACT_PATH, open_artifact
+            artifact, generation = open_artifact(self.artifact_path or DEFAULT_ARTIFACT_PATH), None
+        feature_cols = artifact.metadata.get('feature_cols')
+        if feature_cols is None:
+            with open(self.feature_info_path, 'rb') as f:
+                feature_cols = pickle.load(f)['feature_cols']
+        feature_cols = list(feature_cols)
+        if self.warm_up:
+            _warm_up(artifact, feature_cols)
+        return artifact, feature_cols, generation
+
+    def _load(self):
+        try:
+            artifact, feature_cols, generation = self._open()
+            with self._lock:
+                self.artifact, self.feature_cols, self.generation = artifact, feature_cols, generation
+            self.state = READY
+        except Exception as e:
+            self.error = e
+            self.state = FAILED
+        finally:
+            self.load_seconds = time.monotonic() - self.started_at
+            self._ready.set()
+
+    def wait(self, timeout=None):
+        """等待加载结束；加载失败时抛出原始异常，超时返回False"""
+        if not self._ready.wait(timeout):
+            return False
+        if self.error is not None:
+            raise self.error
+        return True
+
+    def check_for_update(self):
+        """
+        共享存储中发布了新的一代模型时，在后台线程中附加并预热新模型后切换
+
+        只读取8字节的代数计数器，可以在每次请求时调用；返回是否开始了切换
+        """
+        if self.store is None or not self.ready:
+            return False
+        generation = self.store.generation()
+        with self._lock:
+            if generation in (self.generation, self._failed_generation) or self._reloading:
+                return False
+            self._reloading = True
+        threading.Thread(target=self._reload, args=(generation,), name='model-reload', daemon=True).start()
+        return True
+
+    def _reload(self, generation):
+        try:
+            artifact, feature_cols, generation = self._open()
+            with self._lock:
+                self.artifact, self.feature_cols, self.generation = artifact, feature_cols, generation
+            self.reload_error = None
+        except Exception as e:
+            # 新模型无法加载时继续使用当前模型，同一代不再重试
+            self.reload_error = e
+            self._failed_generation = generation
+        finally:
+            self._reloading = False
+
+    def snapshot(self):
+        """同一代模型的 (打包森林, TreeSHAP解释器, 特征列, 模型版本)，切换模型时不会取到新旧混合的组合"""
+        with self._lock:
+            artifact = self.artifact
+            if artifact is None:
+                return None, None, self.feature_cols, None
+            return artifact.forest, artifact.explainer, self.feature_cols, artifact.model_version
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    @property
+    def forest(self):
+        return self.artifact.forest if self.artifact is not None else None
+
+    @property
+    def explainer(self):
+        return self.artifact.explainer if self.artifact is not None else None
+
+    def status(self):
+        """轻量的状态信息，不等待加载"""
+        info = {
+            'status': self.state,
+            'uptime_seconds': round(time.monotonic() - self.started_at, 3),
+        }
+        if self.load_seconds is not None:
+            info['load_seconds'] = round(self.load_seconds, 3)
+        artifact = self.artifact
+        if artifact is not None:
+            info['model_version'] = artifact.model_version
+            info['n_estimators'] = artifact.forest.n_estimators
+        if self.generation is not None:
+            info['generation'] = self.generation
+        if self.error is not None:
+            info['error'] = f"{type(self.error).__name__}: {self.error}"
+        if self.reload_error is not None:
+            info['reload_error'] = f"{type(self.reload_error).__name__}: {self.reload_error}"
+        return info
+
+
+def _warm_up(artifact, feature_cols):
+    """用默认输入做一次预测和SHAP计算（包括what-if增量评分使用的逐树内核）"""
+    import numpy as np
+    from scoring import FEATURE_SPECS
+    from what_if import WhatIfSession
+
+    row = np.array([[float(FEATURE_SPECS[col]['default']) if col in FEATURE_SPECS else 0.0
+                     for col in feature_cols]])
+    artifact.forest.predict_proba(row)
+    artifact.explainer.shap_values(row)
+    WhatIfSession(artifact.forest, artifact.explainer, row)
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime(artifact_path=None):
+    """进程内共享的运行时，首次调用时开始后台加载"""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = ModelRuntime(artifact_path).start()
+        return _runtime
+
+
+def main():
+    runtime = ModelRuntime().start()
+    runtime.wait()
+    print(f"✓ 模型预热完成: {runtime.status()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+评分与解释的公共逻辑（供Streamlit应用和批量评分共用）
+"""
+import numpy as np
+import pandas as pd
+
+from metrics import SHAP_FAILURES, stage
+
+# 输入特征定义：显示名称、分组、取值范围、默认值和步长（与应用中的输入控件一致）
+# 二分类特征使用options代替取值范围
+FEATURE_SPECS = {
+    'GCS': dict(label="GCS (Glasgow Coma Scale)", group="Vital Signs", min=3.0, max=15.0, default=15.0, step=0.1),
+    'RR': dict(label="RR (Respiratory Rate, /min)", group="Vital Signs", min=0.0, max=60.0, default=20.0, step=0.1),
+    'T': dict(label="T (Temperature, °C)", group="Vital Signs", min=30.0, max=45.0, default=37.0, step=0.1),
+    'NBPS': dict(label="NBPS (Systolic Blood Pressure, mmHg)", group="Vital Signs", min=0.0, max=300.0, default=120.0, step=0.1),
+    'WBC': dict(label="WBC (White Blood Cell Count, ×10⁹/L)", group="Laboratory Tests", min=0.0, max=100.0, default=10.0, step=0.1),
+    'HGB': dict(label="HGB (Hemoglobin, g/dL)", group="Laboratory Tests", min=0.0, max=30.0, default=12.0, step=0.1),
+    'ANION_GAP': dict(label="ANION_GAP (Anion Gap, mEq/L)", group="Laboratory Tests", min=0.0, max=50.0, default=12.0, step=0.1),
+    'CHLORIDE': dict(label="CHLORIDE (Chloride, mEq/L)", group="Laboratory Tests", min=0.0, max=200.0, default=105.0, step=0.1),
+    'SODIUM': dict(label="SODIUM (Sodium, mEq/L)", group="Laboratory Tests", min=0.0, max=200.0, default=140.0, step=0.1),
+    'BUN': dict(label="BUN (Blood Urea Nitrogen, mg/dL)", group="Laboratory Tests", min=0.0, max=200.0, default=20.0, step=0.1),
+    'CR': dict(label="CR (Creatinine, mg/dL)", group="Laboratory Tests", min=0.0, max=20.0, default=1.0, step=0.1),
+    'INRPT': dict(label="INRPT (International Normalized Ratio)", group="Laboratory Tests", min=0.5, max=10.0, default=1.0, step=0.1),
+    'BS': dict(label="BS (Blood Sugar, mg/dL)", group="Laboratory Tests", min=0.0, max=500.0, default=100.0, step=0.1),
+    'SOFA': dict(label="SOFA (Sequential Organ Failure Assessment)", group="Scoring Systems", min=0.0, max=24.0, default=0.0, step=0.1),
+    'SAPSII': dict(label="SAPSII (Simplified Acute Physiology Score II)", group="Scoring Systems", min=0.0, max=200.0, default=30.0, step=0.1),
+    'OASIS': dict(label="OASIS (Oxford Acute Severity of Illness Score)", group="Scoring Systems", min=0.0, max=100.0, default=20.0, step=0.1),
+    'BALANCE': dict(label="BALANCE (Fluid Balance, mL)", group="Treatment Measures", min=-50000.0, max=50000.0, default=0.0, step=100.0),
+    'MV': dict(label="MV (Mechanical Ventilation)", group="Treatment Measures", options=[0, 1], default=0, step=1),
+    'CRRT': dict(label="CRRT (Continuous Renal Replacement Therapy)", group="Treatment Measures", options=[0, 1], default=0, step=1),
+    'NOR': dict(label="NOR (Norepinephrine)", group="Treatment Measures", options=[0, 1], default=0, step=1),
+}
+
+
+def feature_groups():
+    """按输入界面的分组顺序返回 [(分组名, [特征名, ...]), ...]"""
+    groups = {}
+    for name, spec in FEATURE_SPECS.items():
+        groups.setdefault(spec['group'], []).append(name)
+    return list(groups.items())
+
+
+# 风险等级阈值（百分比）
+LOW_RISK_THRESHOLD = 30
+HIGH_RISK_THRESHOLD = 60
+
+
+def risk_level(risk_score):
+    """根据风险评分（百分比）返回 (风险等级, 颜色标记)"""
+    if risk_score < LOW_RISK_THRESHOLD:
+        return "Low Risk", "🟢"
+    elif risk_score < HIGH_RISK_THRESHOLD:
+        return "Medium Risk", "🟡"
+    return "High Risk", "🔴"
+
+
+def risk_levels(risk_scores):
+    """向量化版本：对一组风险评分返回风险等级数组"""
+    risk_scores = np.asarray(risk_scores, dtype=float)
+    return np.select(
+        [risk_scores < LOW_RISK_THRESHOLD, risk_scores < HIGH_RISK_THRESHOLD],
+        ["Low Risk", "Medium Risk"],
+        default="High Risk",
+    )
+
+
+def positive_class_shap(explainer, X, class_index=1):
+    """
+    计算一批样本正类的SHAP值
+
+    兼容shap不同版本的输出格式（list / (n, f, c) 数组 / (n, f) 数组），
+    返回 (n_samples, n_features) 矩阵和标量基准值
+    """
+    with stage('shap_values'):
+        try:
+            shap_values = explainer.shap_values(X)
+        except Exception:
+            SHAP_FAILURES.inc()
+            raise
+    expected_value = explainer.expected_value
+
+    with stage('shap_normalize'):
+        if isinstance(shap_values, list):
+            values = np.asarray(shap_values[class_index])
+        else:
+            values = np.asarray(shap_values)
+            if values.ndim == 3:
+                values = values[:, :, class_index]
+
+        expected_value = np.atleast_1d(np.asarray(expected_value, dtype=float))
+        base_value = float(expected_value[class_index] if len(expected_value) > class_index else expected_value[0])
+        return values.reshape(len(X), -1), base_value
+
+
+def top_drivers(shap_matrix, feature_cols, k=3):
+    """每行按|SHAP|取前k个驱动特征，格式如 'BUN (+0.0421)'"""
+    shap_matrix = np.asarray(shap_matrix)
+    k = min(k, shap_matrix.shape[1])
+    order = np.argsort(-np.abs(shap_matrix), axis=1)[:, :k]
+    names = np.asarray(feature_cols, dtype=object)[order]
+    values = np.take_along_axis(shap_matrix, order, axis=1)
+    return ["; ".join(f"{name} ({value:+.4f})" for name, value in zip(row_names, row_values))
+            for row_names, row_values in zip(names, values)]
+
+
+def iter_cohort_chunks(file, file_name, chunksize=5000):
+    """
+    分块读取队列文件（CSV或Parquet）
+
+    返回 (数据块, 已读取进度0~1) 的迭代器
+    """
+    if file_name.lower().endswith('.parquet'):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(file)
+        total_rows = max(parquet_file.metadata.num_rows, 1)
+        rows_read = 0
+        for batch in parquet_file.iter_batches(batch_size=chunksize):
+            chunk = batch.to_pandas()
+            rows_read += len(chunk)
+            yield chunk, min(rows_read / total_rows, 1.0)
+    else:
+        # CSV无法预知行数，用已读取字节数估计进度
+        total_bytes = max(getattr(file, 'size', 0) or 0, 1)
+        for chunk in pd.read_csv(file, chunksize=chunksize):
+            position = file.tell() if hasattr(file, 'tell') else total_bytes
+            yield chunk, min(position / total_bytes, 1.0)
+
+
+def score_chunk(model, explainer, chunk, feature_cols, explain=True, n_drivers=3, audit_log=None, model_version=None):
+    """
+    对一个数据块整体评分（不逐行构造DataFrame）
+
+    返回原始列加上风险评分、风险等级和主要SHAP驱动特征的结果表；给出audit_log时记录每个患者的评分
+    """
+    X = chunk[feature_cols].astype(float)
+    with stage('predict'):
+        risk_scores = model.predict_proba(X)[:, 1] * 100
+
+    result = chunk.copy()
+    result['Risk Score (%)'] = np.round(risk_scores, 2)
+    result['Risk Level'] = risk_levels(risk_scores)
+    shap_matrix, base_value = None, None
+    if explain and explainer is not None:
+        shap_matrix, base_value = positive_class_shap(explainer, X)
+        shap_matrix = shap_matrix[:, :len(feature_cols)]
+        result['Top SHAP Drivers'] = top_drivers(shap_matrix, feature_cols, n_drivers)
+    if audit_log is not None:
+        with stage('audit_enqueue'):
+            audit_log.record_batch('cohort', model_version, feature_cols, X.to_numpy(), risk_scores / 100,
+                                   result['Risk Level'], shap_matrix, base_value)
+    return result
+
+
+def sensitivity_grid(inputs, feature_cols, n_points=50):
+    """
+    敏感性分析（ICE曲线）的网格：每个特征在输入控件取值范围内取n_points个值（按步长取整，
+    并包含当前值），其余特征保持当前输入
+
+    返回 (网格特征矩阵, 每行对应的特征名/取值/是否为当前值)，所有特征的网格合在一个批次中
+    """
+    base = np.array([float(inputs[col]) for col in feature_cols])
+    blocks, names, grid_values = [], [], []
+    for j, col in enumerate(feature_cols):
+        spec = FEATURE_SPECS.get(col)
+        if spec is None:
+            continue
+        if 'options' in spec:
+            values = np.asarray(spec['options'], dtype=float)
+        else:
+            values = np.linspace(spec['min'], spec['max'], n_points)
+            values = np.round(np.round(values / spec['step']) * spec['step'], 6)
+        values = np.unique(np.append(values, base[j]))
+        block = np.tile(base, (len(values), 1))
+        block[:, j] = values
+        blocks.append(block)
+        names.extend([col] * len(values))
+        grid_values.append(values)
+    X = pd.DataFrame(np.vstack(blocks), columns=feature_cols)
+    grid_values = np.concatenate(grid_values)
+    current = grid_values == base[[feature_cols.index(name) for name in names]]
+    return X, pd.DataFrame({'Feature': names, 'Value': grid_values, 'Current': current})
+
+
+def sensitivity_curves(model, inputs, feature_cols, n_points=50, cache=None, steps=None, namespace=None):
+    """
+    对敏感性网格一次批量评分，返回每个特征的ICE曲线表（Feature / Value / Current / Risk (%)）
+
+    提供预测缓存时，网格中已缓存的输入（按steps量化后相同、namespace相同）直接使用缓存的概率，其余行一次评分
+    """
+    X, curves = sensitivity_grid(inputs, feature_cols, n_points)
+    probability = np.full(len(X), np.nan)
+    if cache is not None and len(cache):
+        from prediction_cache import quantize_keys
+        for i, key in enumerate(quantize_keys(X.values, feature_cols, steps or {}, namespace)):
+            cached = cache.peek(key)
+            if cached is not None:
+                probability[i] = cached['probability']
+    missing = np.isnan(probability)
+    if missing.any():
+        with stage('sensitivity_predict'):
+            probability[missing] = model.predict_proba(X.values[missing])[:, 1]
+    curves['Risk (%)'] = probability * 100
+    return curves
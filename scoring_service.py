@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+无界面的HTTP评分服务
+
+启动后立即开始监听，模型包在后台线程中加载并预热（/health为存活探针，
+/ready在模型就绪前返回503）。接收JSON格式的患者数据，
+返回风险评分、风险等级和每个特征的SHAP值。并发请求在短时间窗口内合并为
+一个小批次，由一次向量化的predict_proba / shap_values调用统一处理。
+/metrics以Prometheus文本格式提供各阶段（解析、排队、预测、SHAP、序列化）的延迟直方图。
+
+用法:
+    python scoring_service.py --port 8000
+    curl -X POST http://localhost:8000/predict -d '{"GCS": 15, "RR": 20, ...}'
+"""
+import argparse
+import json
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from audit import get_audit_log
+from drift import monitor_for
+from metrics import REGISTRY, RequestTimer, stage
+from runtime import FAILED, ModelRuntime
+from scoring import positive_class_shap, risk_level
+
+
+class MicroBatcher:
+    """把并发请求聚合成小批次，由后台线程统一评分"""
+
+    def __init__(self, model, explainer, feature_cols, max_batch_size=64, max_wait_ms=5.0, model_version=None,
+                 audit_log=None):
+        self.model = model
+        self.explainer = explainer
+        self.feature_cols = feature_cols
+        self.model_version = model_version
+        self.audit_log = audit_log
+        self._model_lock = threading.Lock()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._closed_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, rows):
+        """提交一组患者特征 (n, n_features)，返回Future，结果为每个患者的结果字典列表"""
+        future = Future()
+        with self._closed_lock:
+            if self._closed:
+                raise RuntimeError("Scoring service is shutting down")
+            self._queue.put((np.asarray(rows, dtype=float), future))
+        return future
+
+    def close(self, timeout=None):
+        """停止接收新请求，等待队列中已提交的批次评分完成（其审计记录在此之前已放入审计队列）"""
+        with self._closed_lock:
+            if not self._closed:
+                self._closed = True
+                # 结束标记排在所有已提交的请求之后
+                self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _collect(self):
+        """
+        阻塞等待第一个请求，然后在时间窗口内继续收集，直到达到批次上限
+
+        返回 (请求列表, 是否收到结束标记)
+        """
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        items = [first]
+        n_rows = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while n_rows < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                return items, True
+            items.append(item)
+            n_rows += len(item[0])
+        return items, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            items, stopping = self._collect()
+            if not items:
+                continue
+            try:
+                results = self._score(np.vstack([rows for rows, _ in items]))
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for rows, future in items:
+                future.set_result(results[start:start + len(rows)])
+                start += len(rows)
+
+    def set_model(self, model, explainer, feature_cols, model_version=None):
+        """切换到新发布的模型，之后的批次使用新模型"""
+        with self._model_lock:
+            self.model, self.explainer, self.feature_cols = model, explainer, feature_cols
+            self.model_version = model_version
+
+    def _score(self, X):
+        """一次向量化调用完成整批的预测和解释"""
+        with self._model_lock:
+            model, explainer, feature_cols, model_version = self.model, self.explainer, self.feature_cols, self.model_version
+        with stage('predict'):
+            risk_scores = model.predict_proba(X)[:, 1] * 100
+        shap_matrix, base_value = positive_class_shap(explainer, X)
+        with stage('format_results'):
+            results = []
+            levels = []
+            for score, shap_row in zip(risk_scores, shap_matrix):
+                level, _ = risk_level(score)
+                levels.append(level)
+                results.append({
+                    'risk_score': round(float(score), 4),
+                    'risk_level': level,
+                    'base_value': base_value,
+                    'shap_values': dict(zip(feature_cols, map(float, shap_row))),
+                })
+        if self.audit_log is not None:
+            with stage('audit_enqueue'):
+                self.audit_log.record_batch('service', model_version, feature_cols, X, risk_scores / 100, levels,
+                                            shap_matrix[:, :len(feature_cols)], base_value)
+        return results
+
+
+def parse_patients(payload, feature_cols):
+    """解析请求体：单个患者对象，或 {"patients": [...]} 列表"""
+    patients = payload.get('patients', [payload]) if isinstance(payload, dict) else payload
+    if not isinstance(patients, list) or not patients:
+        raise ValueError("Request body must be a patient object or {\"patients\": [...]}")
+    rows = []
+    for i, patient in enumerate(patients):
+        missing = [col for col in feature_cols if col not in patient]
+        if missing:
+            raise ValueError(f"Patient {i} is missing features: {', '.join(missing)}")
+        try:
+            rows.append([float(patient[col]) for col in feature_cols])
+        except (TypeError, ValueError):
+            raise ValueError(f"Patient {i} has non-numeric feature values")
+    return rows
+
+
+class ScoringServer(ThreadingHTTPServer):
+    """并发连接较多时需要更大的监听队列"""
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def make_handler(runtime, max_batch_size=64, max_wait_ms=5.0, request_timeout=30.0):
+    """
+    创建绑定了模型运行时的请求处理类；模型就绪后才创建批处理器，共享存储发布新模型后切换批处理器的模型
+
+    退出前调用处理类的close_batcher()，等待已提交的批次评分完成
+    """
+    batcher = None
+    closed = False
+    batcher_lock = threading.Lock()
+
+    def get_batcher():
+        nonlocal batcher
+        runtime.check_for_update()
+        forest, explainer, feature_cols, model_version = runtime.snapshot()
+        with batcher_lock:
+            if closed:
+                raise RuntimeError("Scoring service is shutting down")
+            if batcher is None:
+                batcher = MicroBatcher(forest, explainer, feature_cols, max_batch_size, max_wait_ms,
+                                       model_version=model_version, audit_log=get_audit_log())
+            elif batcher.model is not forest:
+                batcher.set_model(forest, explainer, feature_cols, model_version)
+            return batcher
+
+    def close_batcher(timeout=None):
+        nonlocal closed
+        with batcher_lock:
+            closed = True
+        if batcher is not None:
+            batcher.close(timeout)
+
+    class ScoringHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status, body):
+            with stage('serialize'):
+                data = json.dumps(body).encode('utf-8')
+            self._send(status, data, "application/json")
+
+        def _send(self, status, data, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _require_ready(self):
+            """模型未就绪时返回503"""
+            if runtime.ready:
+                return True
+            self._send_json(503, {'error': f"Model is {runtime.state}", **runtime.status()})
+            return False
+
+        def do_GET(self):
+            if self.path == '/health':
+                # 存活探针：加载期间也返回200，只有加载失败时返回503
+                status = runtime.status()
+                self._send_json(503 if status['status'] == FAILED else 200, status)
+            elif self.path == '/ready':
+                # 就绪探针：模型加载并预热完成后返回200
+                self._send_json(200 if runtime.ready else 503, runtime.status())
+            elif self.path == '/metrics':
+                # Prometheus文本格式的分阶段延迟直方图和计数器
+                self._send(200, REGISTRY.render().encode('utf-8'), "text/plain; version=0.0.4; charset=utf-8")
+            elif self.path == '/features':
+                if self._require_ready():
+                    self._send_json(200, {'feature_cols': runtime.feature_cols})
+            else:
+                self._send_json(404, {'error': 'Not found'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._send_json(404, {'error': 'Not found'})
+                return
+            with RequestTimer('service', 'predict'):
+                self._predict()
+
+        def _predict(self):
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'null')
+            except (ValueError, AttributeError) as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            if not self._require_ready():
+                return
+            try:
+                with stage('parse'):
+                    rows = parse_patients(payload, runtime.feature_cols)
+            except (ValueError, AttributeError) as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            # 输入漂移监测（只放入队列，由后台线程计数）
+            drift_monitor = monitor_for(runtime.artifact)
+            if drift_monitor is not None:
+                drift_monitor.observe(rows)
+            try:
+                # 排队等待加上所在批次的评分（批次内各阶段由批处理线程单独记录）
+                with stage('batch_wait'):
+                    results = get_batcher().submit(rows).result(timeout=request_timeout)
+            except Exception as e:
+                self._send_json(500, {'error': f"Scoring failed: {e}"})
+                return
+            self._send_json(200, {'results': results})
+
+        def log_message(self, format, *args):
+            # 高并发时不逐条打印访问日志
+            pass
+
+    ScoringHandler.close_batcher = staticmethod(close_batcher)
+    return ScoringHandler
+
+
+def _report_ready(runtime):
+    try:
+        runtime.wait()
+        status = runtime.status()
+        print(f"✓ 模型就绪 (版本 {status['model_version']}, 共{status['n_estimators']}棵树, "
+              f"{len(runtime.feature_cols)}个特征, 用时{status['load_seconds']:.1f}s)")
+    except Exception as e:
+        print(f"✗ 模型加载失败: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sepsis risk scoring HTTP service")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8000)))
+    parser.add_argument('--model', default=None, help="模型包路径（默认rf_model.bin，或环境变量MODEL_ARTIFACT）")
+    parser.add_argument('--store-dir', default=None,
+                        help="共享模型存储目录（默认环境变量MODEL_STORE_DIR；设置后从共享内存附加模型并跟随新发布的模型）")
+    parser.add_argument('--max-batch-size', type=int, default=64, help="每个批次的最大样本数")
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help="收集批次的最长等待时间（毫秒）")
+    args = parser.parse_args()
+
+    # 先启动后台加载再开始监听，加载期间/health立即响应，/ready返回503
+    runtime = ModelRuntime(args.model, store_dir=args.store_dir).start()
+    handler = make_handler(runtime, args.max_batch_size, args.max_wait_ms)
+    server = ScoringServer((args.host, args.port), handler)
+    print(f"评分服务已启动: http://{args.host}:{args.port}/predict (模型后台加载中，就绪探针 /ready)")
+    threading.Thread(target=_report_ready, args=(runtime,), daemon=True).start()
+
+    # SIGTERM（docker stop / Kubernetes）时与Ctrl+C一样正常退出；默认处理不执行atexit，审计日志会丢失
+    # shutdown()等待serve_forever返回，必须在其他线程中调用
+    def _terminate(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # 停止接收连接；批处理器不再接收新请求并评分完已提交的批次（处理线程是守护线程，
+        # server_close()不等待它们），之后才关闭审计日志，写完队列中的全部记录
+        server.server_close()
+        handler.close_batcher()
+        audit_log = get_audit_log()
+        if audit_log is not None:
+            audit_log.close()
+
+
+if __name__ == "__main__":
+    main()
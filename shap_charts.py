@@ -0,0 +1,156 @@
+"""
+SHAP力图、瀑布图和贡献图的Altair（Vega-Lite）图表
+
+服务器端只整理20个特征的SHAP值、特征值和基准值，图表在浏览器中绘制，
+不在服务器上用matplotlib栅格化。需要导出静态图片时使用shap_plots。
+"""
+import altair as alt
+import numpy as np
+import pandas as pd
+
+# 与shap默认配色一致：推高风险为红色，降低风险为蓝色
+POSITIVE_COLOR = '#ff0051'
+NEGATIVE_COLOR = '#008bfb'
+_SIGN_SCALE = alt.Scale(domain=['Increases risk', 'Decreases risk'], range=[POSITIVE_COLOR, NEGATIVE_COLOR])
+
+
+def contribution_frame(shap_values_1d, feature_values, feature_cols):
+    """每个特征的SHAP值、特征值和显示标签，按|SHAP|降序"""
+    shap_values_1d = np.asarray(shap_values_1d, dtype=float)
+    frame = pd.DataFrame({
+        'Feature': list(feature_cols),
+        'SHAP Value': shap_values_1d,
+        'Feature Value': np.asarray(feature_values, dtype=float),
+    })
+    frame['Label'] = [f"{name} = {value:g}" for name, value in zip(frame['Feature'], frame['Feature Value'])]
+    frame['Effect'] = np.where(shap_values_1d >= 0, 'Increases risk', 'Decreases risk')
+    order = np.argsort(-np.abs(shap_values_1d), kind='stable')
+    return frame.iloc[order].reset_index(drop=True)
+
+
+def force_chart(shap_values_1d, expected_value, feature_values, feature_cols, height=140):
+    """
+    力图：从基准值出发，正贡献从左侧推向输出值，负贡献从右侧推回输出值
+
+    横轴为模型输出（正类概率），每个特征占一段，长度为其|SHAP|
+    """
+    frame = contribution_frame(shap_values_1d, feature_values, feature_cols)
+    output = float(expected_value + frame['SHAP Value'].sum())
+
+    positive = frame[frame['SHAP Value'] > 0]
+    negative = frame[frame['SHAP Value'] < 0]
+    # 正贡献段依次排在输出值左侧（大的靠近输出值），负贡献段排在右侧
+    pos_end = output - np.concatenate([[0.0], np.cumsum(positive['SHAP Value'].values)[:-1]])
+    neg_start = output + np.concatenate([[0.0], np.cumsum(-negative['SHAP Value'].values)[:-1]])
+    segments = pd.concat([
+        positive.assign(start=pos_end - positive['SHAP Value'].values, end=pos_end),
+        negative.assign(start=neg_start, end=neg_start - negative['SHAP Value'].values),
+    ], ignore_index=True)
+    segments['row'] = 'f(x)'
+
+    tooltip = ['Label', alt.Tooltip('SHAP Value:Q', format='+.4f')]
+    bars = alt.Chart(segments).mark_bar(stroke='white', strokeWidth=1, height=40).encode(
+        x=alt.X('start:Q', title='Model output (probability)', scale=alt.Scale(zero=False)),
+        x2='end:Q',
+        y=alt.Y('row:N', axis=None),
+        color=alt.Color('Effect:N', scale=_SIGN_SCALE, legend=alt.Legend(orient='top', title=None)),
+        tooltip=tooltip,
+    )
+    # 只给较大的几段标注特征名
+    labels = alt.Chart(segments.head(6)).transform_calculate(
+        mid='(datum.start + datum.end) / 2'
+    ).mark_text(dy=-32, fontSize=11).encode(
+        x='mid:Q', y=alt.Y('row:N', axis=None), text='Label:N', tooltip=tooltip,
+    )
+    markers = pd.DataFrame({
+        'value': [float(expected_value), output],
+        'name': [f"base value = {expected_value:.4f}", f"f(x) = {output:.4f}"],
+    })
+    rules = alt.Chart(markers).mark_rule(strokeDash=[4, 3], color='gray').encode(
+        x='value:Q', tooltip=['name:N'],
+    )
+    rule_labels = alt.Chart(markers).mark_text(dy=40, fontWeight='bold').encode(
+        x='value:Q', text='name:N',
+    )
+    return (bars + labels + rules + rule_labels).properties(height=height)
+
+
+def waterfall_chart(shap_values_1d, expected_value, feature_values, feature_cols, max_display=20):
+    """
+    瀑布图：从基准值开始按|SHAP|从大到小逐个累加，最后到达模型输出
+
+    超过max_display的特征合并为一行
+    """
+    frame = contribution_frame(shap_values_1d, feature_values, feature_cols)
+    if len(frame) > max_display:
+        rest = frame.iloc[max_display - 1:]
+        other = pd.DataFrame({
+            'Feature': ['other'], 'SHAP Value': [rest['SHAP Value'].sum()], 'Feature Value': [np.nan],
+            'Label': [f"{len(rest)} other features"],
+        })
+        other['Effect'] = np.where(other['SHAP Value'] >= 0, 'Increases risk', 'Decreases risk')
+        frame = pd.concat([frame.iloc[:max_display - 1], other], ignore_index=True)
+
+    # 自下而上累加：最不重要的特征在底部紧接基准值，最重要的在顶部到达输出值
+    steps = frame.iloc[::-1].reset_index(drop=True)
+    end = expected_value + np.cumsum(steps['SHAP Value'].values)
+    steps['start'] = end - steps['SHAP Value'].values
+    steps['end'] = end
+    label_order = list(frame['Label'])
+
+    tooltip = ['Label', alt.Tooltip('SHAP Value:Q', format='+.4f'),
+               alt.Tooltip('start:Q', format='.4f'), alt.Tooltip('end:Q', format='.4f')]
+    y = alt.Y('Label:N', sort=label_order, title=None)
+    bars = alt.Chart(steps).mark_bar().encode(
+        x=alt.X('start:Q', title='Model output (probability)', scale=alt.Scale(zero=False)),
+        x2='end:Q',
+        y=y,
+        color=alt.Color('Effect:N', scale=_SIGN_SCALE, legend=alt.Legend(orient='top', title=None)),
+        tooltip=tooltip,
+    )
+    values = alt.Chart(steps).transform_calculate(
+        text="(datum['SHAP Value'] >= 0 ? '+' : '') + format(datum['SHAP Value'], '.4f')",
+        right='max(datum.start, datum.end)',
+    ).mark_text(align='left', dx=3, fontSize=10).encode(x='right:Q', y=y, text='text:N')
+
+    output = float(end[-1]) if len(end) else float(expected_value)
+    markers = pd.DataFrame({
+        'value': [float(expected_value), output],
+        'name': [f"E[f(X)] = {expected_value:.4f}", f"f(x) = {output:.4f}"],
+    })
+    rules = alt.Chart(markers).mark_rule(strokeDash=[4, 3], color='gray').encode(
+        x='value:Q', tooltip=['name:N'],
+    )
+    return (bars + values + rules).properties(height=max(200, 24 * len(steps)))
+
+
+def contribution_chart(shap_values_1d, feature_values, feature_cols):
+    """各特征SHAP值条形图（按|SHAP|排序）"""
+    frame = contribution_frame(shap_values_1d, feature_values, feature_cols)
+    return alt.Chart(frame).mark_bar().encode(
+        x=alt.X('SHAP Value:Q', title='SHAP Value'),
+        y=alt.Y('Feature:N', sort=list(frame['Feature']), title=None),
+        color=alt.Color('Effect:N', scale=_SIGN_SCALE, legend=None),
+        tooltip=['Feature', alt.Tooltip('Feature Value:Q', format='g'), alt.Tooltip('SHAP Value:Q', format='+.4f')],
+    ).properties(height=max(200, 22 * len(frame)))
+
+
+def sensitivity_chart(curves, columns=4, width=160, height=110):
+    """
+    敏感性分析小多图：每个特征一条ICE曲线（其余特征保持当前值时风险随该特征的变化），
+    当前输入值用圆点标出；各图横轴独立
+    """
+    base = alt.Chart(curves)
+    tooltip = ['Feature', alt.Tooltip('Value:Q', format='g'), alt.Tooltip('Risk (%):Q', format='.2f')]
+    line = base.mark_line(color=NEGATIVE_COLOR).encode(
+        x=alt.X('Value:Q', title=None, scale=alt.Scale(zero=False)),
+        y=alt.Y('Risk (%):Q', title='Risk (%)'),
+        tooltip=tooltip,
+    )
+    current = base.transform_filter('datum.Current').mark_point(
+        filled=True, size=70, color=POSITIVE_COLOR, opacity=1.0,
+    ).encode(x='Value:Q', y='Risk (%):Q', tooltip=tooltip)
+    order = list(dict.fromkeys(curves['Feature']))
+    return alt.layer(line, current).properties(width=width, height=height).facet(
+        facet=alt.Facet('Feature:N', sort=order, title=None), columns=columns,
+    ).resolve_scale(x='independent')
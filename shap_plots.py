@@ -0,0 +1,142 @@
+"""
+SHAP力图和瀑布图的渲染（输出PNG字节，便于缓存和复用）
+
+优先使用shap自带的绘图函数，失败时退回条形图/累积图。
+可以在多个线程中同时调用（Streamlit的多个会话）：shap的绘图函数依赖pyplot的全局当前图形，
+在模块级锁内串行执行；替代图用Figure对象绘制，不经过pyplot。
+"""
+import io
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # 非交互式后端
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+import shap
+
+from metrics import FALLBACK_PLOTS
+
+# pyplot的当前图形是进程全局状态，同一时间只允许一个线程通过pyplot绘图
+_PYPLOT_LOCK = threading.Lock()
+
+
+def figure_to_png(fig, dpi=150):
+    """把图像保存为PNG字节"""
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=dpi, bbox_inches='tight', facecolor='white')
+    return buffer.getvalue()
+
+
+@contextmanager
+def pyplot_figure(figsize):
+    """在锁内新建pyplot当前图形并返回；结束时（包括出错时）只关闭本次创建的图形"""
+    with _PYPLOT_LOCK:
+        before = set(plt.get_fignums())
+        try:
+            yield plt.figure(figsize=figsize)
+        finally:
+            for num in set(plt.get_fignums()) - before:
+                plt.close(num)
+
+
+def render_force_plot(shap_values_1d, expected_value, feature_values, feature_cols):
+    """渲染SHAP力图，返回PNG字节"""
+    try:
+        explanation_force = shap.Explanation(
+            values=shap_values_1d,
+            base_values=expected_value,
+            data=np.asarray(feature_values),
+            feature_names=feature_cols
+        )
+        with pyplot_figure((12, 4)):
+            # 尝试使用shap.plots.force (新API v0.20+)
+            try:
+                shap.plots.force(explanation_force, matplotlib=True, show=False)
+            except AttributeError:
+                # 如果shap.plots不存在，尝试旧API
+                shap.force_plot(
+                    expected_value,
+                    shap_values_1d,
+                    pd.Series(feature_values, index=feature_cols),
+                    matplotlib=True,
+                    show=False
+                )
+            return figure_to_png(plt.gcf())
+    except Exception:
+        pass
+
+    # 使用条形图替代
+    FALLBACK_PLOTS.inc(plot='force')
+    shap_df_temp = pd.DataFrame({
+        'Feature': feature_cols,
+        'SHAP Value': shap_values_1d
+    })
+    shap_df_temp = shap_df_temp.sort_values('SHAP Value', key=abs, ascending=False)
+    fig = Figure(figsize=(10, 8))
+    ax = fig.subplots()
+    colors = ['red' if x < 0 else 'blue' for x in shap_df_temp['SHAP Value']]
+    ax.barh(shap_df_temp['Feature'], shap_df_temp['SHAP Value'], color=colors)
+    ax.set_xlabel('SHAP Value', fontsize=12)
+    ax.set_title('SHAP Force Plot - Feature Contribution', fontsize=14, fontweight='bold')
+    ax.axvline(x=0, color='black', linestyle='--', linewidth=0.5)
+    ax.grid(axis='x', alpha=0.3)
+    return figure_to_png(fig)
+
+
+def render_waterfall_plot(shap_values_1d, expected_value, feature_values, feature_cols):
+    """渲染SHAP瀑布图，返回PNG字节"""
+    try:
+        explanation = shap.Explanation(
+            values=shap_values_1d,
+            base_values=expected_value,
+            data=np.asarray(feature_values),
+            feature_names=feature_cols
+        )
+        with pyplot_figure((12, 8)):
+            # 尝试新API
+            try:
+                shap.plots.waterfall(explanation, show=False)
+            except AttributeError:
+                # 如果新API不存在，使用旧API
+                shap.waterfall_plot(explanation, show=False)
+            return figure_to_png(plt.gcf())
+    except Exception:
+        pass
+
+    # 使用累积条形图替代瀑布图
+    FALLBACK_PLOTS.inc(plot='waterfall')
+    shap_df_temp = pd.DataFrame({
+        'Feature': feature_cols,
+        'SHAP Value': shap_values_1d
+    })
+    shap_df_temp = shap_df_temp.sort_values('SHAP Value', ascending=False)
+    shap_df_temp['Cumulative'] = shap_df_temp['SHAP Value'].cumsum() + expected_value
+
+    fig = Figure(figsize=(12, 10))
+    ax1, ax2 = fig.subplots(2, 1)
+
+    # 上：SHAP值条形图
+    colors = ['red' if x < 0 else 'blue' for x in shap_df_temp['SHAP Value']]
+    ax1.bar(range(len(shap_df_temp)), shap_df_temp['SHAP Value'], color=colors)
+    ax1.set_xticks(range(len(shap_df_temp)))
+    ax1.set_xticklabels(shap_df_temp['Feature'], rotation=45, ha='right')
+    ax1.set_ylabel('SHAP Value', fontsize=12)
+    ax1.set_title('SHAP Waterfall Plot - Feature Contribution', fontsize=14, fontweight='bold')
+    ax1.axhline(y=0, color='black', linestyle='--', linewidth=0.5)
+    ax1.grid(axis='y', alpha=0.3)
+
+    # 下：累积值
+    ax2.plot(range(len(shap_df_temp)), shap_df_temp['Cumulative'], marker='o', linewidth=2, markersize=6)
+    ax2.axhline(y=expected_value, color='green', linestyle='--', linewidth=1, label=f'Base Value: {expected_value:.4f}')
+    ax2.set_xticks(range(len(shap_df_temp)))
+    ax2.set_xticklabels(shap_df_temp['Feature'], rotation=45, ha='right')
+    ax2.set_ylabel('Cumulative SHAP Value', fontsize=12)
+    ax2.set_title('Cumulative SHAP Value Change', fontsize=14, fontweight='bold')
+    ax2.legend()
+    ax2.grid(alpha=0.3)
+
+    fig.tight_layout()
+    return figure_to_png(fig)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+按分片并行训练随机森林并合并为一个模型
+
+随机森林的各棵树相互独立：把 n_estimators 棵树分成 n_shards 个分片，每个分片用确定的种子
+（np.random.SeedSequence(base_seed).spawn(n_shards)[i]）训练一个较小的RandomForestClassifier，
+写入共享目录（先写临时文件再原子替换，已完成的分片不重新训练）。分片可以在同一台机器的进程池中运行，
+也可以在多台机器上分别运行（各自用 --shards 选择分片，共享目录为网络挂载的本地路径）。
+每个进程从列式缓存（内存映射）读取训练集，只训练自己分片的树（线程数受 --n-jobs 限制）；
+多台机器分担训练时间，每台机器只需容纳自己进程的训练矩阵。
+
+合并时检查所有分片的参数、训练数据哈希和特征列一致，按分片顺序拼接各分片的树
+（预测为全部树的平均，与一次训练 n_estimators 棵树的森林相同），
+输出 rf_model.pkl、feature_info.pkl、模型包 rf_model.bin（重新生成TreeSHAP路径表）和漂移参考分布。
+分片的划分和种子只取决于 (n_estimators, n_shards, base_seed)，与进程数和机器数无关，结果可复现。
+
+用法:
+    # 单机：4个进程训练8个分片后合并
+    python shard_training.py train --n-shards 8 --workers 4 --shard-dir shards
+    python shard_training.py merge --n-shards 8 --shard-dir shards --output rf_model.bin
+
+    # 多机：共享目录 /mnt/shared/shards，每台机器训练一部分分片，任意一台机器合并
+    python shard_training.py train --n-shards 8 --shards 0-3 --shard-dir /mnt/shared/shards   # 机器A
+    python shard_training.py train --n-shards 8 --shards 4-7 --shard-dir /mnt/shared/shards   # 机器B
+    python shard_training.py merge --n-shards 8 --shard-dir /mnt/shared/shards
+"""
+import argparse
+import copy
+import glob
+import os
+import pickle
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from project_data import (DEFAULT_RF_PARAMS, FEATURE_COLS, PARAMS_PATH, TRAIN_PATH, dataset_columns,
+                          detect_target_col, file_hash, load_dataset, read_rf_params)
+
+DEFAULT_SHARD_DIR = 'shards'
+DEFAULT_BASE_SEED = 42
+
+
+def shard_sizes(n_estimators, n_shards):
+    """每个分片的树数（相差不超过1，多出的树分给前面的分片）"""
+    if not 1 <= n_shards <= n_estimators:
+        raise ValueError(f"n_shards must be between 1 and n_estimators ({n_estimators}), got {n_shards}")
+    base, extra = divmod(n_estimators, n_shards)
+    return [base + (i < extra) for i in range(n_shards)]
+
+
+def shard_seeds(n_shards, base_seed=DEFAULT_BASE_SEED):
+    """每个分片的随机种子（由base_seed派生的相互独立的子序列）"""
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(base_seed).spawn(n_shards)]
+
+
+def shard_path(shard_dir, shard, n_shards):
+    return os.path.join(shard_dir, f"shard-{shard:04d}-of-{n_shards:04d}.pkl")
+
+
+def parse_shards(text, n_shards):
+    """'0-3,6' -> [0, 1, 2, 3, 6]；为空时返回全部分片"""
+    if not text:
+        return list(range(n_shards))
+    shards = set()
+    for part in text.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = part.split('-')
+            shards.update(range(int(start), int(end) + 1))
+        elif part:
+            shards.add(int(part))
+    invalid = [i for i in shards if not 0 <= i < n_shards]
+    if invalid:
+        raise ValueError(f"Shard indices out of range 0..{n_shards - 1}: {sorted(invalid)}")
+    return sorted(shards)
+
+
+def load_rf_params(params_path=PARAMS_PATH):
+    """读取参数文件中的随机森林参数，读取失败时使用默认参数"""
+    import pandas as pd
+
+    try:
+        return read_rf_params(pd.read_excel(params_path))
+    except Exception as e:
+        print(f"读取参数时出错，使用默认参数: {e}")
+        return dict(DEFAULT_RF_PARAMS)
+
+
+def _limit_threads(n_jobs):
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(n_jobs)
+
+
+def train_shard(train_path, target_col, rf_params, shard, n_shards, shard_dir, base_seed=DEFAULT_BASE_SEED,
+                n_jobs=1, feature_cols=FEATURE_COLS, overwrite=False):
+    """
+    训练一个分片并写入共享目录，返回分片信息字典
+
+    分片文件已存在且参数一致时直接返回（可断点续跑；多台机器重复训练同一分片时结果相同）
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    path = shard_path(shard_dir, shard, n_shards)
+    sizes = shard_sizes(rf_params['n_estimators'], n_shards)
+    info = {
+        'shard': shard,
+        'n_shards': n_shards,
+        'n_trees': sizes[shard],
+        'seed': shard_seeds(n_shards, base_seed)[shard],
+        'base_seed': base_seed,
+        'params': dict(rf_params),
+        'feature_cols': list(feature_cols),
+        'target_col': target_col,
+        'train_source': os.path.basename(train_path),
+        'train_hash': file_hash(train_path),
+    }
+    if not overwrite and os.path.exists(path):
+        existing = read_shard(path)[1]
+        if _config(existing) == _config(info):
+            return {**existing, 'skipped': True}
+        raise ValueError(f"{path} was trained with a different configuration; use --overwrite or another --shard-dir")
+
+    data = load_dataset(train_path, list(feature_cols) + [target_col])
+    params = {name: value for name, value in rf_params.items() if name != 'n_estimators'}
+    model = RandomForestClassifier(n_estimators=info['n_trees'], random_state=info['seed'], n_jobs=n_jobs, **params)
+    start = time.perf_counter()
+    model.fit(data[list(feature_cols)], data[target_col])
+    info['fit_seconds'] = time.perf_counter() - start
+    info['host'] = socket.gethostname()
+    info['created_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    os.makedirs(shard_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'info': info, 'model': model}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return info
+
+
+def _config(info):
+    """决定分片内容的配置（合并时必须一致）"""
+    return {key: info[key] for key in ('n_shards', 'base_seed', 'params', 'feature_cols', 'target_col',
+                                       'train_hash')}
+
+
+def read_shard(path):
+    """返回 (RandomForestClassifier, 分片信息)"""
+    with open(path, 'rb') as f:
+        payload = pickle.load(f)
+    return payload['model'], payload['info']
+
+
+def train_shards(train_path, target_col, rf_params, n_shards, shard_dir=DEFAULT_SHARD_DIR, shards=None,
+                 workers=None, n_jobs=None, base_seed=DEFAULT_BASE_SEED, feature_cols=FEATURE_COLS, overwrite=False):
+    """在进程池中训练选中的分片（默认全部），返回分片信息列表"""
+    shards = list(range(n_shards)) if shards is None else list(shards)
+    n_cpus = os.cpu_count() or 1
+    workers = workers or max(1, min(len(shards), n_cpus))
+    n_jobs = n_jobs or max(1, n_cpus // workers)
+    if workers * n_jobs > n_cpus:
+        print(f"⚠ {workers}个进程 × {n_jobs}个线程超过了CPU核数 ({n_cpus})")
+
+    # 先在主进程中生成列式缓存，避免多个进程同时转换源文件
+    dataset_columns(train_path)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_limit_threads, initargs=(n_jobs,)) as pool:
+        futures = [pool.submit(train_shard, train_path, target_col, rf_params, shard, n_shards, shard_dir,
+                               base_seed, n_jobs, feature_cols, overwrite) for shard in shards]
+        for i, future in enumerate(as_completed(futures), 1):
+            info = future.result()
+            results.append(info)
+            status = "已存在，跳过" if info.get('skipped') else f"用时 {info['fit_seconds']:.1f}s"
+            print(f"[{i}/{len(shards)}] 分片 {info['shard']}: {info['n_trees']}棵树, 种子 {info['seed']}, {status}")
+    return sorted(results, key=lambda info: info['shard'])
+
+
+def merge_shards(n_shards, shard_dir=DEFAULT_SHARD_DIR):
+    """
+    按分片顺序合并共享目录中分片总数为n_shards的全部分片（目录中其他分片数的文件不参与）
+
+    返回 (合并后的RandomForestClassifier, 训练信息字典)；分片不完整或配置不一致时抛出ValueError
+    """
+    paths = sorted(glob.glob(os.path.join(shard_dir, f'shard-*-of-{n_shards:04d}.pkl')))
+    if not paths:
+        raise ValueError(f"No shards of {n_shards} found in {shard_dir}")
+    loaded = [read_shard(path) for path in paths]
+    config = _config(loaded[0][1])
+    for path, (_, info) in zip(paths, loaded):
+        if _config(info) != config:
+            raise ValueError(f"{path} does not match the configuration of the other shards")
+    found = sorted(info['shard'] for _, info in loaded)
+    missing = sorted(set(range(n_shards)) - set(found))
+    if missing:
+        raise ValueError(f"Missing shards {missing} of {n_shards} in {shard_dir}")
+    loaded.sort(key=lambda item: item[1]['shard'])
+
+    models = [model for model, _ in loaded]
+    for model, info in loaded:
+        if not np.array_equal(model.classes_, models[0].classes_):
+            raise ValueError(f"Shard {info['shard']} saw classes {model.classes_}, expected {models[0].classes_}")
+
+    # 拼接各分片的树；其余拟合属性（classes_、特征名等）各分片相同
+    merged = copy.copy(models[0])
+    merged.estimators_ = [est for model in models for est in model.estimators_]
+    merged.n_estimators = len(merged.estimators_)
+    merged.random_state = config['base_seed']
+    if merged.n_estimators != config['params']['n_estimators']:
+        raise ValueError(f"Merged forest has {merged.n_estimators} trees, expected {config['params']['n_estimators']}")
+
+    training = {
+        'n_shards': n_shards,
+        'base_seed': config['base_seed'],
+        'seeds': [info['seed'] for _, info in loaded],
+        'n_trees': [info['n_trees'] for _, info in loaded],
+        'hosts': sorted({info.get('host', '') for _, info in loaded}),
+        'fit_seconds': sum(info.get('fit_seconds', 0.0) for _, info in loaded),
+        'train_source': loaded[0][1]['train_source'],
+        'train_hash': config['train_hash'],
+    }
+    return merged, {**config, 'training': training}
+
+
+def write_model(rf_model, info, output='rf_model.bin', train_path=None):
+    """
+    保存合并后的模型：rf_model.pkl、feature_info.pkl、模型包（重新生成TreeSHAP路径表），
+    提供训练集时在模型包旁边写出漂移参考分布。返回模型包元数据
+    """
+    from drift import DriftReference, reference_path
+    from forest_engine import PackedForest
+    from model_artifact import write_artifact
+
+    feature_cols = info['feature_cols']
+    target_col = info['target_col']
+    with open("rf_model.pkl", 'wb') as f:
+        pickle.dump(rf_model, f)
+    with open("feature_info.pkl", 'wb') as f:
+        pickle.dump({'feature_cols': feature_cols, 'target_col': target_col}, f)
+
+    metadata = write_artifact(
+        output,
+        PackedForest.from_sklearn(rf_model),
+        metadata={
+            'feature_cols': list(feature_cols),
+            'target_col': target_col,
+            'params': dict(info['params']),
+            'training': info['training'],
+        },
+    )
+    if train_path is not None:
+        if file_hash(train_path) != info['train_hash']:
+            raise ValueError(f"{train_path} differs from the training data the shards were fitted on")
+        X_train = load_dataset(train_path, list(feature_cols))[list(feature_cols)].to_numpy(dtype=float)
+        DriftReference.from_data(X_train, feature_cols, source=os.path.basename(train_path)).save(
+            reference_path(output))
+    return metadata
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the random forest in seeded shards and merge them")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    train = commands.add_parser('train', help="训练分片（默认全部未完成的分片）")
+    train.add_argument('--n-shards', type=int, required=True, help="分片总数（所有机器必须相同）")
+    train.add_argument('--shards', default=None, help="本机训练的分片，如 0-3,6（默认全部）")
+    train.add_argument('--shard-dir', default=DEFAULT_SHARD_DIR, help="共享分片目录")
+    train.add_argument('--train', default=TRAIN_PATH, help="训练集文件")
+    train.add_argument('--params', default=PARAMS_PATH, help="参数文件（R语言参数名）")
+    train.add_argument('--n-estimators', type=int, default=None, help="覆盖参数文件中的树数")
+    train.add_argument('--base-seed', type=int, default=DEFAULT_BASE_SEED)
+    train.add_argument('--workers', type=int, default=None, help="并行进程数")
+    train.add_argument('--n-jobs', type=int, default=None, help="每个进程的线程数（默认CPU核数/进程数）")
+    train.add_argument('--overwrite', action='store_true', help="重新训练已存在的分片")
+
+    merge = commands.add_parser('merge', help="合并全部分片为一个模型")
+    merge.add_argument('--n-shards', type=int, required=True, help="分片总数（与训练时相同）")
+    merge.add_argument('--shard-dir', default=DEFAULT_SHARD_DIR)
+    merge.add_argument('--output', default='rf_model.bin', help="模型包")
+    merge.add_argument('--train', default=TRAIN_PATH, help="训练集文件（生成漂移参考分布）")
+    merge.add_argument('--no-drift-reference', action='store_true', help="不生成漂移参考分布")
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        rf_params = load_rf_params(args.params)
+        if args.n_estimators:
+            rf_params['n_estimators'] = args.n_estimators
+        target_col = detect_target_col(dataset_columns(args.train))
+        shards = parse_shards(args.shards, args.n_shards)
+        sizes = shard_sizes(rf_params['n_estimators'], args.n_shards)
+        print(f"参数: {rf_params}")
+        print(f"{rf_params['n_estimators']}棵树分为{args.n_shards}个分片（每片{min(sizes)}~{max(sizes)}棵），"
+              f"本机训练分片 {shards}")
+        start = time.perf_counter()
+        train_shards(args.train, target_col, rf_params, args.n_shards, args.shard_dir, shards,
+                     args.workers, args.n_jobs, args.base_seed, overwrite=args.overwrite)
+        print(f"✓ 分片已保存到: {args.shard_dir} (用时 {time.perf_counter() - start:.1f}s)")
+    else:
+        start = time.perf_counter()
+        rf_model, info = merge_shards(args.n_shards, args.shard_dir)
+        metadata = write_model(rf_model, info, args.output, None if args.no_drift_reference else args.train)
+        training = info['training']
+        print(f"✓ 已合并{training['n_shards']}个分片（{rf_model.n_estimators}棵树，分片训练合计 "
+              f"{training['fit_seconds']:.1f}s，机器 {', '.join(training['hosts'])}）")
+        print(f"✓ 模型包已保存到: {args.output} (版本 {metadata['model_version']}, "
+              f"用时 {time.perf_counter() - start:.1f}s)；另见 rf_model.pkl、feature_info.pkl")
+
+
+if __name__ == "__main__":
+    main()
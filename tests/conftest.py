@@ -0,0 +1,72 @@
+"""
+回归测试的公共数据：在合成队列上训练的小随机森林（训练和测试数据都含缺失值）
+
+engine夹具让依赖它的测试分别在numba编译内核和纯NumPy实现上各运行一次。
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from project_data import FEATURE_COLS  # noqa: E402
+from synthetic_data import TARGET_COL, generate_cohort  # noqa: E402
+
+
+def _with_missing(df, fraction, seed):
+    rng = np.random.default_rng(seed)
+    df = df.copy()
+    for col in ('BUN', 'GCS', 'WBC'):
+        df.loc[rng.random(len(df)) < fraction, col] = np.nan
+    return df
+
+
+@pytest.fixture(scope='session')
+def cohort():
+    """(训练集, 测试集特征)；测试集包含一整行缺失的样本"""
+    train = _with_missing(generate_cohort(800, seed=0), 0.05, seed=1)
+    test = _with_missing(generate_cohort(60, seed=2, with_target=False), 0.2, seed=3)[FEATURE_COLS]
+    test.iloc[0] = np.nan
+    return train, test
+
+
+@pytest.fixture(scope='session')
+def sklearn_forest(cohort):
+    from sklearn.ensemble import RandomForestClassifier
+
+    train, _ = cohort
+    model = RandomForestClassifier(n_estimators=12, max_depth=6, min_samples_leaf=5, max_features=6, random_state=0)
+    return model.fit(train[FEATURE_COLS], train[TARGET_COL])
+
+
+@pytest.fixture(scope='session')
+def packed_forest(sklearn_forest):
+    from forest_engine import PackedForest
+
+    return PackedForest.from_sklearn(sklearn_forest)
+
+
+@pytest.fixture(scope='session')
+def explainer(packed_forest):
+    from tree_shap import TreeShapExplainer
+
+    return TreeShapExplainer.from_forest(packed_forest)
+
+
+@pytest.fixture(params=['numba', 'numpy'])
+def engine(request, monkeypatch):
+    """'numba'使用编译内核（未安装numba时跳过）；'numpy'强制使用纯NumPy实现"""
+    import forest_engine
+    import quantized_forest
+    import tree_shap
+
+    if request.param == 'numba':
+        if forest_engine.njit is None:
+            pytest.skip("numba is not installed")
+    else:
+        monkeypatch.setattr(forest_engine, 'njit', None)
+        monkeypatch.setattr(quantized_forest, 'njit', None)
+        monkeypatch.setattr(tree_shap, 'njit', None)
+    return request.param
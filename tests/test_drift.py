@@ -0,0 +1,69 @@
+"""PSI/KS在已知直方图上的取值，以及参考分布对同分布样本和偏移样本的判断"""
+import numpy as np
+import pytest
+
+from drift import PSI_ALERT, PSI_EPSILON, PSI_WARNING, DriftMonitor, DriftReference, ks, psi
+from project_data import FEATURE_COLS
+from synthetic_data import generate_cohort
+
+# 10个等比例的范围内箱，两端为超出范围的空箱
+UNIFORM = np.array([0] + [100] * 10 + [0])
+
+
+def test_identical_distributions_score_zero():
+    assert psi(UNIFORM, UNIFORM) == 0.0
+    assert ks(UNIFORM, UNIFORM) == 0.0
+    # 只与比例有关，与样本数无关
+    assert psi(UNIFORM, 3 * UNIFORM) == pytest.approx(0.0, abs=1e-12)
+    assert ks(UNIFORM, 3 * UNIFORM) == pytest.approx(0.0, abs=1e-12)
+
+
+def test_known_shift():
+    # 全部数据集中到前5箱：这5箱比例0.1 -> 0.2，后5箱0.1 -> 0（按PSI_EPSILON计算）
+    shifted = np.array([0] + [200] * 5 + [0] * 5 + [0])
+    expected = 5 * 0.1 * np.log(2) + 5 * (PSI_EPSILON - 0.1) * np.log(PSI_EPSILON / 0.1)
+    assert psi(UNIFORM, shifted) == pytest.approx(expected, rel=1e-12)
+    assert ks(UNIFORM, shifted) == pytest.approx(0.5, abs=1e-12)
+
+
+def test_out_of_range_mass_is_not_merged_away():
+    # 参考分布集中在一箱时，超出上限的数据仍然计入
+    reference = np.array([0, 0, 1000, 0, 0])
+    current = np.array([0, 0, 500, 0, 500])
+    assert psi(reference, current) > PSI_ALERT
+    assert ks(reference, current) == pytest.approx(0.5, abs=1e-12)
+
+
+def test_empty_counts_are_nan():
+    assert np.isnan(psi(UNIFORM, np.zeros_like(UNIFORM)))
+    assert np.isnan(ks(np.zeros_like(UNIFORM), UNIFORM))
+
+
+@pytest.fixture(scope='module')
+def reference():
+    X = generate_cohort(3000, seed=0)[FEATURE_COLS].to_numpy(dtype=float)
+    return DriftReference.from_data(X, FEATURE_COLS)
+
+
+def test_reference_flags_only_the_shifted_feature(reference):
+    current = generate_cohort(3000, seed=5)[FEATURE_COLS]
+    table = reference.compare(reference.layout.bin_counts(current.to_numpy(dtype=float))).set_index('Feature')
+    assert (table['PSI'] < PSI_WARNING).all()
+
+    current['SODIUM'] += 8
+    table = reference.compare(reference.layout.bin_counts(current.to_numpy(dtype=float))).set_index('Feature')
+    assert table.loc['SODIUM', 'PSI'] > PSI_ALERT
+    assert table.loc['SODIUM', 'KS'] > 0.3
+    assert table.loc['SODIUM', 'Current Median'] - table.loc['SODIUM', 'Reference Median'] == pytest.approx(8, abs=1)
+    assert (table.drop(index='SODIUM')['PSI'] < PSI_WARNING).all()
+
+
+def test_monitor_matches_direct_counts(reference):
+    current = generate_cohort(500, seed=6)[FEATURE_COLS]
+    monitor = DriftMonitor(reference)
+    for start in range(0, len(current), 64):
+        monitor.observe(current.iloc[start:start + 64])
+    monitor.flush()
+    assert monitor.recent_observations() == len(current)
+    expected = reference.compare(reference.layout.bin_counts(current.to_numpy(dtype=float)))
+    np.testing.assert_allclose(monitor.scores()[['PSI', 'KS']], expected[['PSI', 'KS']], rtol=0, atol=0)
@@ -0,0 +1,70 @@
+"""向量化bootstrap评估的指标与sklearn在同一重抽样上的结果一致"""
+import numpy as np
+import pytest
+from sklearn.metrics import average_precision_score, brier_score_loss, roc_auc_score
+
+from evaluation import bootstrap_evaluation, bootstrap_weights, weighted_metrics
+
+
+@pytest.fixture(scope='module')
+def scores():
+    rng = np.random.default_rng(0)
+    y = (rng.random(300) < 0.3).astype(int)
+    # 取值四舍五入到两位小数，产生大量同分
+    proba = np.round(np.clip(0.3 + 0.3 * (y - 0.3) + rng.normal(0, 0.2, len(y)), 0, 1), 2)
+    return proba, y
+
+
+def test_unit_weights_match_sklearn(scores):
+    proba, y = scores
+    metrics, curve = weighted_metrics(proba, y, np.ones((1, len(y))))
+    assert metrics['AUC'][0] == pytest.approx(roc_auc_score(y, proba), abs=1e-12)
+    assert metrics['AUPRC'][0] == pytest.approx(average_precision_score(y, proba), abs=1e-12)
+    assert metrics['Brier'][0] == pytest.approx(brier_score_loss(y, proba), abs=1e-12)
+    assert metrics['Prevalence'][0] == pytest.approx(y.mean(), abs=1e-12)
+    assert curve['count'].sum() == len(y)
+
+
+def test_bootstrap_weights_match_resampled_sklearn(scores):
+    proba, y = scores
+    weights = next(bootstrap_weights(len(y), 20, chunk_size=20, seed=1))
+    assert weights.shape == (20, len(y))
+    assert (weights.sum(axis=1) == len(y)).all()
+    metrics, _ = weighted_metrics(proba, y, weights)
+    for b in range(len(weights)):
+        sample = np.repeat(np.arange(len(y)), weights[b])
+        assert metrics['AUC'][b] == pytest.approx(roc_auc_score(y[sample], proba[sample]), abs=1e-12)
+        assert metrics['AUPRC'][b] == pytest.approx(average_precision_score(y[sample], proba[sample]), abs=1e-12)
+        assert metrics['Brier'][b] == pytest.approx(brier_score_loss(y[sample], proba[sample]), abs=1e-12)
+
+
+def test_bootstrap_evaluation_table(scores):
+    proba, y = scores
+    table, calibration = bootstrap_evaluation(proba, y, n_boot=200, chunk_size=64, seed=0)
+    assert list(table['metric']) == ['AUC', 'AUPRC', 'Brier', 'ECE', 'Prevalence']
+    assert (table['ci_low'] <= table['estimate']).all() and (table['estimate'] <= table['ci_high']).all()
+    assert calibration['n'].sum() == len(y)
+    # 同一种子结果可复现
+    again, _ = bootstrap_evaluation(proba, y, n_boot=200, chunk_size=64, seed=0)
+    np.testing.assert_array_equal(table[['ci_low', 'ci_high']].to_numpy(), again[['ci_low', 'ci_high']].to_numpy())
+
+
+def test_single_class_is_rejected(scores):
+    proba, _ = scores
+    with pytest.raises(ValueError):
+        bootstrap_evaluation(proba, np.zeros(len(proba)), n_boot=10)
+
+
+@pytest.mark.parametrize('labels', [(1, 2), (-1, 1), ('no', 'yes')])
+def test_non_binary_labels_are_rejected(scores, labels):
+    proba, y = scores
+    with pytest.raises(ValueError, match='0/1'):
+        bootstrap_evaluation(proba, np.where(y == 1, labels[1], labels[0]), n_boot=10)
+
+
+def test_boolean_and_float_labels_are_accepted(scores):
+    proba, y = scores
+    expected, _ = bootstrap_evaluation(proba, y, n_boot=10)
+    for labels in (y.astype(bool), y.astype(float)):
+        table, _ = bootstrap_evaluation(proba, labels, n_boot=10)
+        np.testing.assert_allclose(table['estimate'], expected['estimate'])
@@ -0,0 +1,34 @@
+"""PackedForest的预测与sklearn RandomForestClassifier一致（含缺失值）"""
+import numpy as np
+
+
+def test_predict_proba_matches_sklearn(engine, sklearn_forest, packed_forest, cohort):
+    _, X = cohort
+    expected = sklearn_forest.predict_proba(X)
+    np.testing.assert_allclose(packed_forest.predict_proba(X), expected, rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(packed_forest.predict(X), sklearn_forest.predict(X))
+
+
+def test_apply_matches_sklearn_leaves(engine, sklearn_forest, packed_forest, cohort):
+    _, X = cohort
+    leaves = packed_forest.apply(X)
+    expected = sklearn_forest.apply(X) + packed_forest.roots.astype(np.intp)
+    np.testing.assert_array_equal(leaves, expected)
+    for i in range(len(X)):
+        assert packed_forest.proba_from_leaves(leaves[i]) == packed_forest.predict_proba(X.iloc[[i]])[0, 1]
+
+
+def test_select_trees_matches_sub_forest(engine, sklearn_forest, packed_forest, cohort):
+    _, X = cohort
+    trees = [1, 4, 7, 10]
+    expected = np.mean([sklearn_forest.estimators_[t].predict_proba(X.to_numpy(dtype=np.float32))[:, 1]
+                        for t in trees], axis=0)
+    subset = packed_forest.select_trees(trees)
+    assert subset.n_estimators == len(trees)
+    np.testing.assert_allclose(subset.predict_proba(X)[:, 1], expected, rtol=0, atol=1e-12)
+
+
+def test_column_order_follows_feature_names(packed_forest, cohort):
+    _, X = cohort
+    shuffled = X[X.columns[::-1]]
+    np.testing.assert_array_equal(packed_forest.predict_proba(shuffled), packed_forest.predict_proba(X))
@@ -0,0 +1,51 @@
+"""模型包的保存/加载往返一致，头部校验魔数和格式版本，数组按64字节对齐且直接引用映射内存"""
+import numpy as np
+import pytest
+
+from model_artifact import _PREAMBLE, ALIGNMENT, FORMAT_VERSION, MAGIC, open_artifact, read_header, write_artifact
+
+
+@pytest.fixture(scope='module')
+def artifact_path(packed_forest, explainer, tmp_path_factory):
+    path = tmp_path_factory.mktemp('artifact') / 'rf_model.bin'
+    write_artifact(str(path), packed_forest, explainer, metadata={'target_col': 'SPESIS'})
+    return path
+
+
+def test_roundtrip_predictions_are_identical(engine, packed_forest, explainer, artifact_path, cohort):
+    _, X = cohort
+    artifact = open_artifact(str(artifact_path))
+    np.testing.assert_array_equal(artifact.forest.predict_proba(X), packed_forest.predict_proba(X))
+    np.testing.assert_array_equal(artifact.explainer.shap_values(X), explainer.shap_values(X))
+    assert artifact.explainer.expected_value == explainer.expected_value
+    assert list(artifact.forest.feature_names_in_) == list(packed_forest.feature_names_in_)
+    assert artifact.metadata['target_col'] == 'SPESIS'
+    assert artifact.metadata['n_estimators'] == packed_forest.n_estimators
+
+
+def test_model_version_depends_only_on_arrays(packed_forest, explainer, artifact_path, tmp_path):
+    again = write_artifact(str(tmp_path / 'again.bin'), packed_forest, explainer)
+    assert again['model_version'] == open_artifact(str(artifact_path)).model_version
+    subset = write_artifact(str(tmp_path / 'subset.bin'), packed_forest.select_trees([0, 1, 2]))
+    assert subset['model_version'] != again['model_version']
+
+
+def test_arrays_are_aligned_zero_copy_views(artifact_path):
+    artifact = open_artifact(str(artifact_path))
+    header = read_header(artifact._buffer)
+    assert all(spec['offset'] % ALIGNMENT == 0 for spec in header['arrays'].values())
+    for array in (artifact.forest.threshold, artifact.forest.value, artifact.explainer.path_lo):
+        assert array.ctypes.data % ALIGNMENT == 0
+        assert not array.flags.writeable
+
+
+@pytest.mark.parametrize('magic, version, message', [(b'NOTMODEL', FORMAT_VERSION, 'Not a sepsis model'),
+                                                     (MAGIC, FORMAT_VERSION + 1, 'format version')])
+def test_header_is_validated(artifact_path, tmp_path, magic, version, message):
+    data = bytearray(artifact_path.read_bytes())
+    header_len = _PREAMBLE.unpack_from(data, 0)[2]
+    _PREAMBLE.pack_into(data, 0, magic, version, header_len)
+    path = tmp_path / 'corrupt.bin'
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match=message):
+        open_artifact(str(path))
@@ -0,0 +1,19 @@
+"""量化森林与完整精度森林落入相同的叶节点，正类概率误差不超过error_bound"""
+import numpy as np
+import pytest
+
+from quantized_forest import quantize_forest
+
+
+@pytest.mark.parametrize('bits', [8, 16])
+def test_predictions_within_error_bound(engine, packed_forest, cohort, bits):
+    train, X = cohort
+    qforest, _ = quantize_forest(packed_forest, value_bits=bits)
+    assert qforest.error_bound == pytest.approx(1 / (2 * ((1 << bits) - 1)))
+    # 阈值无损：每个样本在每棵树中落入的叶节点不变
+    for data in (X, train[X.columns]):
+        np.testing.assert_array_equal(qforest.apply(data), packed_forest.apply(data))
+        diff = np.abs(qforest.predict_proba(data) - packed_forest.predict_proba(data))
+        assert diff.max() <= qforest.error_bound + 1e-12
+    np.testing.assert_array_equal(qforest.predict_proba(X)[:, 1],
+                                  [qforest.proba_from_leaves(leaves) for leaves in qforest.apply(X)])
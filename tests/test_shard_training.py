@@ -0,0 +1,65 @@
+"""分片训练的合并：合并后的森林与各分片的树相同，预测等于各分片按树数加权的平均"""
+import numpy as np
+import pytest
+
+from project_data import FEATURE_COLS
+from shard_training import merge_shards, read_shard, shard_path, shard_seeds, shard_sizes, train_shard
+from synthetic_data import TARGET_COL
+
+RF_PARAMS = {'n_estimators': 12, 'max_depth': 6, 'min_samples_split': 2, 'min_samples_leaf': 5, 'max_features': 6}
+
+
+@pytest.fixture
+def shard_dir(cohort, tmp_path, monkeypatch):
+    # 列式缓存写在当前目录下
+    monkeypatch.chdir(tmp_path)
+    train, _ = cohort
+    train.to_csv('train.csv', index=False)
+    for shard in range(3):
+        train_shard('train.csv', TARGET_COL, RF_PARAMS, shard, 3, 'shards')
+    return tmp_path / 'shards'
+
+
+def _trees_equal(a, b):
+    return all(np.array_equal(getattr(a.tree_, name), getattr(b.tree_, name))
+               for name in ('feature', 'threshold', 'children_left', 'children_right', 'value'))
+
+
+def test_merge_concatenates_shard_trees(shard_dir, cohort):
+    _, X = cohort
+    merged, info = merge_shards(3, str(shard_dir))
+    shards = [read_shard(shard_path(str(shard_dir), shard, 3)) for shard in range(3)]
+    assert merged.n_estimators == RF_PARAMS['n_estimators']
+    assert info['training']['n_trees'] == shard_sizes(RF_PARAMS['n_estimators'], 3) == [4, 4, 4]
+    assert info['training']['seeds'] == shard_seeds(3)
+    trees = [tree for model, _ in shards for tree in model.estimators_]
+    assert all(_trees_equal(a, b) for a, b in zip(merged.estimators_, trees))
+
+    expected = sum(model.n_estimators * model.predict_proba(X) for model, _ in shards) / RF_PARAMS['n_estimators']
+    np.testing.assert_allclose(merged.predict_proba(X), expected, rtol=0, atol=1e-12)
+
+
+def test_retrained_shard_is_identical(shard_dir):
+    model, _ = read_shard(shard_path(str(shard_dir), 1, 3))
+    info = train_shard('train.csv', TARGET_COL, RF_PARAMS, 1, 3, 'shards')
+    assert info['skipped']
+    train_shard('train.csv', TARGET_COL, RF_PARAMS, 1, 3, 'shards', overwrite=True)
+    again, _ = read_shard(shard_path(str(shard_dir), 1, 3))
+    assert all(_trees_equal(a, b) for a, b in zip(model.estimators_, again.estimators_))
+
+
+def test_merge_ignores_other_shard_counts(shard_dir):
+    for shard in range(2):
+        train_shard('train.csv', TARGET_COL, RF_PARAMS, shard, 2, 'shards')
+    three, _ = merge_shards(3, str(shard_dir))
+    two, _ = merge_shards(2, str(shard_dir))
+    assert three.n_estimators == two.n_estimators == RF_PARAMS['n_estimators']
+
+
+def test_incomplete_or_mismatched_shards_are_rejected(shard_dir):
+    (shard_dir / 'shard-0002-of-0003.pkl').unlink()
+    with pytest.raises(ValueError, match='Missing shards'):
+        merge_shards(3, str(shard_dir))
+    train_shard('train.csv', TARGET_COL, {**RF_PARAMS, 'max_depth': 3}, 2, 3, 'shards')
+    with pytest.raises(ValueError, match='does not match'):
+        merge_shards(3, str(shard_dir))
@@ -0,0 +1,38 @@
+"""TreeShapExplainer与shap.TreeExplainer一致（含缺失值），且满足可加性"""
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope='module')
+def reference_shap(sklearn_forest, cohort):
+    shap = pytest.importorskip('shap')
+    _, X = cohort
+    reference = shap.TreeExplainer(sklearn_forest)
+    values = np.asarray(reference.shap_values(X, check_additivity=False))
+    # 不同版本的shap返回 (n_classes, n, f) 列表或 (n, f, n_classes) 数组，取正类
+    values = values[1] if values.shape[0] == 2 else values[..., 1]
+    return values, float(np.ravel(reference.expected_value)[1])
+
+
+def test_shap_values_match_shap(engine, explainer, reference_shap, cohort):
+    _, X = cohort
+    values, expected_value = reference_shap
+    np.testing.assert_allclose(explainer.shap_values(X), values, rtol=0, atol=1e-12)
+    assert explainer.expected_value == pytest.approx(expected_value, abs=1e-12)
+
+
+def test_shap_values_are_additive(engine, explainer, packed_forest, cohort):
+    _, X = cohort
+    values = explainer.shap_values(X)
+    np.testing.assert_allclose(explainer.expected_value + values.sum(axis=1), packed_forest.predict_proba(X)[:, 1],
+                               rtol=0, atol=1e-12)
+
+
+def test_tree_contributions_sum_to_shap_values(engine, explainer, packed_forest, cohort):
+    _, X = cohort
+    all_trees = np.arange(packed_forest.n_estimators)
+    for i in (0, 1, 2):
+        contributions = explainer.tree_contributions(X.iloc[[i]], all_trees)
+        assert contributions.shape == (packed_forest.n_estimators, X.shape[1])
+        np.testing.assert_allclose(contributions.sum(axis=0), explainer.shap_values(X.iloc[[i]])[0],
+                                   rtol=0, atol=1e-12)
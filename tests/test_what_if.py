@@ -0,0 +1,29 @@
+"""增量what-if重新评分与完整计算一致，且只重新计算受影响的树"""
+import numpy as np
+
+from what_if import WhatIfSession
+
+
+def test_updates_match_full_recompute(engine, packed_forest, explainer, cohort):
+    _, X = cohort
+    x = X.iloc[1].to_numpy(dtype=float)
+    session = WhatIfSession(packed_forest, explainer, x)
+    rng = np.random.default_rng(0)
+    for step in range(8):
+        x = x.copy()
+        column = rng.integers(len(x))
+        # 在其他患者的取值中选一个（包括缺失值），覆盖路径条件变化和不变化两种情况
+        x[column] = X.iloc[rng.integers(len(X)), column]
+        n_recomputed = session.update(x)
+        assert 0 <= n_recomputed <= packed_forest.n_estimators
+        # 概率按树的顺序累加，与完整计算逐位相同；SHAP值在浮点误差内一致
+        assert session.probability == packed_forest.predict_proba(x.reshape(1, -1))[0, 1]
+        np.testing.assert_allclose(session.shap_values, explainer.shap_values(x.reshape(1, -1))[0],
+                                   rtol=0, atol=1e-12)
+
+
+def test_unchanged_input_recomputes_nothing(packed_forest, explainer, cohort):
+    _, X = cohort
+    x = X.iloc[0].to_numpy(dtype=float)
+    session = WhatIfSession(packed_forest, explainer, x)
+    assert session.update(x.copy()) == 0
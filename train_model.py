@@ -2,45 +2,46 @@ import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
 import pickle
-import shap
 import os
+import subprocess
+import sys
+from forest_engine import PackedForest
+from model_artifact import write_artifact
+from compact_forest import DEFAULT_TOLERANCE, compact_forest
+from drift import DriftReference, reference_path
+from evaluation import bootstrap_evaluation, plot_calibration, print_report
+from shard_training import DEFAULT_SHARD_DIR, merge_shards
+from project_data import (PARAMS_PATH, TRAIN_PATH, TEST_PATH, FEATURE_COLS, DEFAULT_RF_PARAMS,
+                          detect_target_col, read_rf_params, dataset_columns, load_dataset, file_hash)
 
 # 读取最优参数
 print("读取最优参数...")
-params_path = r"Final result终版\最优模型RF参数.xlsx"
+params_path = PARAMS_PATH
 params_df = pd.read_excel(params_path)
 print("参数文件内容:")
 print(params_df)
 
-# 读取训练集
+# 提取特征和目标变量
+feature_cols = FEATURE_COLS
+
+# 读取训练集（第一次读取后转换为列式缓存，之后只映射需要的列）
 print("\n读取训练集...")
-train_path = r"spesis and pi\parameters\smote_nc_mimiciv_train.csv"
-train_df = pd.read_csv(train_path)
+train_path = TRAIN_PATH
+train_columns = dataset_columns(train_path)
+print(f"列名: {train_columns}")
+
+# 检查列名（可能大小写不同），找不到时假设第一列是目标变量
+target_col = detect_target_col(train_columns)
+train_df = load_dataset(train_path, feature_cols + [target_col])
 print(f"训练集形状: {train_df.shape}")
-print(f"列名: {train_df.columns.tolist()}")
 
 # 读取测试集
 print("\n读取测试集...")
-test_path = r"spesis and pi\parameters\mimiciii_test1.xlsx"
-test_df = pd.read_excel(test_path)
+test_path = TEST_PATH
+test_columns = dataset_columns(test_path)
+print(f"列名: {test_columns}")
+test_df = load_dataset(test_path, feature_cols + ([target_col] if target_col in test_columns else []))
 print(f"测试集形状: {test_df.shape}")
-print(f"列名: {test_df.columns.tolist()}")
-
-# 提取特征和目标变量
-feature_cols = ['ANION_GAP', 'BALANCE', 'BS', 'BUN', 'CHLORIDE', 'CR', 'CRRT', 
-                'GCS', 'HGB', 'INRPT', 'MV', 'NBPS', 'NOR', 'OASIS', 'RR', 
-                'SAPSII', 'SODIUM', 'SOFA', 'T', 'WBC']
-
-# 检查列名（可能大小写不同）
-train_cols = train_df.columns.tolist()
-target_col = None
-for col in train_cols:
-    if 'SPESIS' in col.upper() or 'SEPSIS' in col.upper():
-        target_col = col
-        break
-
-if target_col is None:
-    target_col = train_cols[0]  # 假设第一列是目标变量
 
 print(f"\n目标变量列: {target_col}")
 
@@ -59,48 +60,22 @@ print(f"测试集特征形状: {X_test.shape}")
 # 从参数文件中提取最优参数
 # 参数文件使用R语言格式，需要转换为Python格式
 try:
-    # 创建参数字典
-    params_dict = {}
-    for idx, row in params_df.iterrows():
-        charater = str(row['Charater']).strip()
-        value = row['Value']
-        if pd.notna(value):
-            params_dict[charater] = value
-    
-    # 转换R参数到Python参数
-    # num.trees -> n_estimators
-    n_estimators = int(params_dict.get('num.trees', 2500))
-    
-    # max.depth -> max_depth
-    max_depth = int(params_dict.get('max.depth', 50)) if 'max.depth' in params_dict else None
-    
-    # min.node.size -> min_samples_leaf
-    min_samples_leaf = int(params_dict.get('min.node.size', 50))
-    
-    # min.bucket -> min_samples_split
-    min_samples_split = int(params_dict.get('min.bucket', 30))
-    
-    # mtry -> max_features (可以是整数或'sqrt')
-    mtry_val = params_dict.get('mtry', 6)
-    try:
-        max_features = int(float(mtry_val))
-    except (ValueError, TypeError):
-        max_features = 'sqrt'
-        
+    rf_params = read_rf_params(params_df)
     print(f"从参数文件读取的参数:")
-    print(f"  num.trees: {n_estimators}")
-    print(f"  max.depth: {max_depth}")
-    print(f"  min.node.size: {min_samples_leaf}")
-    print(f"  min.bucket: {min_samples_split}")
-    print(f"  mtry: {max_features}")
-        
+    print(f"  num.trees: {rf_params['n_estimators']}")
+    print(f"  max.depth: {rf_params['max_depth']}")
+    print(f"  min.node.size: {rf_params['min_samples_leaf']}")
+    print(f"  min.bucket: {rf_params['min_samples_split']}")
+    print(f"  mtry: {rf_params['max_features']}")
 except Exception as e:
     print(f"读取参数时出错，使用默认参数: {e}")
-    n_estimators = 2500
-    max_depth = 50
-    min_samples_split = 30
-    min_samples_leaf = 50
-    max_features = 6
+    rf_params = dict(DEFAULT_RF_PARAMS)
+
+n_estimators = rf_params['n_estimators']
+max_depth = rf_params['max_depth']
+min_samples_split = rf_params['min_samples_split']
+min_samples_leaf = rf_params['min_samples_leaf']
+max_features = rf_params['max_features']
 
 print(f"\n模型参数:")
 print(f"  n_estimators: {n_estimators}")
@@ -109,19 +84,31 @@ print(f"  min_samples_split: {min_samples_split}")
 print(f"  min_samples_leaf: {min_samples_leaf}")
 print(f"  max_features: {max_features}")
 
-# 训练模型
-print("\n训练随机森林模型...")
-rf_model = RandomForestClassifier(
-    n_estimators=n_estimators,
-    max_depth=max_depth,
-    min_samples_split=min_samples_split,
-    min_samples_leaf=min_samples_leaf,
-    max_features=max_features,
-    random_state=42,
-    n_jobs=-1
-)
-
-rf_model.fit(X_train, y_train)
+# 训练模型（环境变量TRAIN_SHARDS大于1时按分片在多个进程中训练后合并，见 shard_training.py）
+n_shards = int(os.environ.get('TRAIN_SHARDS', '1'))
+training_info = None
+if n_shards > 1:
+    print(f"\n按{n_shards}个分片训练随机森林模型...")
+    shard_dir = os.environ.get('TRAIN_SHARD_DIR', DEFAULT_SHARD_DIR)
+    # 分片在子进程中训练（进程池不能从本脚本的顶层代码中启动）
+    subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shard_training.py'),
+                    'train', '--n-shards', str(n_shards), '--shard-dir', shard_dir, '--train', train_path,
+                    '--params', params_path, '--n-estimators', str(n_estimators)], check=True)
+    rf_model, merged_info = merge_shards(n_shards, shard_dir)
+    training_info = merged_info['training']
+else:
+    print("\n训练随机森林模型...")
+    rf_model = RandomForestClassifier(
+        n_estimators=n_estimators,
+        max_depth=max_depth,
+        min_samples_split=min_samples_split,
+        min_samples_leaf=min_samples_leaf,
+        max_features=max_features,
+        random_state=42,
+        n_jobs=-1
+    )
+
+    rf_model.fit(X_train, y_train)
 print("模型训练完成!")
 
 # 保存模型
@@ -138,16 +125,84 @@ feature_info = {
 with open("feature_info.pkl", 'wb') as f:
     pickle.dump(feature_info, f)
 
-# 创建SHAP解释器
-print("\n创建SHAP解释器...")
-# 使用TreeExplainer（适用于树模型，速度快）
-explainer = shap.TreeExplainer(rf_model)
-shap_values = explainer.shap_values(X_train[:100])  # 使用前100个样本作为背景
-
-# 保存SHAP解释器
-with open("shap_explainer.pkl", 'wb') as f:
-    pickle.dump(explainer, f)
-print("SHAP解释器已保存!")
+# 保存模型包（打包森林 + TreeSHAP路径表，供应用和评分服务mmap加载）
+print("\n生成模型包...")
+packed_forest = PackedForest.from_sklearn(rf_model)
+artifact_metadata = write_artifact(
+    "rf_model.bin",
+    packed_forest,
+    metadata={
+        'feature_cols': list(feature_cols),
+        'target_col': target_col,
+        'params': {
+            'n_estimators': n_estimators,
+            'max_depth': max_depth,
+            'min_samples_split': min_samples_split,
+            'min_samples_leaf': min_samples_leaf,
+            'max_features': max_features,
+        },
+        **({'training': training_info} if training_info else {}),
+    },
+)
+print(f"模型包已保存到: rf_model.bin (版本 {artifact_metadata['model_version']})")
+
+# 输入漂移监测的参考分布（训练集上每个特征的直方图），保存在模型包旁边
+drift_reference = DriftReference.from_data(X_train.to_numpy(dtype=float), feature_cols,
+                                           source=os.path.basename(train_path))
+drift_reference.save(reference_path("rf_model.bin"))
+print(f"漂移参考分布已保存到: {reference_path('rf_model.bin')}")
+
+# 外部测试集评估：测试集评分一次，AUC/AUPRC/Brier/校准曲线及其bootstrap置信区间（向量化重抽样）
+# 结局必须是0/1且两类都出现（例如1/2或Y/N编码的结局不评估，bootstrap_evaluation会拒绝）
+if y_test is not None and set(y_test.unique()) == {0, 1}:
+    print("\n在外部测试集上评估...")
+    test_proba = packed_forest.predict_proba(X_test)[:, 1]
+    metrics_table, calibration = bootstrap_evaluation(test_proba, y_test)
+    print_report(metrics_table, calibration)
+    metrics_table.to_csv("evaluation_report.csv", index=False)
+    calibration.to_csv("calibration_curve.csv", index=False)
+    plot_calibration(calibration, "calibration.png", title=f"Calibration on MIMIC-III ({target_col})")
+    print("评估结果已保存到: evaluation_report.csv, calibration_curve.csv, calibration.png")
+elif y_test is None:
+    print("\n测试集没有结局列，跳过评估")
+else:
+    print(f"\n⚠ 测试集结局取值为 {sorted(map(str, y_test.unique()))}，不是同时包含0和1两类的结局，跳过评估")
+
+# 森林压缩（可选）：环境变量COMPACTION_HOLDOUT指定不参与训练的留出集文件（如单独的验证集或外部测试集），
+# 在其上找出与完整模型概率差不超过容差的最小子森林；模型始终在完整训练集上训练
+holdout_path = os.environ.get('COMPACTION_HOLDOUT')
+if not holdout_path:
+    print("\n未设置COMPACTION_HOLDOUT，跳过森林压缩")
+elif file_hash(holdout_path) == file_hash(train_path):
+    print(f"\n⚠ {holdout_path} 与训练集相同，跳过森林压缩")
+else:
+    holdout_columns = dataset_columns(holdout_path)
+    holdout_df = load_dataset(holdout_path, feature_cols + ([target_col] if target_col in holdout_columns else []))
+    y_holdout = holdout_df[target_col] if target_col in holdout_df.columns else None
+    print(f"\n压缩森林（容差 {DEFAULT_TOLERANCE * 100:.1f} 个百分点，留出集 {holdout_path}: {len(holdout_df)}行）...")
+    compact_model, compact_trees, compaction_report = compact_forest(packed_forest, holdout_df[feature_cols],
+                                                                     DEFAULT_TOLERANCE, y_holdout)
+    print(compaction_report.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    compaction_report.to_csv("compaction_report.csv", index=False)
+    selected = compaction_report[compaction_report['selected']].iloc[0]
+    write_artifact(
+        "rf_model_compact.bin",
+        compact_model,
+        metadata={
+            'feature_cols': list(feature_cols),
+            'target_col': target_col,
+            'compaction': {
+                'source_model_version': artifact_metadata['model_version'],
+                'source_n_estimators': n_estimators,
+                'tolerance': DEFAULT_TOLERANCE,
+                'holdout_source': os.path.basename(holdout_path),
+                'holdout_max_abs_diff': float(selected['max_abs_diff_pp']) / 100,
+                'tree_indices': compact_trees.tolist(),
+            },
+        },
+    )
+    drift_reference.save(reference_path("rf_model_compact.bin"))
+    print(f"压缩模型包已保存到: rf_model_compact.bin ({compact_model.n_estimators}/{n_estimators}棵树)")
 
 print("\n完成!")
 
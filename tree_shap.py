@@ -0,0 +1,447 @@
+"""
+基于打包森林的向量化批量TreeSHAP
+
+直接在PackedForest的节点数组上计算精确的路径依赖TreeSHAP（与shap.TreeExplainer
+的tree_path_dependent算法相同），输出正类的 (n_samples, n_features) SHAP矩阵和标量基准值。
+
+加载时为每个叶节点预计算一次路径表：路径上出现的每个（去重后的）特征、
+该特征的零分支比例（覆盖样本比例之积）以及样本沿该路径前进所需的取值区间 (lo, hi]。
+计算时对每个（样本, 叶节点）只需判断区间并做TreeSHAP的extend/unwind递推。
+"""
+import numpy as np
+
+try:
+    from numba import config as numba_config, njit, prange
+    # 在后台线程中启动并行内核后，TBB线程层会使解释器退出时挂起，优先使用OpenMP
+    numba_config.THREADING_LAYER_PRIORITY = ['omp', 'tbb', 'workqueue']
+except ImportError:  # numba不可用时使用NumPy实现
+    njit = None
+
+# 构建路径表时每批处理的节点数上限，控制 (节点数 × 特征数) 中间数组的内存
+_BUILD_CHUNK_NODES = 1 << 16
+# NumPy实现中每个分块 (样本数 × 叶节点数) 的上限
+_CHUNK_ELEMENTS = 1 << 21
+
+
+def _floor_float32(values):
+    """向下取整到float32：对float32输入 x，x <= t 与 x <= floor32(t) 等价"""
+    rounded = values.astype(np.float32)
+    too_big = rounded.astype(np.float64) > values
+    rounded[too_big] = np.nextafter(rounded[too_big], np.float32(-np.inf))
+    return rounded
+
+
+if njit is not None:
+    @njit(cache=True, inline='always')
+    def _leaf_shap(row, row_has_nan, leaf, leaf_offset, leaf_value, path_feature, path_zero, path_lo, path_hi,
+                   path_nan_ok, pweight, ones, inv_k, out_row):
+        """把一个叶节点对一个样本的SHAP贡献累加到out_row"""
+        start = leaf_offset[leaf]
+        depth = leaf_offset[leaf + 1] - start
+        # 样本是否满足路径上每个特征的全部分裂条件（无分支写法，避免分支预测失败）
+        for j in range(depth):
+            x = row[path_feature[start + j]]
+            ones[j] = np.float64((x > path_lo[start + j]) & (x <= path_hi[start + j]))
+        if row_has_nan:
+            for j in range(depth):
+                if np.isnan(row[path_feature[start + j]]):
+                    ones[j] = np.float64(path_nan_ok[start + j])
+
+        # extend: 依次把路径上的特征加入（第0位为根节点的占位元素）
+        pweight[0] = 1.0
+        for d in range(1, depth + 1):
+            zero = path_zero[start + d - 1]
+            one = ones[d - 1]
+            inv = 1.0 / (d + 1)
+            pweight[d] = 0.0
+            for k in range(d - 1, -1, -1):
+                pweight[k + 1] += one * pweight[k] * (k + 1) * inv
+                pweight[k] = zero * pweight[k] * (d - k) * inv
+
+        # unwind: 每个特征移出路径后的权重之和
+        # 不满足条件(one=0)的特征，权重和与特征无关，只需计算一次
+        value = leaf_value[leaf]
+        scale = depth + 1.0
+        inv_scale = 1.0 / scale
+        zero_total = 0.0
+        for k in range(depth):
+            zero_total += pweight[k] / (depth - k)
+        zero_total *= scale * value
+        for j in range(depth):
+            if ones[j] != 0.0:
+                zero = path_zero[start + j]
+                total = 0.0
+                next_one_portion = pweight[depth]
+                for k in range(depth - 1, -1, -1):
+                    tmp = next_one_portion * scale * inv_k[k]
+                    total += tmp
+                    next_one_portion = pweight[k] - tmp * zero * (depth - k) * inv_scale
+                out_row[path_feature[start + j]] += total * (1.0 - zero) * value
+            else:
+                out_row[path_feature[start + j]] -= zero_total
+
+    @njit(cache=True, parallel=True)
+    def _shap_kernel(X, leaf_offset, leaf_value, path_feature, path_zero, path_lo, path_hi,
+                     path_nan_ok, max_unique_depth, out):
+        n_leaves = leaf_value.shape[0]
+        for i in prange(X.shape[0]):
+            pweight = np.empty(max_unique_depth + 1)
+            ones = np.empty(max_unique_depth)
+            inv_k = 1.0 / np.arange(1, max_unique_depth + 1)
+            row = X[i]
+            row_has_nan = np.isnan(row).any()
+            out_row = out[i]
+            for leaf in range(n_leaves):
+                _leaf_shap(row, row_has_nan, leaf, leaf_offset, leaf_value, path_feature, path_zero, path_lo,
+                           path_hi, path_nan_ok, pweight, ones, inv_k, out_row)
+
+    @njit(cache=True, parallel=True)
+    def _tree_shap_kernel(row, trees, tree_leaf_offset, tree_leaves, leaf_offset, leaf_value, path_feature,
+                          path_zero, path_lo, path_hi, path_nan_ok, max_unique_depth, out):
+        # 单个样本，按树并行：out的第s行为第trees[s]棵树全部叶节点的贡献之和
+        row_has_nan = np.isnan(row).any()
+        for s in prange(trees.shape[0]):
+            pweight = np.empty(max_unique_depth + 1)
+            ones = np.empty(max_unique_depth)
+            inv_k = 1.0 / np.arange(1, max_unique_depth + 1)
+            out_row = out[s]
+            t = trees[s]
+            for k in range(tree_leaf_offset[t], tree_leaf_offset[t + 1]):
+                _leaf_shap(row, row_has_nan, tree_leaves[k], leaf_offset, leaf_value, path_feature, path_zero,
+                           path_lo, path_hi, path_nan_ok, pweight, ones, inv_k, out_row)
+
+
+    @njit(cache=True, parallel=True)
+    def _tree_moments_kernel(X, trees, tree_stratum, tree_leaf_offset, tree_leaves, leaf_offset, leaf_value,
+                             path_feature, path_zero, path_lo, path_hi, path_nan_ok, max_unique_depth,
+                             out_sum, out_sumsq):
+        # 按样本并行：逐棵树计算贡献，按树所在的层累加贡献及其平方（近似SHAP的均值和方差估计）
+        n_features = out_sum.shape[2]
+        for i in prange(X.shape[0]):
+            pweight = np.empty(max_unique_depth + 1)
+            ones = np.empty(max_unique_depth)
+            inv_k = 1.0 / np.arange(1, max_unique_depth + 1)
+            contrib = np.empty(n_features)
+            row = X[i]
+            row_has_nan = np.isnan(row).any()
+            for s in range(trees.shape[0]):
+                t = trees[s]
+                contrib[:] = 0.0
+                for k in range(tree_leaf_offset[t], tree_leaf_offset[t + 1]):
+                    _leaf_shap(row, row_has_nan, tree_leaves[k], leaf_offset, leaf_value, path_feature, path_zero,
+                               path_lo, path_hi, path_nan_ok, pweight, ones, inv_k, contrib)
+                h = tree_stratum[s]
+                for f in range(n_features):
+                    out_sum[i, h, f] += contrib[f]
+                    out_sumsq[i, h, f] += contrib[f] * contrib[f]
+
+
+class TreeShapExplainer:
+    """打包森林上的路径依赖TreeSHAP解释器（正类）"""
+
+    def __init__(self, leaf_offset, leaf_value, leaf_tree, path_feature, path_zero, path_lo, path_hi,
+                 path_nan_ok, expected_value, n_features, feature_names=None):
+        self.leaf_offset = leaf_offset      # 每个叶节点路径在路径表中的起止位置 (n_leaves + 1,)
+        self.leaf_value = leaf_value        # 叶节点正类概率 / 树的数量
+        self.leaf_tree = leaf_tree          # 叶节点所属的树
+        self.path_feature = path_feature    # 路径表：特征编号
+        self.path_zero = path_zero          # 路径表：零分支比例
+        self.path_lo = path_lo              # 路径表：取值区间下界（不含）
+        self.path_hi = path_hi              # 路径表：取值区间上界（含）
+        self.path_nan_ok = path_nan_ok      # 路径表：缺失值是否沿该路径前进
+        self.expected_value = float(expected_value)
+        self.n_features = int(n_features)
+        self.feature_names = None if feature_names is None else list(feature_names)
+
+        depths = np.diff(leaf_offset)
+        self.max_unique_depth = int(depths.max()) if len(depths) else 0
+        # 叶节点按路径长度排序，相同长度的叶节点连续存放（NumPy实现按长度分组计算）
+        self._depth_ranges = [(int(d), int(a), int(b)) for d, a, b in zip(*_runs(depths))]
+
+    @classmethod
+    def from_forest(cls, forest):
+        """从PackedForest构建路径表"""
+        if forest.cover is None:
+            raise ValueError("PackedForest has no node cover; rebuild it with PackedForest.from_sklearn")
+        n_trees = forest.n_estimators
+        n_features = forest.n_features_in_
+        n_nodes = len(forest.value)
+        roots = forest.roots.astype(np.int64)
+        left = forest.left.astype(np.int64)
+        right = forest.right.astype(np.int64)
+        feature = forest.feature.astype(np.int64)
+        is_leaf = left == np.arange(n_nodes)
+
+        # 按树分批，每批的节点编号是连续区间
+        tree_ends = np.append(roots[1:], n_nodes)
+        parts = []
+        first = 0
+        while first < n_trees:
+            last = first + 1
+            while last < n_trees and tree_ends[last] - roots[first] <= _BUILD_CHUNK_NODES:
+                last += 1
+            parts.append(_build_paths(
+                np.arange(first, last), roots[first:last], int(roots[first]), int(tree_ends[last - 1]),
+                is_leaf, feature, forest.threshold, left, right, forest.missing_left, forest.cover, n_features))
+            first = last
+
+        leaf_nodes = np.concatenate([p[0] for p in parts])
+        leaf_tree = np.concatenate([p[1] for p in parts])
+        depths = np.concatenate([p[2] for p in parts])
+        path_cols = [np.concatenate([p[3][k] for p in parts]) for k in range(5)]
+
+        # 叶节点按路径长度稳定排序，并相应重排路径表
+        order = np.argsort(depths, kind='stable')
+        old_starts = np.concatenate([[0], np.cumsum(depths)])[:-1][order]
+        depths = depths[order]
+        new_offsets = np.concatenate([[0], np.cumsum(depths)])
+        path_index = np.arange(new_offsets[-1]) - np.repeat(new_offsets[:-1] - old_starts, depths)
+
+        root_value = forest.value[roots]
+        return cls(
+            leaf_offset=new_offsets.astype(np.int64),
+            leaf_value=forest.value[leaf_nodes[order]] / n_trees,
+            leaf_tree=leaf_tree[order].astype(np.int32),
+            path_feature=path_cols[0][path_index].astype(np.uint16),
+            path_zero=path_cols[1][path_index],
+            path_lo=path_cols[2][path_index],
+            path_hi=path_cols[3][path_index],
+            path_nan_ok=path_cols[4][path_index],
+            expected_value=root_value.mean(),
+            n_features=n_features,
+            feature_names=forest.feature_names_in_,
+        )
+
+    def _as_matrix(self, X):
+        if hasattr(X, 'columns') and self.feature_names is not None:
+            X = X[self.feature_names]
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        return X
+
+    def shap_values(self, X):
+        """计算正类的SHAP值，返回 (n_samples, n_features)"""
+        X = self._as_matrix(X)
+        out = np.zeros((X.shape[0], self.n_features), dtype=np.float64)
+        if njit is not None:
+            _shap_kernel(X, self.leaf_offset, self.leaf_value, self.path_feature, self.path_zero,
+                         self.path_lo, self.path_hi, self.path_nan_ok, self.max_unique_depth, out)
+        else:
+            self._shap_values_numpy(X, out)
+        return out
+
+    def _shap_values_numpy(self, X, out):
+        """NumPy实现：对路径长度相同的一组叶节点同时做extend/unwind递推"""
+        for depth, leaf_start, leaf_stop in self._depth_ranges:
+            if depth == 0:
+                continue
+            a, b = self.leaf_offset[leaf_start], self.leaf_offset[leaf_stop]
+            features = self.path_feature[a:b].reshape(-1, depth).astype(np.intp)
+            zeros = self.path_zero[a:b].reshape(-1, depth)
+            lo = self.path_lo[a:b].reshape(-1, depth)
+            hi = self.path_hi[a:b].reshape(-1, depth)
+            nan_ok = self.path_nan_ok[a:b].reshape(-1, depth)
+            values = self.leaf_value[leaf_start:leaf_stop]
+            # 按特征汇总贡献：路径元素按特征排序后分段求和
+            by_feature = np.argsort(features.ravel(), kind='stable')
+            group_features, group_starts = np.unique(features.ravel()[by_feature], return_index=True)
+
+            chunk = max(1, _CHUNK_ELEMENTS // max(1, features.size))
+            for start in range(0, X.shape[0], chunk):
+                x = X[start:start + chunk][:, features]
+                ones = np.where(np.isnan(x), nan_ok, (x > lo) & (x <= hi)).astype(np.float64)
+                contrib = _unwound_contributions(ones, zeros, depth) * values[None, :, None]
+                contrib = contrib.reshape(len(x), -1)[:, by_feature]
+                out[start:start + chunk, group_features] += np.add.reduceat(contrib, group_starts, axis=1)
+
+    def explain(self, X):
+        """返回 (SHAP矩阵, 基准值)"""
+        return self.shap_values(X), self.expected_value
+
+    def _tree_index(self):
+        """按树分组的叶节点 (每棵树的起止位置, 叶节点编号)，第一次使用时构建"""
+        if getattr(self, '_tree_leaves', None) is None:
+            n_trees = int(self.leaf_tree.max()) + 1 if len(self.leaf_tree) else 0
+            counts = np.bincount(self.leaf_tree, minlength=n_trees)
+            self._tree_leaf_offset = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            self._tree_leaves = np.argsort(self.leaf_tree, kind='stable').astype(np.int64)
+        return self._tree_leaf_offset, self._tree_leaves
+
+    def _feature_paths(self, f):
+        """路径表中特征f的全部元素及其所属叶节点，第一次使用时构建"""
+        if getattr(self, '_feature_path_index', None) is None:
+            path_leaf = np.repeat(np.arange(len(self.leaf_value)), np.diff(self.leaf_offset))
+            by_feature = np.argsort(self.path_feature, kind='stable')
+            bounds = np.searchsorted(self.path_feature[by_feature], np.arange(self.n_features + 1))
+            self._feature_path_index = [(by_feature[a:b], path_leaf[by_feature[a:b]])
+                                        for a, b in zip(bounds[:-1], bounds[1:])]
+        return self._feature_path_index[f]
+
+    def tree_contributions(self, x, tree_indices):
+        """
+        单个样本在指定树上的SHAP值
+
+        返回 (len(tree_indices), n_features)，第s行为第tree_indices[s]棵树的贡献；
+        对全部树求和即为shap_values(x)。
+        """
+        x = self._as_matrix(x)[0]
+        trees = np.asarray(tree_indices, dtype=np.int64)
+        tree_leaf_offset, tree_leaves = self._tree_index()
+        out = np.zeros((len(trees), self.n_features), dtype=np.float64)
+        if njit is not None:
+            _tree_shap_kernel(x, trees, tree_leaf_offset, tree_leaves, self.leaf_offset, self.leaf_value,
+                              self.path_feature, self.path_zero, self.path_lo, self.path_hi, self.path_nan_ok,
+                              self.max_unique_depth, out)
+            return out
+
+        # NumPy实现：取出所选树的叶节点，按路径长度分组计算后累加到对应的行
+        slot = np.full(len(tree_leaf_offset) - 1, -1, dtype=np.intp)
+        slot[trees] = np.arange(len(trees))
+        leaf_slot = slot[self.leaf_tree]
+        for depth, leaf_start, leaf_stop in self._depth_ranges:
+            leaves = leaf_start + np.flatnonzero(leaf_slot[leaf_start:leaf_stop] >= 0)
+            if depth == 0 or len(leaves) == 0:
+                continue
+            path = self.leaf_offset[leaves][:, None] + np.arange(depth)
+            features = self.path_feature[path].astype(np.intp)
+            values = x[features]
+            ones = np.where(np.isnan(values), self.path_nan_ok[path],
+                            (values > self.path_lo[path]) & (values <= self.path_hi[path])).astype(np.float64)
+            contrib = _unwound_contributions(ones[None], self.path_zero[path], depth)[0]
+            np.add.at(out, (np.repeat(leaf_slot[leaves], depth), features.ravel()),
+                      (contrib * self.leaf_value[leaves][:, None]).ravel())
+        return out
+
+    def accumulate_tree_moments(self, X, tree_indices, tree_stratum, out_sum, out_sumsq):
+        """
+        把每个样本在指定树上的SHAP贡献按层累加到 out_sum / out_sumsq (n_samples, n_strata, n_features)
+
+        tree_stratum[s]为第tree_indices[s]棵树所在的层；近似SHAP（approx_shap.py）据此估计均值和方差
+        """
+        X = self._as_matrix(X)
+        trees = np.asarray(tree_indices, dtype=np.int64)
+        tree_stratum = np.asarray(tree_stratum, dtype=np.int64)
+        tree_leaf_offset, tree_leaves = self._tree_index()
+        if njit is not None:
+            _tree_moments_kernel(X, trees, tree_stratum, tree_leaf_offset, tree_leaves, self.leaf_offset,
+                                 self.leaf_value, self.path_feature, self.path_zero, self.path_lo, self.path_hi,
+                                 self.path_nan_ok, self.max_unique_depth, out_sum, out_sumsq)
+            return
+        for i in range(X.shape[0]):
+            contrib = self.tree_contributions(X[i], trees)
+            np.add.at(out_sum[i], tree_stratum, contrib)
+            np.add.at(out_sumsq[i], tree_stratum, contrib * contrib)
+
+    def affected_trees(self, x_old, x_new):
+        """
+        样本从x_old改为x_new后需要重新计算的树
+
+        只有路径表中某个元素的区间判断（样本是否沿该路径前进）发生变化的叶节点，SHAP贡献才会改变；
+        其所属的树之外，其余树的SHAP贡献和样本落入的叶节点都与修改前相同。
+        """
+        x_old = self._as_matrix(x_old)[0]
+        x_new = self._as_matrix(x_new)[0]
+        same = (x_old == x_new) | (np.isnan(x_old) & np.isnan(x_new))
+        trees = []
+        for f in np.flatnonzero(~same):
+            entries, leaves = self._feature_paths(f)
+            flipped = self._path_condition(x_old[f], entries) != self._path_condition(x_new[f], entries)
+            trees.append(self.leaf_tree[leaves[flipped]])
+        return np.unique(np.concatenate(trees)) if trees else np.empty(0, dtype=np.int64)
+
+    def _path_condition(self, value, entries):
+        """一个特征取值是否满足路径表中指定元素的区间条件"""
+        if np.isnan(value):
+            return self.path_nan_ok[entries]
+        return (value > self.path_lo[entries]) & (value <= self.path_hi[entries])
+
+
+def _runs(depths):
+    """已排序数组中每段相同取值的 (值, 起点, 终点)"""
+    if len(depths) == 0:
+        return [], [], []
+    starts = np.flatnonzero(np.diff(depths, prepend=depths[0] - 1))
+    stops = np.append(starts[1:], len(depths))
+    return depths[starts], starts, stops
+
+
+def _unwound_contributions(ones, zeros, depth):
+    """对形状 (n, L, depth) 的ones计算每个路径元素的 权重和 × (one - zero)"""
+    shape = ones.shape[:2]
+    pweight = np.zeros(shape + (depth + 1,))
+    pweight[..., 0] = 1.0
+    for d in range(1, depth + 1):
+        zero = zeros[None, :, d - 1]
+        one = ones[..., d - 1]
+        for k in range(d - 1, -1, -1):
+            pweight[..., k + 1] += one * pweight[..., k] * (k + 1) / (d + 1)
+            pweight[..., k] = zero * pweight[..., k] * (d - k) / (d + 1)
+
+    result = np.empty(ones.shape)
+    for j in range(depth):
+        zero = zeros[None, :, j]
+        one = ones[..., j]
+        is_one = one != 0.0
+        total_one = np.zeros(shape)
+        total_zero = np.zeros(shape)
+        next_one_portion = pweight[..., depth].copy()
+        for k in range(depth - 1, -1, -1):
+            tmp = next_one_portion * (depth + 1) / (k + 1)
+            total_one += tmp
+            next_one_portion = pweight[..., k] - tmp * zero * (depth - k) / (depth + 1)
+            total_zero += pweight[..., k] / zero * (depth + 1) / (depth - k)
+        result[..., j] = np.where(is_one, total_one, total_zero) * (one - zero)
+    return result
+
+
+def _build_paths(tree_ids, roots, node_start, node_stop, is_leaf, feature, threshold, left, right,
+                 missing_left, cover, n_features):
+    """对一批树自顶向下逐层传播路径状态，返回这批树所有叶节点的路径表"""
+    n = node_stop - node_start
+    lo = np.full((n, n_features), -np.inf)
+    hi = np.full((n, n_features), np.inf)
+    zero = np.ones((n, n_features))
+    nan_ok = np.ones((n, n_features), dtype=bool)
+    used = np.zeros((n, n_features), dtype=bool)
+    tree_of = np.empty(n, dtype=np.int64)
+
+    frontier = roots - node_start
+    tree_of[frontier] = tree_ids
+    while len(frontier):
+        parents = frontier[~is_leaf[frontier + node_start]]
+        if len(parents) == 0:
+            break
+        g = parents + node_start
+        f = feature[g]
+        children = []
+        for child_global, go_left in ((left[g], True), (right[g], False)):
+            c = child_global - node_start
+            lo[c] = lo[parents]
+            hi[c] = hi[parents]
+            zero[c] = zero[parents]
+            nan_ok[c] = nan_ok[parents]
+            used[c] = used[parents]
+            tree_of[c] = tree_of[parents]
+            if go_left:
+                hi[c, f] = np.minimum(hi[parents, f], threshold[g])
+            else:
+                lo[c, f] = np.maximum(lo[parents, f], threshold[g])
+            zero[c, f] *= cover[child_global] / cover[g]
+            nan_ok[c, f] &= missing_left[g] == go_left
+            used[c, f] = True
+            children.append(c)
+        frontier = np.concatenate(children)
+
+    leaves = np.flatnonzero(is_leaf[node_start:node_stop])
+    leaf_used = used[leaves]
+    rows, cols = np.nonzero(leaf_used)
+    leaf_rows = leaves[rows]
+    path = (
+        cols,
+        zero[leaf_rows, cols],
+        _floor_float32(lo[leaf_rows, cols]),
+        _floor_float32(hi[leaf_rows, cols]),
+        nan_ok[leaf_rows, cols],
+    )
+    return leaves + node_start, tree_of[leaves], leaf_used.sum(axis=1), path
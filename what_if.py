@@ -0,0 +1,53 @@
+"""
+增量what-if重新评分
+
+医生通常只修改一两个输入（如GCS或NOR）后重新计算。WhatIfSession为一个患者保存
+每棵树落入的叶节点和每棵树的SHAP贡献；修改输入后只重新计算路径条件发生变化的树
+（TreeShapExplainer.affected_trees），其余树的结果直接复用。
+风险概率按树的顺序累加，与完整计算逐位相同；SHAP值为各树贡献之和，与完整计算在浮点误差内一致。
+"""
+import time
+
+import numpy as np
+
+
+class WhatIfSession:
+    """一个患者的增量评分状态"""
+
+    def __init__(self, forest, explainer, x):
+        self.forest = forest
+        self.explainer = explainer
+        start = time.perf_counter()
+        self.x = forest._as_matrix(x)[0].copy()
+        all_trees = np.arange(forest.n_estimators)
+        self.leaves = forest.apply(self.x)[0]
+        self.tree_shap = explainer.tree_contributions(self.x, all_trees)
+        self.n_recomputed = forest.n_estimators
+        self.last_seconds = time.perf_counter() - start
+
+    def update(self, x):
+        """改为新的输入x，只重新计算受影响的树；返回重新计算的树数"""
+        start = time.perf_counter()
+        x_new = self.forest._as_matrix(x)[0].copy()
+        trees = self.explainer.affected_trees(self.x, x_new)
+        if len(trees):
+            self.leaves[trees] = self.forest.apply(x_new, trees)[0]
+            self.tree_shap[trees] = self.explainer.tree_contributions(x_new, trees)
+        self.x = x_new
+        self.n_recomputed = len(trees)
+        self.last_seconds = time.perf_counter() - start
+        return self.n_recomputed
+
+    @property
+    def probability(self):
+        """正类概率（与森林predict_proba的计算方式相同）"""
+        return self.forest.proba_from_leaves(self.leaves)
+
+    @property
+    def shap_values(self):
+        """正类SHAP值 (n_features,)"""
+        return self.tree_shap.sum(axis=0)
+
+    @property
+    def expected_value(self):
+        return self.explainer.expected_value